@@ -3,13 +3,34 @@ import os
 import argparse
 import sqlite3
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import base64
 import time
+import math
 import traceback
-from datetime import datetime
-from functools import partial
+import re
+import gzip
+import zlib
+import io
+import json
+import csv
+import threading
+import queue
+import atexit
+import zipfile
+import xml.etree.ElementTree as ET
+from html import escape as html_escape
+import hashlib
+import uuid
+import tempfile
+from datetime import datetime, timedelta
+from functools import partial, wraps
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from collections import OrderedDict
+from urllib.parse import urlparse
 from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 
 # --- Configurazione Globale ---
 SERVER_HOST = "100.64.205.34"
@@ -19,6 +40,144 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, "timbracart.db")
 ASSETS_DIR = os.path.join(BASE_DIR, "assets")
 
+# Compressione HTTP (risposte e corpi richiesta)
+COMPRESS_MIN_SIZE = 1024  # sotto questa soglia (byte) non conviene comprimere
+COMPRESS_LEVEL = 6
+COMPRESS_MIMETYPES = {
+    'application/json', 'application/x-ndjson', 'application/javascript',
+    'text/plain', 'text/html', 'text/css', 'text/csv', 'image/svg+xml'
+}
+# Media già compressi: non si ricomprimono mai
+COMPRESS_EXCLUDED_EXT = {'.mov', '.mp4', '.png', '.jpg', '.jpeg', '.gif', '.docx', '.xlsx', '.zip', '.gz'}
+MAX_DECOMPRESSED_BODY = 64 * 1024 * 1024  # limite anti zip-bomb sui corpi richiesta
+BROTLI_INPUT_STEP = 16   # byte compressi passati per volta al decompressore (brotli < 1.2)
+
+# Streaming NDJSON (Accept: application/x-ndjson) per le liste grandi
+NDJSON_MIMETYPE = 'application/x-ndjson'
+NDJSON_BATCH = 500  # righe lette dal cursore per ogni chunk inviato
+NDJSON_CLIENT_BATCH = 200  # righe consegnate insieme alla GUI dal thread che legge lo stream
+
+# Audit log persistente (tabella audit_log, scritta da un thread dedicato)
+AUDIT_QUEUE_SIZE = 10000   # eventi in memoria prima della backpressure
+AUDIT_BATCH_SIZE = 500     # eventi massimi per commit di gruppo
+AUDIT_PUT_TIMEOUT = 0.05   # attesa massima (s) di una richiesta se la coda è piena
+
+# Scritture degli endpoint: un solo thread scrittore con commit di gruppo
+WRITE_QUEUE_SIZE = 10000   # operazioni in attesa prima di rispondere 503
+WRITE_BATCH_SIZE = 256     # operazioni massime per transazione
+WRITE_TIMEOUT = 10         # attesa massima (s) di una richiesta per l'esito della sua scrittura
+WRITE_BUSY_TIMEOUT = 30    # attesa (s) del lock se scrive qualcun altro (job, audit, backup)
+
+# Metriche Prometheus esposte su /metrics
+METRICS_PREFIX = 'badgeempire'
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Archivio asset indirizzato per contenuto: assets/blobs/ab/cd/<sha256><ext>
+ASSET_CHUNK_SIZE = 1024 * 1024  # byte letti per volta dall'upload mentre si calcola l'hash
+ASSET_GC_INTERVAL = 3600        # secondi tra due passate del garbage collector
+ASSET_GC_GRACE = 900            # età minima (s) di un blob non referenziato prima di eliminarlo
+ASSET_MAX_AGE = 31536000        # un anno: gli URL versionati (?v=) e i blob non cambiano mai
+ASSET_CACHE_BYTES = 64 * 1024 * 1024  # budget della cache asset lato client
+CHARACTER_EXPIRY_INTERVAL = 900            # secondi tra due archiviazioni dei personaggi scaduti
+CHARACTER_EXPIRY_BATCH = 500               # personaggi archiviati per transazione
+CHARACTER_EXPIRY_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%d/%m/%y')  # expiry_date accettate
+BACHECA_PREFETCH_RADIUS = 2                 # personaggi precaricati prima e dopo quello corrente
+BACHECA_DECODED_BYTES = 48 * 1024 * 1024    # budget delle immagini già decodificate in memoria
+LOCAL_DATA_DIR = os.path.join(os.path.expanduser('~'), '.badgeempire')  # replica locale dei log
+DOWNLOAD_CHUNK_SIZE = 256 * 1024           # byte scritti su disco per volta nei download in streaming
+BACHECA_POLL_INTERVAL = 25000               # ms tra due controlli di aggiornamento della bacheca
+BACHECA_POLL_MAX_INTERVAL = 300000          # tetto del backoff se il server rifiuta o non risponde
+
+# Ricerca full-text (SQLite FTS5) su personaggi e motivazioni dei log
+SEARCH_TOKENIZER = 'unicode61 remove_diacritics 2'  # "perché" trova anche "perche"
+SEARCH_MAX_TERMS = 8          # parole massime considerate per query
+SEARCH_PAGE_SIZE = 20
+SEARCH_OPTIMIZE_INTERVAL = 86400  # fusione periodica dei segmenti dell'indice
+
+# Change log per la sincronizzazione incrementale (?since=<version>)
+CHANGE_LOG_RETENTION_DAYS = 14   # oltre questa età i client fanno una risincronizzazione completa
+CHANGE_LOG_PRUNE_INTERVAL = 3600
+
+# Estrazione del testo dai copioni .docx (in background, dopo l'upload)
+SCRIPT_PREVIEW_MAX_CHARS = 20000          # l'anteprima HTML mostra solo l'inizio del copione
+SCRIPT_MAX_XML_SIZE = 32 * 1024 * 1024    # limite anti zip-bomb su word/document.xml
+
+# Rate limiting (token bucket per client e route) e load shedding
+RATE_LIMIT_ENABLED = True
+RATE_LIMIT_DEFAULT = (20.0, 40)   # (token al secondo, burst) per le route non elencate
+RATE_LIMITS = {
+    '/bacheca/characters': (2.0, 10),
+    '/admin/users_hours': (1.0, 5),
+    '/admin/removal_requests': (2.0, 10),
+    '/search': (5.0, 20),
+    '/login': (0.5, 5),
+    '/register': (0.2, 3),
+    '/admin/export/work_logs': (0.2, 3),
+    '/kiosk/scan': (20.0, 100),   # un solo terminale condiviso all'ingresso
+    '/metrics': None,             # lo scraper non va mai limitato
+}
+RATE_LIMIT_MAX_BUCKETS = 10000    # bucket in memoria prima di scartare i meno recenti
+SERVER_MAX_IN_FLIGHT = 64         # richieste servite in parallelo, oltre si risponde 503
+CONCURRENCY_LIMITS = {            # slot dedicati alle route costose
+    '/bacheca/characters': 8,
+    '/admin/users_hours': 4,
+    '/admin/removal_requests': 8,
+    '/search': 8,
+    '/admin/export/work_logs': 2,
+}
+LOAD_SHED_RETRY_AFTER = 2         # secondi suggeriti al client dopo un 503
+CLIENT_RETRIES = 3                # tentativi del client su 429/503 (rispettando Retry-After)
+CLIENT_BACKOFF = 0.5              # base del backoff esponenziale lato client
+
+# Idempotency-Key: le ripetizioni di una scrittura ricevono l'esito già dato invece di rieseguirla
+IDEMPOTENCY_TTL = 86400               # per quanto una chiave resta valida
+IDEMPOTENCY_PRUNE_INTERVAL = 3600
+IDEMPOTENCY_MAX_HASHED_BODY = 1024 * 1024  # corpi più grandi: nell'impronta entra solo la lunghezza
+IDEMPOTENT_ROUTES = {                 # (metodo, route): il client aggiunge la chiave solo a queste
+    ('POST', '/add_hours'),
+    ('POST', '/request_removal'),
+    ('POST', '/bacheca/character'),
+    ('PATCH', '/bacheca/character/<int:cid>'),
+    ('POST', '/admin/handle_removal_batch'),
+}
+
+# Cache in memoria delle risposte di sola lettura (invalidate dalle scritture)
+RESPONSE_CACHE_TTL = 300                    # rete di sicurezza per modifiche fatte fuori dagli endpoint
+RESPONSE_CACHE_MAX_ENTRIES = 512
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # corpi in chiaro più varianti compresse
+RESPONSE_CACHE_MAX_ENTRY = 8 * 1024 * 1024   # risposte più grandi non si mettono in cache
+
+# Backup online del database (API di backup di SQLite)
+BACKUP_DIR = None            # None = <BASE_DIR>/backups
+BACKUP_INTERVAL = 6 * 3600   # età massima dell'ultimo backup automatico
+BACKUP_CHECK_INTERVAL = 600  # ogni quanto il job controlla se serve un backup
+BACKUP_KEEP = 28             # backup conservati (i più vecchi vengono eliminati)
+BACKUP_PAGES = 256           # pagine copiate per passo
+BACKUP_SLEEP = 0.02          # pausa (s) tra due passi: lascia spazio agli scrittori
+BACKUP_MAX_RESTARTS = 5      # ripartenze per scritture concorrenti prima della copia in un passo
+
+# Archiviazione dei log vecchi in un database collegato (ATTACH) e manutenzione periodica
+ARCHIVE_DB_PATH = None           # None = timbracart_archive.db accanto al database
+ARCHIVE_AFTER_DAYS = 365         # log più vecchi passano all'archivio (None = mai)
+ARCHIVE_INTERVAL = 86400
+ARCHIVE_BATCH = 2000             # righe spostate per transazione (lock di scrittura breve)
+MAINTENANCE_INTERVAL = 86400     # ANALYZE, PRAGMA optimize, incremental_vacuum
+MAINTENANCE_ANALYZE_LIMIT = 1000 # righe campionate per indice da ANALYZE (0 = tutte)
+MAINTENANCE_VACUUM_PAGES = 512   # pagine liberate per passo (ogni passo è una transazione breve)
+MAINTENANCE_VACUUM_RATIO = 0.25  # pagine libere oltre le quali si segnala la conversione (aggiorna_database.py)
+
+# Report amministrativi (/admin/reports)
+REPORT_PAGE_SIZE = 200
+REPORT_MAX_ROWS = 1000
+EXPORT_BATCH = 2000        # righe lette per volta dall'export CSV/XLSX (memoria costante)
+
+# Modalità kiosk: timbratura con badge (/kiosk/scan, client con --kiosk)
+KIOSK_DEBOUNCE = 60               # secondi: una seconda lettura dello stesso badge viene ignorata
+KIOSK_MAX_SHIFT_HOURS = 16        # un'entrata più vecchia non chiude il turno: si riparte con un'entrata
+KIOSK_LOG_REASON = 'Timbratura'   # motivo dei log creati all'uscita
+KIOSK_CODE_CACHE_TTL = 600        # ricarica periodica della mappa codice -> utente
+KIOSK_MESSAGE_MS = 4000           # durata dell'esito a schermo nel client kiosk
+
 # Crea le directory necessarie
 os.makedirs(ASSETS_DIR, exist_ok=True)
 os.makedirs(os.path.join(ASSETS_DIR, 'bacheca'), exist_ok=True)
@@ -29,7 +188,8 @@ try:
     from PyQt5.QtWidgets import (
         QDialog, QMessageBox, QWidget, QVBoxLayout, QHBoxLayout, QFormLayout,
         QLabel, QLineEdit, QPushButton, QTableWidget, QTextEdit, QFileDialog,
-        QComboBox, QGroupBox, QMainWindow, QTabWidget, QTableWidgetItem
+        QComboBox, QGroupBox, QMainWindow, QTabWidget, QTableWidgetItem, QTextBrowser,
+        QDateEdit, QSpinBox, QProgressDialog
     )
     from PyQt5.QtCore import Qt
     PYQT_AVAILABLE = True
@@ -37,16 +197,33 @@ except ImportError:
     print("PyQt5 non è installato. Esegui: pip install PyQt5")
     PYQT_AVAILABLE = False
 
+# --- Brotli (opzionale) ---
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+# --- SQLite FTS5 (opzionale: alcune build di SQLite ne sono prive) ---
+def _fts5_available():
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE fts5_probe USING fts5(x)')
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+SEARCH_AVAILABLE = _fts5_available()
+
 # --- Flask Server Imports ---
 try:
-    from flask import Flask, jsonify, request, send_file
+    from flask import Flask, Response, jsonify, request, send_file
     from flask_cors import CORS
     app = Flask(__name__)
     CORS(app)  # Abilita CORS per tutti i metodi HTTP
     FLASK_AVAILABLE = True
 except ImportError:
     try:
-        from flask import Flask, jsonify, request, send_file
+        from flask import Flask, Response, jsonify, request, send_file
         app = Flask(__name__)
         FLASK_AVAILABLE = True
     except ImportError:
@@ -56,8 +233,15 @@ except ImportError:
             def route(self, rule, **options):
                 def decorator(f): return f
                 return decorator
+            def before_request(self, f): return f
+            def after_request(self, f): return f
+            def teardown_request(self, f): return f
+            def errorhandler(self, exc):
+                def decorator(f): return f
+                return decorator
         app = DummyFlask()
         request = None
+        Response = None
         def send_file(path, as_attachment=False): return path
         FLASK_AVAILABLE = False
 
@@ -344,14 +528,536 @@ def make_icon(name, size=24):
     pixmap = QtGui.QPixmap(icon_path).scaled(size, size, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
     return QtGui.QIcon(pixmap)
 
+# Route di IDEMPOTENT_ROUTES come espressioni regolari sul percorso dell'URL
+_IDEMPOTENT_PATTERNS = [(method, re.compile(re.sub(r'<int:\w+>', r'\\d+', rule) + '$'))
+                        for method, rule in IDEMPOTENT_ROUTES]
+
+class _IdempotentSession(requests.Session):
+    """Le richieste verso le route di IDEMPOTENT_ROUTES portano un Idempotency-Key nuovo;
+    i tentativi ripetuti dall'adapter riusano gli stessi header, quindi la stessa chiave.
+    Le altre (login, kiosk, registrazione...) non ne hanno: il server la ignorerebbe."""
+    def request(self, method, url, *args, **kwargs):
+        path = urlparse(url).path
+        if any(m == method.upper() and p.search(path) for m, p in _IDEMPOTENT_PATTERNS):
+            headers = dict(kwargs.get('headers') or {})
+            headers.setdefault('Idempotency-Key', uuid.uuid4().hex)
+            kwargs['headers'] = headers
+        return super().request(method, url, *args, **kwargs)
+
+def _make_http_session():
+    """Sessione HTTP condivisa dal client: riusa le connessioni e ritenta con backoff
+    esponenziale (rispettando Retry-After) su 429/503, connessioni fallite e timeout di lettura.
+    Grazie all'Idempotency-Key ripetere è sicuro per le scritture di IDEMPOTENT_ROUTES: se il
+    server aveva già eseguito la richiesta risponde con l'esito salvato invece di rieseguirla."""
+    retry = Retry(total=CLIENT_RETRIES, connect=CLIENT_RETRIES, read=CLIENT_RETRIES, status=CLIENT_RETRIES,
+                  status_forcelist=(429, 503), allowed_methods=None,
+                  backoff_factor=CLIENT_BACKOFF, respect_retry_after_header=True,
+                  raise_on_status=False)
+    session = _IdempotentSession()
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=16)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+http_session = _make_http_session()
+
+def post_json(url, data, timeout=8, **kwargs):
+    """POST JSON lato client: i corpi grandi (es. immagini base64) vengono inviati in gzip"""
+    body = json.dumps(data).encode('utf-8')
+    headers = kwargs.pop('headers', {}) or {}
+    headers['Content-Type'] = 'application/json'
+    if len(body) >= COMPRESS_MIN_SIZE:
+        body = gzip.compress(body, COMPRESS_LEVEL)
+        headers['Content-Encoding'] = 'gzip'
+    return http_session.post(url, data=body, headers=headers, timeout=timeout, **kwargs)
+
+def iter_ndjson(url, timeout=8):
+    """GET in streaming NDJSON: restituisce gli oggetti man mano che arrivano le righe.
+    Se il server risponde con un normale array JSON lo itera comunque."""
+    with http_session.get(url, headers={'Accept': NDJSON_MIMETYPE}, stream=True, timeout=timeout) as r:
+        if r.status_code != 200:
+            raise RuntimeError(f"HTTP {r.status_code}")
+        if not r.headers.get('Content-Type', '').startswith(NDJSON_MIMETYPE):
+            yield from r.json()
+            return
+        for line in r.iter_lines():
+            if line:
+                yield json.loads(line)
+
+class AssetCache:
+    """Cache degli asset lato client: LRU entro un budget di byte.
+    Rispetta Cache-Control (max-age / immutable) e rivalida con If-None-Match / If-Modified-Since."""
+    def __init__(self, max_bytes=ASSET_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()  # url -> (dati, etag, last_modified, scadenza)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _expiry(response):
+        cc = response.headers.get('Cache-Control', '')
+        directives = [d.strip().lower() for d in cc.split(',')]
+        if 'no-store' in directives or 'no-cache' in directives:
+            return 0
+        for d in directives:
+            if d.startswith('max-age='):
+                try:
+                    return time.time() + int(d[8:])
+                except ValueError:
+                    return 0
+        return 0
+
+    def get(self, url, timeout=6):
+        """Ritorna i byte dell'asset, dalla cache se ancora validi"""
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry:
+                self._entries.move_to_end(url)
+                if entry[3] > time.time():
+                    return entry[0]
+        headers = {}
+        if entry:
+            if entry[1]:
+                headers['If-None-Match'] = entry[1]
+            if entry[2]:
+                headers['If-Modified-Since'] = entry[2]
+        r = http_session.get(url, headers=headers, timeout=timeout)
+        if r.status_code == 304 and entry:
+            data = entry[0]
+        else:
+            r.raise_for_status()
+            data = r.content
+        if 'no-store' not in r.headers.get('Cache-Control', '').lower():
+            self._put(url, (data, r.headers.get('ETag') or (entry and entry[1]),
+                            r.headers.get('Last-Modified') or (entry and entry[2]), self._expiry(r)))
+        return data
+
+    def _put(self, url, entry):
+        if len(entry[0]) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(url, None)
+            if old:
+                self.size -= len(old[0])
+            self._entries[url] = entry
+            self.size += len(entry[0])
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted[0])
+
+asset_cache = AssetCache()
+
+def fetch_asset(url, timeout=6):
+    """Scarica un asset (immagini della bacheca) passando dalla cache client"""
+    return asset_cache.get(url, timeout=timeout)
+
+def download_to_file(url, path, params=None, progress=None, cancelled=None, timeout=30):
+    """GET in streaming scritto direttamente su disco (mai tutto in memoria).
+    Si scrive su <path>.part, rinominato solo a download completo; progress(byte) viene
+    chiamato a ogni chunk, cancelled() può interrompere. Ritorna (byte, header della risposta)."""
+    tmp = path + '.part'
+    with http_session.get(url, params=params, stream=True, timeout=timeout) as r:
+        if r.status_code != 200:
+            try:
+                message = r.json().get('message')
+            except ValueError:
+                message = None
+            raise RuntimeError(message or f"HTTP {r.status_code}")
+        done = 0
+        try:
+            with open(tmp, 'wb') as f:
+                for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    if cancelled and cancelled():
+                        raise InterruptedError('Download annullato')
+                    f.write(chunk)
+                    done += len(chunk)
+                    if progress:
+                        progress(done)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return done, r.headers
+
+class LocalLogReplica:
+    """Replica SQLite locale dei log dell'utente, allineata con /get_logs/<id>?since=<version>.
+    Home e Analitica leggono da qui: all'avvio i dati sono subito disponibili anche con rete lenta."""
+    def __init__(self, server_url, user_id):
+        self.server_url = server_url
+        self.user_id = user_id
+        self._lock = threading.Lock()
+        server_key = hashlib.sha1(server_url.encode('utf-8')).hexdigest()[:12]
+        try:
+            os.makedirs(LOCAL_DATA_DIR, exist_ok=True)
+            self.path = os.path.join(LOCAL_DATA_DIR, f"logs_{server_key}_{user_id}.db")
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        except (OSError, sqlite3.Error) as e:
+            print(f"[REPLICA] Replica su disco non disponibile ({e}), uso la memoria")
+            self.path = ':memory:'
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS work_logs (
+                id INTEGER PRIMARY KEY, date TEXT, hours REAL, reason TEXT)''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_replica_date ON work_logs(date)')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    def version(self):
+        with self._lock:
+            r = self._conn.execute("SELECT value FROM meta WHERE key='version'").fetchone()
+        return int(r[0]) if r else 0
+
+    def sync(self, timeout=8):
+        """Scarica e applica le differenze; ritorna True se la replica è cambiata"""
+        r = http_session.get(f"{self.server_url}/get_logs/{self.user_id}",
+                         params={'since': self.version()}, timeout=timeout)
+        r.raise_for_status()
+        return self.apply(r.json())
+
+    def apply(self, delta):
+        changed = delta['full'] or bool(delta['items']) or bool(delta['deleted'])
+        with self._lock, self._conn:
+            if delta['full']:
+                self._conn.execute('DELETE FROM work_logs')
+            self._conn.executemany('INSERT OR REPLACE INTO work_logs (id, date, hours, reason) VALUES (?,?,?,?)',
+                                   [(it['id'], it['date'], it['hours'], it['reason']) for it in delta['items']])
+            self._conn.executemany('DELETE FROM work_logs WHERE id=?', [(lid,) for lid in delta['deleted']])
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (str(delta['version']),))
+        return changed
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            cur = self._conn.execute(sql, params)
+            cols = [d[0] for d in cur.description]
+            return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+    def recent(self, limit=10):
+        return self._query('SELECT * FROM work_logs ORDER BY date DESC LIMIT ?', (limit,))
+
+    def months(self):
+        return [r['month'] for r in self._query(
+            "SELECT DISTINCT substr(date, 1, 7) AS month FROM work_logs WHERE date IS NOT NULL ORDER BY month DESC")]
+
+    def month_logs(self, month):
+        return self._query('SELECT * FROM work_logs WHERE date LIKE ? ORDER BY date DESC', (f"{month}%",))
+
+    def month_total(self, month):
+        return self._query('SELECT COALESCE(SUM(hours), 0) AS total FROM work_logs WHERE date LIKE ?',
+                           (f"{month}%",))[0]['total']
+
+class AuditWriter:
+    """Scrive l'audit log in background: coda in memoria, commit di gruppo,
+    backpressure limitata e svuotamento della coda alla chiusura"""
+    _STOP = object()
+
+    def __init__(self, maxsize=AUDIT_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize)
+        self.written = 0
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        self._atexit_registered = False
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def submit(self, entry):
+        """Accoda un evento; se la coda è piena attende al massimo AUDIT_PUT_TIMEOUT"""
+        if not (self._thread and self._thread.is_alive()):
+            self.start()
+        try:
+            self.queue.put(entry, timeout=AUDIT_PUT_TIMEOUT)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                print(f"[AUDIT] Coda piena, eventi scartati finora: {self.dropped}")
+
+    def flush(self):
+        """Attende che tutti gli eventi accodati siano scritti"""
+        if self._thread and self._thread.is_alive():
+            self.queue.join()
+
+    def stop(self, timeout=5):
+        if not (self._thread and self._thread.is_alive()):
+            return
+        try:
+            self.queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            print("[AUDIT] Impossibile fermare il writer: coda piena")
+            return
+        self._thread.join(timeout)
+
+    def _run(self):
+        conn = sqlite3.connect(DB_PATH, timeout=10)
+        try:
+            while True:
+                first = self.queue.get()
+                batch = []
+                stop = first is self._STOP
+                if not stop:
+                    batch.append(first)
+                # Commit di gruppo: prende tutto ciò che è già in coda senza attendere
+                while not stop and len(batch) < AUDIT_BATCH_SIZE:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is self._STOP:
+                        stop = True
+                    else:
+                        batch.append(item)
+                if batch:
+                    self._write(conn, batch)
+                # Un task_done per ogni get (sentinella inclusa)
+                for _ in range(len(batch) + (1 if stop else 0)):
+                    self.queue.task_done()
+                if stop:
+                    break
+        finally:
+            conn.close()
+
+    def _write(self, conn, batch):
+        try:
+            with conn:
+                conn.executemany('INSERT INTO audit_log (ts, user_id, action, details) VALUES (?,?,?,?)', batch)
+            self.written += len(batch)
+        except Exception as e:
+            print(f"[AUDIT] Errore scrittura di {len(batch)} eventi: {e}")
+
+_audit_writer = AuditWriter()
+
 def audit(user_id, action, details):
-    """Funzione di audit"""
+    """Funzione di audit: l'evento viene persistito in background su audit_log"""
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    print(f"[AUDIT] {timestamp} - User {user_id} - {action}: {details}")
+    _audit_writer.submit((timestamp, user_id, action, details))
+
+class WriteUnavailable(RuntimeError):
+    """La scrittura non è stata eseguita (coda piena o attesa scaduta): si può ritentare"""
+    pass
+
+class WriteQueue:
+    """Unico scrittore del database per gli endpoint: le richieste accodano fn(cursor)
+    e ne attendono l'esito su un Future. Il thread prende tutte le operazioni già in coda
+    (fino a WRITE_BATCH_SIZE) e le esegue in una sola transazione, ognuna nel suo SAVEPOINT:
+    un'operazione che fallisce viene annullata senza toccare le altre. Un commit (e un fsync)
+    per gruppo invece che per richiesta, e nessuna contesa sul lock di scrittura."""
+    _STOP = object()
+
+    def __init__(self, maxsize=WRITE_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize)
+        self.operations = 0
+        self.transactions = 0
+        self.failed = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        self._atexit_registered = False
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def submit(self, fn):
+        """Accoda fn(cursor); ritorna un Future con il valore di fn, risolto dopo il commit"""
+        if not (self._thread and self._thread.is_alive()):
+            self.start()
+        future = Future()
+        try:
+            self.queue.put((fn, future), timeout=WRITE_TIMEOUT)
+        except queue.Full:
+            future.set_exception(WriteUnavailable('Troppe scritture in coda, riprovare'))
+        return future
+
+    def execute(self, fn, timeout=None):
+        """Esegue fn(cursor) nel thread scrittore e ne ritorna il risultato (o ne rilancia l'eccezione).
+        Se l'attesa scade prima che l'operazione parta la si annulla: WriteUnavailable garantisce
+        che non è stato scritto nulla. Un'operazione già partita si attende fino al commit."""
+        stats = getattr(_request_stats, 'current', None)
+        t0 = time.perf_counter()
+        future = self.submit(fn)
+        try:
+            return future.result(WRITE_TIMEOUT if timeout is None else timeout)
+        except FutureTimeoutError:
+            if future.cancel():
+                raise WriteUnavailable('Database occupato, riprovare')
+            return future.result()
+        finally:
+            # Le query girano nel thread scrittore, che non vede le statistiche della richiesta:
+            # il suo tempo SQLite è l'attesa dell'esito (coda, operazione e commit di gruppo)
+            if stats is not None:
+                stats['db_seconds'] += time.perf_counter() - t0
+                stats['db_queries'] += getattr(future, 'db_queries', 0)
+
+    def stop(self, timeout=5):
+        if not (self._thread and self._thread.is_alive()):
+            return
+        try:
+            self.queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            print("[WRITER] Impossibile fermare lo scrittore: coda piena")
+            return
+        self._thread.join(timeout)
+
+    def _run(self):
+        conn = get_db_connection()
+        conn.isolation_level = None  # transazioni gestite qui (BEGIN/SAVEPOINT/COMMIT)
+        conn.execute(f'PRAGMA busy_timeout = {WRITE_BUSY_TIMEOUT * 1000}')  # altri scrittori: job, audit
+        try:
+            while True:
+                first = self.queue.get()
+                batch = []
+                stop = first is self._STOP
+                if not stop:
+                    batch.append(first)
+                # Commit di gruppo: mentre si scriveva il gruppo precedente la coda si è riempita
+                while not stop and len(batch) < WRITE_BATCH_SIZE:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is self._STOP:
+                        stop = True
+                    else:
+                        batch.append(item)
+                if batch:
+                    self._apply(conn, batch)
+                for _ in range(len(batch) + (1 if stop else 0)):
+                    self.queue.task_done()
+                if stop:
+                    break
+        finally:
+            conn.close()
+
+    def _apply(self, conn, batch):
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for fn, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue  # annullata dalla richiesta (attesa scaduta)
+                c = conn.cursor()
+                c.execute('SAVEPOINT op')
+                op_stats = {'db_seconds': 0.0, 'db_queries': 0}
+                _request_stats.current = op_stats  # _TimedCursor conta le query dell'operazione
+                try:
+                    value = fn(c)
+                except Exception as e:
+                    c.execute('ROLLBACK TO op')
+                    c.execute('RELEASE op')
+                    results.append((future, e, False))
+                else:
+                    c.execute('RELEASE op')
+                    results.append((future, value, True))
+                finally:
+                    _request_stats.current = None
+                    future.db_queries = op_stats['db_queries']
+            conn.execute('COMMIT')
+        except Exception as e:
+            # BEGIN o COMMIT falliti: nessuna operazione del gruppo è stata scritta
+            print(f"[WRITER] Transazione di {len(batch)} operazioni fallita: {e}")
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            self.failed += len(batch)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.transactions += 1
+        self.operations += len(results)
+        for future, value, ok in results:
+            if ok:
+                future.set_result(value)
+            else:
+                self.failed += 1
+                future.set_exception(value)
+
+_db_writer = WriteQueue()
+
+class PeriodicJob:
+    """Esegue fn ogni `interval` secondi in un thread daemon (manutenzione lato server)"""
+    def __init__(self, name, interval, fn):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.fn()
+            except Exception as e:
+                print(f"[{self.name}] Errore: {e}")
+                traceback.print_exc()
+
+class OneShotJob:
+    """Lavoro lanciato su richiesta (es. da un endpoint admin) in un thread daemon:
+    la richiesta risponde subito e non ne parte un secondo finché il primo è in corso"""
+    def __init__(self, name, fn):
+        self.name = name
+        self.fn = fn
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, *args):
+        """False se un'esecuzione è già in corso"""
+        with self._lock:
+            if self.running():
+                return False
+            self._thread = threading.Thread(target=self._run, args=args, name=self.name, daemon=True)
+            self._thread.start()
+            return True
+
+    def running(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def wait(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self, *args):
+        try:
+            self.fn(*args)
+        except Exception as e:
+            print(f"[{self.name}] Errore: {e}")
+            traceback.print_exc()
+
+# Job periodici avviati da run_server
+BACKGROUND_JOBS = []
+
+def start_background_jobs():
+    for job in BACKGROUND_JOBS:
+        job.start()
+
+def stop_background_jobs():
+    for job in BACKGROUND_JOBS:
+        job.stop()
 
 # ---------------- SERVER SIDE ----------------
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH, factory=_TimedConnection)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -373,8 +1079,255 @@ def init_db_bacheca(conn):
         last_modified TEXT
     )
     ''')
+    # Personaggi scaduti: restano i dati, i file vengono rilasciati
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS bacheca_characters_archive (
+        id INTEGER PRIMARY KEY,
+        series_title TEXT,
+        character_name TEXT,
+        role TEXT,
+        script_text TEXT,
+        expiry_date TEXT,
+        expires_at TEXT,
+        created_by INTEGER,
+        visible_to TEXT,
+        assigned_to INTEGER,
+        last_modified TEXT,
+        archived_at TEXT
+    )
+    ''')
+    conn.commit()
+
+def init_db_audit(conn):
+    """Inizializzazione tabella Audit Log"""
+    c = conn.cursor()
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS audit_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts TEXT,
+        user_id INTEGER,
+        action TEXT,
+        details TEXT
+    )
+    ''')
+    # Indici per i filtri di /admin/audit (utente, azione, intervallo temporale)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_audit_user_ts ON audit_log(user_id, ts)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_audit_action_ts ON audit_log(action, ts)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_audit_ts ON audit_log(ts)')
+    conn.commit()
+
+def init_db_reports(conn):
+    """Indici di work_logs per gli intervalli di date (report e log del singolo utente).
+    Contengono anche le ore: i report per utente e per periodo non leggono la tabella."""
+    c = conn.cursor()
+    c.execute('CREATE INDEX IF NOT EXISTS idx_work_logs_date ON work_logs(date, user_id, hours)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_work_logs_user_date ON work_logs(user_id, date, hours)')
+    conn.commit()
+
+def init_db_archive(conn):
+    """Tabelle dell'archiviazione nel database principale: totali mensili dei log archiviati
+    (users_hours non deve leggere l'archivio) e lotti confermati"""
+    c = conn.cursor()
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS work_log_rollups (
+        user_id INTEGER,
+        month TEXT,
+        hours REAL DEFAULT 0,
+        entries INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, month)
+    )
+    ''')
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS archive_batches (
+        id INTEGER PRIMARY KEY,
+        archived_at TEXT,
+        horizon TEXT,
+        rows INTEGER,
+        max_date TEXT
+    )
+    ''')
+    conn.commit()
+
+def init_db_punches(conn):
+    """Timbrature da badge (entrata/uscita); l'uscita punta al log delle ore creato"""
+    c = conn.cursor()
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS punches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        ts TEXT,
+        kind TEXT,
+        terminal TEXT,
+        work_log_id INTEGER
+    )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_punches_user_ts ON punches(user_id, ts)')
+    conn.commit()
+
+def init_db_idempotency(conn):
+    """Risultati delle scritture già eseguite per Idempotency-Key (JSON del valore dell'operazione)"""
+    c = conn.cursor()
+    c.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='idempotency_keys'")
+    r = c.fetchone()
+    if r and 'result' not in r[0]:
+        # Formato precedente (risposte HTTP salvate): le chiavi durano un giorno, si riparte da vuoto
+        c.execute('DROP TABLE idempotency_keys')
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        key TEXT PRIMARY KEY,
+        fingerprint TEXT,
+        result TEXT,
+        created_at REAL
+    )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency_keys(created_at)')
+    conn.commit()
+
+def init_db_assets(conn):
+    """Inizializzazione tabella dei blob (asset indirizzati per SHA-256)"""
+    c = conn.cursor()
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS asset_blobs (
+        path TEXT PRIMARY KEY,
+        sha256 TEXT,
+        size INTEGER,
+        refcount INTEGER DEFAULT 0,
+        unreferenced_since REAL
+    )
+    ''')
+    # Il garbage collector cerca solo i blob senza riferimenti
+    c.execute('CREATE INDEX IF NOT EXISTS idx_asset_blobs_unref ON asset_blobs(refcount, unreferenced_since)')
+    conn.commit()
+
+# Indici full-text: tabella FTS -> (tabella sorgente, colonne indicizzate)
+SEARCH_INDEXES = {
+    'characters_fts': ('bacheca_characters', ('character_name', 'role', 'series_title', 'script_text')),
+    'work_logs_fts': ('work_logs', ('reason',)),
+}
+
+def init_db_search(conn):
+    """Indici FTS5 a contenuto esterno, tenuti allineati da trigger sulle tabelle sorgente"""
+    if not SEARCH_AVAILABLE:
+        print("[DB] SQLite senza FTS5: ricerca full-text disattivata")
+        return
+    c = conn.cursor()
+    for fts, (table, cols) in SEARCH_INDEXES.items():
+        c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (fts,))
+        exists = c.fetchone() is not None
+        col_list = ', '.join(cols)
+        new_vals = ', '.join(f'new.{col}' for col in cols)
+        old_vals = ', '.join(f'old.{col}' for col in cols)
+        c.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({col_list}, "
+                  f"content='{table}', content_rowid='id', tokenize='{SEARCH_TOKENIZER}')")
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts}(rowid, {col_list}) VALUES (new.id, {new_vals});
+        END''')
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals});
+        END''')
+        # Solo le colonne indicizzate: gli UPDATE di last_modified & co. non toccano l'indice
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {col_list} ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals});
+            INSERT INTO {fts}(rowid, {col_list}) VALUES (new.id, {new_vals});
+        END''')
+        if not exists:
+            # Primo avvio: indicizza le righe già presenti
+            c.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+            print(f"[DB] Indice di ricerca '{fts}' creato")
+    conn.commit()
+
+# Tabelle tracciate nel change log: tabella -> (entità, colonna proprietario o None)
+CHANGE_TRACKED = {
+    'bacheca_characters': ('character', None),
+    'work_logs': ('work_log', 'user_id'),
+}
+
+def init_db_change_log(conn):
+    """Change log generico (versione monotona per ogni modifica), alimentato da trigger"""
+    c = conn.cursor()
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS change_log (
+        version INTEGER PRIMARY KEY AUTOINCREMENT,
+        entity TEXT,
+        entity_id INTEGER,
+        owner_id INTEGER,
+        op TEXT,
+        changed_at TEXT
+    )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_change_log_entity ON change_log(entity, version)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_change_log_owner ON change_log(entity, owner_id, version)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_change_log_changed_at ON change_log(changed_at)')
+    # Entità presenti qui non registrano le cancellazioni (la riga vive solo dentro la
+    # transazione che sposta i log nell'archivio: per i client non sono cancellazioni)
+    c.execute('CREATE TABLE IF NOT EXISTS change_log_paused (entity TEXT PRIMARY KEY)')
+    for table, (entity, owner_col) in CHANGE_TRACKED.items():
+        new_owner = f'new.{owner_col}' if owner_col else 'NULL'
+        old_owner = f'old.{owner_col}' if owner_col else 'NULL'
+        for event, op, ref, owner in (('INSERT', 'upsert', 'new', new_owner),
+                                      ('UPDATE', 'upsert', 'new', new_owner),
+                                      ('DELETE', 'delete', 'old', old_owner)):
+            name = f'{table}_changes_{event.lower()}'
+            guard = ''
+            if event == 'DELETE':
+                guard = f"WHEN NOT EXISTS (SELECT 1 FROM change_log_paused WHERE entity='{entity}')"
+                c.execute("SELECT sql FROM sqlite_master WHERE type='trigger' AND name=?", (name,))
+                r = c.fetchone()
+                if r and 'change_log_paused' not in r[0]:
+                    c.execute(f'DROP TRIGGER {name}')  # creato da una versione precedente, senza condizione
+            c.execute(f'''CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} {guard} BEGIN
+                INSERT INTO change_log (entity, entity_id, owner_id, op, changed_at)
+                VALUES ('{entity}', {ref}.id, {owner}, '{op}', strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'));
+            END''')
     conn.commit()
 
+def current_change_version(c):
+    c.execute("SELECT seq FROM sqlite_sequence WHERE name='change_log'")
+    r = c.fetchone()
+    return r[0] if r else 0
+
+def changes_since(c, entity, since, owner_id=None):
+    """Ritorna (versione corrente, full, id modificati) per un'entità dopo `since`.
+    full=True se il client deve risincronizzare tutto (prima sync, log potato, versione sconosciuta)."""
+    version = current_change_version(c)
+    c.execute('SELECT MIN(version) FROM change_log')
+    oldest = c.fetchone()[0] or version + 1
+    if since <= 0 or since > version or since < oldest - 1:
+        return version, True, []
+    sql = 'SELECT DISTINCT entity_id FROM change_log WHERE entity=? AND version>? AND version<=?'
+    params = [entity, since, version]
+    if owner_id is not None:
+        sql += ' AND owner_id=?'
+        params.append(owner_id)
+    c.execute(sql, params)
+    return version, False, [r[0] for r in c.fetchall()]
+
+def prune_change_log():
+    """Elimina le voci più vecchie di CHANGE_LOG_RETENTION_DAYS"""
+    cutoff = datetime.fromtimestamp(time.time() - CHANGE_LOG_RETENTION_DAYS * 86400).strftime('%Y-%m-%d %H:%M:%S')
+    conn = get_db_connection()
+    try:
+        conn.execute('DELETE FROM change_log WHERE changed_at < ?', (cutoff,))
+        conn.commit()
+    finally:
+        conn.close()
+
+BACKGROUND_JOBS.append(PeriodicJob('change-log-prune', CHANGE_LOG_PRUNE_INTERVAL, prune_change_log))
+
+def optimize_search_index():
+    """Fonde i segmenti degli indici FTS5 (le query restano veloci dopo molte scritture)"""
+    if not SEARCH_AVAILABLE:
+        return
+    conn = get_db_connection()
+    try:
+        for fts in SEARCH_INDEXES:
+            conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('optimize')")
+        conn.commit()
+    finally:
+        conn.close()
+
+BACKGROUND_JOBS.append(PeriodicJob('search-optimize', SEARCH_OPTIMIZE_INTERVAL, optimize_search_index))
+
 def update_db_add_visibility():
     """Aggiunge campo visible_to per gestire visibilità personaggi"""
     conn = get_db_connection()
@@ -388,6 +1341,19 @@ def update_db_add_visibility():
     finally:
         conn.close()
 
+def update_db_add_script_preview():
+    """Aggiunge campo script_preview_html (anteprima del copione estratta dal .docx)"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute('ALTER TABLE bacheca_characters ADD COLUMN script_preview_html TEXT')
+        conn.commit()
+        print("[DB] Colonna 'script_preview_html' aggiunta a bacheca_characters")
+    except sqlite3.OperationalError:
+        pass  # Colonna già esistente
+    finally:
+        conn.close()
+
 def update_db_add_assigned():
     """Aggiunge campo assigned_to per assegnazione personaggio"""
     conn = get_db_connection()
@@ -401,11 +1367,40 @@ def update_db_add_assigned():
     finally:
         conn.close()
 
+def update_db_add_expiry():
+    """Aggiunge expires_at (scadenza normalizzata YYYY-MM-DD, indicizzata) e la ricava da expiry_date"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        try:
+            c.execute('ALTER TABLE bacheca_characters ADD COLUMN expires_at TEXT')
+            print("[DB] Colonna 'expires_at' aggiunta a bacheca_characters")
+        except sqlite3.OperationalError:
+            pass  # Colonna già esistente
+        c.execute('CREATE INDEX IF NOT EXISTS idx_bacheca_expires_at ON bacheca_characters(expires_at)')
+        c.execute("SELECT id, expiry_date FROM bacheca_characters WHERE expires_at IS NULL AND expiry_date <> ''")
+        updates = []
+        for cid, text in c.fetchall():
+            expires_at = parse_expiry(text)
+            if expires_at is not None:
+                updates.append((expires_at, cid))
+        if updates:
+            # Senza toccare last_modified: per i client il personaggio non è cambiato
+            c.executemany('UPDATE bacheca_characters SET expires_at=? WHERE id=?', updates)
+            print(f"[DB] Scadenza normalizzata per {len(updates)} personaggi")
+        conn.commit()
+    finally:
+        conn.close()
+
 
 def init_db():
     """Inizializzazione database"""
     conn = get_db_connection()
     c = conn.cursor()
+    # Solo su un database nuovo (vuoto): lo spazio liberato si restituisce con incremental_vacuum
+    c.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    # WAL: i lettori non bloccano lo scrittore (e viceversa); l'impostazione resta nel file
+    c.execute('PRAGMA journal_mode = WAL')
     
     c.execute('''
     CREATE TABLE IF NOT EXISTS users (
@@ -465,226 +1460,1851 @@ def init_db():
         conn.commit()
 
     init_db_bacheca(conn)
+    init_db_audit(conn)
+    init_db_assets(conn)
+    init_db_search(conn)
+    init_db_change_log(conn)
+    init_db_reports(conn)
+    init_db_archive(conn)
+    init_db_punches(conn)
+    init_db_idempotency(conn)
     conn.close()
     update_db_add_visibility()
     update_db_add_assigned()
+    update_db_add_script_preview()
+    update_db_asset_blobs()
+    update_db_add_expiry()
 
-def _save_uploaded_file(fileobj, subdir, filename_prefix):
+# --- Archivio asset (blob indirizzati per contenuto) ---
+# Colonne che referenziano un blob: i contatori vengono ricalcolati da qui
+ASSET_REF_COLUMNS = [
+    ('bacheca_characters', ('image_path', 'script_path', 'mov_path')),
+]
+
+_asset_lock = threading.Lock()
+_recent_blobs = {}  # percorso -> istante dell'ultimo upload; il GC non tocca i blob appena scritti
+
+def _blobs_dir():
+    return os.path.join(ASSETS_DIR, 'blobs')
+
+def _is_blob_path(rel):
+    if not rel:
+        return False
+    prefix = os.path.relpath(_blobs_dir(), BASE_DIR).replace(os.sep, '/') + '/'
+    return rel.replace('\\', '/').startswith(prefix)
+
+def _store_blob(stream, ext):
+    """Copia lo stream nell'archivio calcolando lo SHA-256 in un solo passaggio.
+    I contenuti identici vengono salvati una volta sola. Ritorna (percorso relativo, byte)."""
+    blobs = _blobs_dir()
+    os.makedirs(blobs, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(prefix='.upload_', dir=blobs)
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            while True:
+                chunk = stream.read(ASSET_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+        return _commit_blob(tmp_path, digest.hexdigest(), ext), size
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _commit_blob(tmp_path, sha, ext):
+    """Sposta un file temporaneo dell'archivio al suo percorso per contenuto; ritorna il percorso relativo"""
+    dest_dir = os.path.join(_blobs_dir(), sha[:2], sha[2:4])
+    os.makedirs(dest_dir, exist_ok=True)
+    dest = os.path.join(dest_dir, sha + ext)
+    rel = os.path.relpath(dest, BASE_DIR).replace(os.sep, '/')
+    with _asset_lock:
+        _recent_blobs[rel] = time.time()
+        if os.path.exists(dest):
+            os.remove(tmp_path)  # duplicato: il blob esiste già
+        else:
+            os.replace(tmp_path, dest)
+    return rel
+
+class _BlobUpload:
+    """File in cui il parser multipart scrive un upload: sta già nella cartella dei blob e
+    calcola lo SHA-256 mentre i byte arrivano, così salvarlo è solo un rename.
+    Se non viene salvato, close() (a fine richiesta) lo elimina."""
+    def __init__(self):
+        blobs = _blobs_dir()
+        os.makedirs(blobs, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix='.upload_', dir=blobs)
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._digest.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def commit(self, ext):
+        self._file.close()
+        rel = _commit_blob(self.path, self._digest.hexdigest(), ext)
+        self.path = None
+        return rel
+
+    def close(self):
+        self._file.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+            self.path = None
+
+if FLASK_AVAILABLE:
+    class _UploadRequest(app.request_class):
+        def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+            return _BlobUpload()
+    app.request_class = _UploadRequest
+
+def _save_uploaded_file(fileobj):
+    """Salva un file caricato nell'archivio asset; ritorna il percorso relativo del blob.
+    Il chiamante deve registrare il riferimento con _asset_ref nella stessa transazione dell'UPDATE."""
     if not fileobj:
         return None
-    _, ext = os.path.splitext(fileobj.filename)
-    ts = int(time.time())
-    name = f"{filename_prefix}_{ts}{ext}"
-    dest_dir = os.path.join(ASSETS_DIR, 'bacheca', secure_filename(subdir))
-    os.makedirs(dest_dir, exist_ok=True)
-    dest_path = os.path.join(dest_dir, name)
-    fileobj.save(dest_path)
-    return os.path.relpath(dest_path, BASE_DIR)
+    t0 = time.perf_counter()
+    _, ext = os.path.splitext(secure_filename(fileobj.filename or ''))
+    if isinstance(fileobj.stream, _BlobUpload) and fileobj.stream.path:
+        size = fileobj.stream.size
+        rel = fileobj.stream.commit(ext.lower())
+    else:
+        rel, size = _store_blob(fileobj.stream, ext.lower())
+    METRICS.observe_file_io('save_upload', time.perf_counter() - t0, size)
+    return rel
 
-# --- ENDPOINTS FLASK ---
-    
-@app.route('/bacheca/characters', methods=['GET'])
-def api_bacheca_characters():
-    # ← AGGIUNTO: parametro opzionale user_id
-    user_id = request.args.get('user_id')  # Es: ?user_id=5
-    
+def _asset_ref(c, rel):
+    """Aggiunge un riferimento al blob (da chiamare dentro la transazione che salva il percorso)"""
+    if not _is_blob_path(rel):
+        return
+    full_path = os.path.join(BASE_DIR, rel)
+    size = os.path.getsize(full_path) if os.path.exists(full_path) else 0
+    sha = os.path.splitext(os.path.basename(rel))[0]
+    c.execute('''INSERT INTO asset_blobs (path, sha256, size, refcount, unreferenced_since) VALUES (?,?,?,1,NULL)
+                 ON CONFLICT(path) DO UPDATE SET refcount=refcount+1, unreferenced_since=NULL''',
+              (rel, sha, size))
+
+def _asset_unref(c, rel):
+    """Toglie un riferimento; il file viene eliminato dal GC dopo ASSET_GC_GRACE secondi"""
+    if not _is_blob_path(rel):
+        return
+    c.execute('''UPDATE asset_blobs SET refcount=MAX(refcount-1, 0),
+                 unreferenced_since=CASE WHEN refcount<=1 THEN ? ELSE unreferenced_since END
+                 WHERE path=?''', (time.time(), rel))
+
+def _reconcile_asset_refs(c, now):
+    """Riallinea i contatori ai percorsi effettivamente salvati nel DB"""
+    refs = {}
+    for table, cols in ASSET_REF_COLUMNS:
+        for col in cols:
+            c.execute(f'SELECT {col} FROM {table} WHERE {col} IS NOT NULL')
+            for (rel,) in c.fetchall():
+                if _is_blob_path(rel):
+                    refs[rel] = refs.get(rel, 0) + 1
+    c.execute('SELECT path, refcount FROM asset_blobs')
+    current = {r[0]: r[1] for r in c.fetchall()}
+    fixed = 0
+    for rel, n in refs.items():
+        if current.get(rel) != n:
+            full_path = os.path.join(BASE_DIR, rel)
+            size = os.path.getsize(full_path) if os.path.exists(full_path) else 0
+            sha = os.path.splitext(os.path.basename(rel))[0]
+            c.execute('''INSERT INTO asset_blobs (path, sha256, size, refcount, unreferenced_since) VALUES (?,?,?,?,NULL)
+                         ON CONFLICT(path) DO UPDATE SET refcount=excluded.refcount, unreferenced_since=NULL''',
+                      (rel, sha, size, n))
+            fixed += 1
+    for rel, n in current.items():
+        if rel not in refs and n > 0:
+            c.execute('UPDATE asset_blobs SET refcount=0, unreferenced_since=? WHERE path=?', (now, rel))
+            fixed += 1
+    return fixed
+
+def collect_asset_garbage(grace=None):
+    """Garbage collector dell'archivio: riallinea i contatori, elimina i blob senza
+    riferimenti da almeno `grace` secondi e i file orfani (upload mai registrati)"""
+    grace = ASSET_GC_GRACE if grace is None else grace
+    now = time.time()
+    cutoff = now - grace
+    removed = 0
+    freed = 0
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT * FROM bacheca_characters ORDER BY series_title, character_name")
-    rows = c.fetchall()
-    conn.close()
-    
-    out = []
-    for r in rows:
-        r = dict(r)
-        
-        # ← AGGIUNTO: Filtro per visibilità
-        visible_to = r.get('visible_to', '')
-        if visible_to:  # Se ha restrizioni di visibilità
-            allowed_users = [uid.strip() for uid in visible_to.split(',') if uid.strip()]
-            # Se user_id è specificato E non è nella lista → salta
-            if user_id and str(user_id) not in allowed_users:
-                continue
-        
-        # Resto del codice UGUALE
-        v_ts = int(datetime.strptime(r['last_modified'], '%Y-%m-%d %H:%M:%S').timestamp()) if r.get('last_modified') else int(time.time())
-        img_url = f"{SERVER_URL}/profile_image/{r['image_path']}?v={v_ts}" if r['image_path'] else None
-        mov_url = f"{SERVER_URL}/profile_image/{r['mov_path']}?v={v_ts}" if r['mov_path'] else None
-        script_url = f"{SERVER_URL}/profile_image/{r['script_path']}?v={v_ts}" if r['script_path'] else None
-        
-        out.append({
-            'id': r['id'],
-            'series_title': r['series_title'],
-            'character_name': r['character_name'],
-            'role': r['role'],
-            'image_url': img_url,
-            'script_text': r.get('script_text'),
-            'script_url': script_url,
-            'expiry_date': r.get('expiry_date'),
-            'mov_url': mov_url,
-            'last_modified': r.get('last_modified'),
-            'visible_to': r.get('visible_to',''),
-            'assigned_to': r.get('assigned_to')
-        })
-
-    
-    return jsonify(out)
-
-@app.route('/bacheca/character', methods=['POST'])
-def api_bacheca_create_character():
-    """Crea un nuovo personaggio (supporta form-data con file opzionali)"""
-    if request is None: return jsonify({'status':'error','message':'Server not configured'}), 500
     try:
-        series = request.form.get('series_title') or request.form.get('series') or ''
-        name = request.form.get('character_name') or ''
-        role = request.form.get('role') or ''
-        expiry = request.form.get('expiry_date') or ''
-        created_by = request.form.get('created_by')
-        visible_to = request.form.get('visible_to','').strip()
-        assigned_to = request.form.get('assigned_to','').strip()
+        c.execute('BEGIN IMMEDIATE')
+        fixed = _reconcile_asset_refs(c, now)
+        c.execute('SELECT path, size FROM asset_blobs WHERE refcount<=0 AND unreferenced_since<?', (cutoff,))
+        doomed = c.fetchall()
+        with _asset_lock:
+            for rel, size in doomed:
+                if _recent_blobs.get(rel, 0) >= cutoff:
+                    continue
+                c.execute('DELETE FROM asset_blobs WHERE path=? AND refcount<=0', (rel,))
+                full_path = os.path.join(BASE_DIR, rel)
+                if c.rowcount and os.path.exists(full_path):
+                    os.remove(full_path)
+                    removed += 1
+                    freed += size or 0
+            conn.commit()
 
-        if not name or not role:
-            return jsonify({'status':'error','message':'Nome e ruolo obbligatori'}), 400
+        c.execute('SELECT path FROM asset_blobs')
+        known = {r[0] for r in c.fetchall()}
+        with _asset_lock:
+            for root, _, files in os.walk(_blobs_dir()):
+                for name in files:
+                    full_path = os.path.join(root, name)
+                    rel = os.path.relpath(full_path, BASE_DIR).replace(os.sep, '/')
+                    if rel in known or _recent_blobs.get(rel, 0) >= cutoff:
+                        continue
+                    try:
+                        if os.path.getmtime(full_path) >= cutoff:
+                            continue
+                        nbytes = os.path.getsize(full_path)
+                        os.remove(full_path)
+                    except OSError:
+                        continue
+                    removed += 1
+                    freed += nbytes
+            for rel, ts in list(_recent_blobs.items()):
+                if ts < cutoff:
+                    del _recent_blobs[rel]
+    finally:
+        conn.close()
+    if removed or fixed:
+        print(f"[GC] Asset: {removed} file eliminati ({freed} byte), {fixed} contatori corretti")
+    return {'removed': removed, 'freed_bytes': freed, 'fixed_refs': fixed}
 
-        image_file = request.files.get('image_file')
-        script_file = request.files.get('script')
-        mov_file = request.files.get('mov')
+BACKGROUND_JOBS.append(PeriodicJob('asset-gc', ASSET_GC_INTERVAL, collect_asset_garbage))
 
-        conn = get_db_connection()
-        c = conn.cursor()
-        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        c.execute('INSERT INTO bacheca_characters (series_title, character_name, role, expiry_date, created_by, visible_to, last_modified, assigned_to) VALUES (?,?,?,?,?,?,?,?)',
-                  (series, name, role, expiry, created_by, visible_to, now, assigned_to))
-        conn.commit()
-        cid = c.lastrowid
-
-        updates = {}
-        if image_file:
-            img_rel = _save_uploaded_file(image_file, series, f"img_{secure_filename(name)}")
-            updates['image_path'] = img_rel
-        if script_file:
-            if not script_file.filename.endswith('.docx'):
-                c.execute('DELETE FROM bacheca_characters WHERE id=?', (cid,))
-                conn.commit()
-                conn.close()
-                return jsonify({'status':'error','message':'Il copione deve essere .docx'}), 400
-            script_rel = _save_uploaded_file(script_file, series, f"script_{secure_filename(name)}")
-            updates['script_path'] = script_rel
-        if mov_file:
-            mov_rel = _save_uploaded_file(mov_file, series, f"mov_{secure_filename(name)}")
-            updates['mov_path'] = mov_rel
+# --- Scadenza dei personaggi della bacheca ---
+def parse_expiry(text):
+    """expiry_date (testo libero) -> 'YYYY-MM-DD', o None se vuota o non riconosciuta (nessuna scadenza)"""
+    text = (text or '').strip()
+    for fmt in CHARACTER_EXPIRY_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+def expiry_today():
+    """Un personaggio è scaduto quando expires_at < oggi: il giorno di scadenza è ancora valido"""
+    return datetime.now().strftime('%Y-%m-%d')
+
+def archive_expired_characters(batch=None):
+    """Sposta i personaggi scaduti in bacheca_characters_archive e rilascia i loro file.
+    Ogni blocco è una transazione del thread scrittore: i contatori dei blob scendono insieme
+    alla DELETE e il GC elimina i file rimasti senza riferimenti. Ritorna i personaggi archiviati."""
+    batch = batch or CHARACTER_EXPIRY_BATCH
+    today = expiry_today()
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-        if updates:
-            params = ', '.join([f"{k}=?" for k in updates.keys()]) + ', last_modified=?'
-            vals = list(updates.values()) + [now, cid]
-            c.execute(f"UPDATE bacheca_characters SET {params} WHERE id=?", vals)
-            conn.commit()
+    def archive(c):
+        c.execute('SELECT id, image_path, script_path, mov_path FROM bacheca_characters '
+                  'WHERE expires_at < ? ORDER BY expires_at LIMIT ?', (today, batch))
+        rows = c.fetchall()
+        if not rows:
+            return 0
+        ids = [r[0] for r in rows]
+        marks = ','.join('?' * len(ids))
+        c.execute(f'''INSERT OR REPLACE INTO bacheca_characters_archive
+                     (id, series_title, character_name, role, script_text, expiry_date, expires_at,
+                      created_by, visible_to, assigned_to, last_modified, archived_at)
+                     SELECT id, series_title, character_name, role, script_text, expiry_date, expires_at,
+                      created_by, visible_to, assigned_to, last_modified, ?
+                     FROM bacheca_characters WHERE id IN ({marks})''', [now, *ids])
+        for r in rows:
+            for rel in r[1:]:
+                _asset_unref(c, rel)
+        c.execute(f'DELETE FROM bacheca_characters WHERE id IN ({marks})', ids)
+        return len(ids)
+
+    total = 0
+    while True:
+        n = _db_writer.execute(archive)
+        total += n
+        if n < batch:
+            break
+    if total:
+        response_cache.invalidate('characters')
+        audit(None, 'bacheca_expire', f"{total} personaggi scaduti archiviati")
+        print(f"[BACHECA] {total} personaggi scaduti archiviati")
+    return total
+
+BACKGROUND_JOBS.append(PeriodicJob('character-expiry', CHARACTER_EXPIRY_INTERVAL, archive_expired_characters))
+
+def update_db_asset_blobs():
+    """Sposta nell'archivio per contenuto i file salvati col vecchio schema (assets/bacheca/<serie>/...)"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    moved = {}
+    try:
+        for table, cols in ASSET_REF_COLUMNS:
+            for col in cols:
+                c.execute(f"SELECT id, {col} FROM {table} WHERE {col} IS NOT NULL AND {col} != ''")
+                for rid, rel in c.fetchall():
+                    if _is_blob_path(rel):
+                        continue
+                    if rel not in moved:
+                        full_path = os.path.join(BASE_DIR, rel)
+                        if not os.path.isfile(full_path):
+                            moved[rel] = None
+                            continue
+                        with open(full_path, 'rb') as f:
+                            moved[rel], _ = _store_blob(f, os.path.splitext(rel)[1].lower())
+                    if moved[rel]:
+                        c.execute(f'UPDATE {table} SET {col}=? WHERE id=?', (moved[rel], rid))
+                        _asset_ref(c, moved[rel])
+        conn.commit()
+    finally:
         conn.close()
-        audit(created_by, 'bacheca_create', f"cid={cid}")
-        return jsonify({'status':'ok', 'id': cid})
-    except Exception as e:
-        traceback.print_exc()
-        return jsonify({'status':'error','message':str(e)}), 500
+    migrated = [rel for rel, new in moved.items() if new]
+    for rel in migrated:
+        try:
+            os.remove(os.path.join(BASE_DIR, rel))
+        except OSError:
+            pass
+    if migrated:
+        print(f"[DB] {len(migrated)} file spostati nell'archivio asset")
 
+# --- Backup online (API di backup di SQLite) ---
+_backup_lock = threading.Lock()
+_BACKUP_NAME = re.compile(r'^timbracart_\d{8}_\d{6}(_[\w-]+)?\.db$')
 
-@app.route('/bacheca/character/<int:cid>/delete', methods=['POST'])
-def api_bacheca_delete_character(cid):
-    """Endpoint dedicato per eliminare un personaggio"""
-    if request is None: return jsonify({'status':'error','message':'Server not configured'}), 500
-    
+class BackupInProgress(RuntimeError):
+    pass
+
+class _BackupRestarted(Exception):
+    pass
+
+def _backup_dir():
+    return BACKUP_DIR or os.path.join(BASE_DIR, 'backups')
+
+def verify_backup(path):
+    """PRAGMA integrity_check su una copia: ritorna la lista dei problemi (vuota se integra)"""
     try:
-        print(f"[SERVER] Richiesta DELETE per personaggio ID: {cid}")
-        conn = get_db_connection()
-        c = conn.cursor()
-        # Recupera i file da eliminare
-        c.execute('SELECT image_path, script_path, mov_path FROM bacheca_characters WHERE id=?', (cid,))
-        r = c.fetchone()
-        
-        if not r:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            result = [r[0] for r in conn.execute('PRAGMA integrity_check').fetchall()]
+        finally:
             conn.close()
-            print(f"[SERVER] Personaggio {cid} non trovato")
-            return jsonify({'status':'error','message':'Personaggio non trovato'}), 404
-        
-        print(f"[SERVER] Personaggio trovato, eliminazione file...")
-        # Elimina i file fisici
-        for file_path in [r[0], r[1], r[2]]:
-            if file_path:
-                full_path = os.path.join(BASE_DIR, file_path)
-                if os.path.exists(full_path):
-                    try:
-                        os.remove(full_path)
-                        print(f"[SERVER] File eliminato: {full_path}")
-                    except Exception as e:
-                        print(f"[SERVER] Errore eliminazione file {full_path}: {e}")
-        
-        # Elimina il record dal database
-        c.execute('DELETE FROM bacheca_characters WHERE id=?', (cid,))
+    except sqlite3.DatabaseError as e:
+        return [str(e)]
+    return [] if result == ['ok'] else result
+
+def _backup_companion(path):
+    """timbracart_<data>.db[.tmp] -> timbracart_<data>.archive.db[.tmp]"""
+    if path.endswith('.tmp'):
+        return _backup_companion(path[:-4]) + '.tmp'
+    return path[:-3] + '.archive.db'
+
+def _backup_copy(src_path, dst_path):
+    """Copia a passi con l'API di backup; ritorna le ripartenze dovute alle scritture concorrenti"""
+    state = {'remaining': None, 'restarts': 0}
+
+    def progress(status, remaining, total):
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+        state['remaining'] = remaining
+        if state['restarts'] >= BACKUP_MAX_RESTARTS:
+            raise _BackupRestarted()
+        time.sleep(BACKUP_SLEEP)
+
+    src = sqlite3.connect(src_path)
+    try:
+        dst = sqlite3.connect(dst_path)
+        try:
+            try:
+                src.backup(dst, pages=BACKUP_PAGES, progress=progress)
+            except _BackupRestarted:
+                # Troppe scritture concorrenti: copia in un passo (blocca gli scrittori per poco)
+                src.backup(dst, pages=-1)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    return state['restarts']
+
+def backup_database(dest_dir=None, label=None):
+    """Copia coerente del database mentre il server scrive.
+    sqlite3.Connection.backup copia BACKUP_PAGES pagine per passo e tra un passo e l'altro
+    si dorme BACKUP_SLEEP secondi: gli scrittori aspettano al massimo un passo.
+    Se il database viene modificato SQLite riparte da capo; dopo BACKUP_MAX_RESTARTS
+    ripartenze si copia tutto in un solo passo. La copia viene verificata prima di
+    comparire con il suo nome definitivo."""
+    if not _backup_lock.acquire(blocking=False):
+        raise BackupInProgress('Backup già in corso')
+    tmp_path = None
+    try:
+        dest_dir = dest_dir or _backup_dir()
+        os.makedirs(dest_dir, exist_ok=True)
+        name = f"timbracart_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        if label:
+            name += '_' + secure_filename(label)
+        final_path = os.path.join(dest_dir, name + '.db')
+        tmp_path = final_path + '.tmp'
+        t0 = time.perf_counter()
+        restarts = _backup_copy(DB_PATH, tmp_path)
+        problems = verify_backup(tmp_path)
+        if problems:
+            raise RuntimeError(f"Backup non integro: {'; '.join(problems[:5])}")
+        # L'archivio dei log vecchi viaggia con il suo backup (<nome>.archive.db)
+        if os.path.exists(_archive_path()):
+            archive_tmp = _backup_companion(tmp_path)
+            restarts += _backup_copy(_archive_path(), archive_tmp)
+            problems = verify_backup(archive_tmp)
+            if problems:
+                raise RuntimeError(f"Backup dell'archivio non integro: {'; '.join(problems[:5])}")
+            os.replace(archive_tmp, _backup_companion(final_path))
+        os.replace(tmp_path, final_path)
+        info = {'file': os.path.basename(final_path), 'path': final_path, 'size': os.path.getsize(final_path),
+                'seconds': round(time.perf_counter() - t0, 3), 'restarts': restarts, 'integrity': 'ok'}
+        print(f"[BACKUP] {info['file']}: {info['size']} byte in {info['seconds']}s (ripartenze: {info['restarts']})")
+        audit(None, 'backup', f"{info['file']} size={info['size']}")
+        return info
+    except BaseException:
+        for path in (tmp_path, tmp_path and _backup_companion(tmp_path)):
+            if path and os.path.exists(path):
+                os.remove(path)
+        raise
+    finally:
+        _backup_lock.release()
+
+def list_backups(dest_dir=None):
+    """Backup presenti, dal più recente"""
+    dest_dir = dest_dir or _backup_dir()
+    if not os.path.isdir(dest_dir):
+        return []
+    out = []
+    for name in os.listdir(dest_dir):
+        if _BACKUP_NAME.match(name):
+            st = os.stat(os.path.join(dest_dir, name))
+            out.append({'file': name, 'size': st.st_size,
+                        'created': datetime.fromtimestamp(st.st_mtime).strftime('%Y-%m-%d %H:%M:%S')})
+    return sorted(out, key=lambda b: b['file'], reverse=True)
+
+def prune_backups(keep=None, dest_dir=None):
+    """Conserva solo gli ultimi `keep` backup; ritorna i file eliminati"""
+    keep = BACKUP_KEEP if keep is None else keep
+    dest_dir = dest_dir or _backup_dir()
+    removed = []
+    for b in list_backups(dest_dir)[keep:]:
+        try:
+            path = os.path.join(dest_dir, b['file'])
+            if os.path.exists(_backup_companion(path)):
+                os.remove(_backup_companion(path))
+            os.remove(path)
+            removed.append(b['file'])
+        except OSError as e:
+            print(f"[BACKUP] Impossibile eliminare {b['file']}: {e}")
+    if removed:
+        print(f"[BACKUP] Retention: {len(removed)} backup eliminati")
+    return removed
+
+def scheduled_backup():
+    """Backup se l'ultimo è più vecchio di BACKUP_INTERVAL (anche dopo un riavvio del server)"""
+    latest = list_backups()
+    if latest and time.time() - os.path.getmtime(os.path.join(_backup_dir(), latest[0]['file'])) < BACKUP_INTERVAL:
+        return None
+    info = backup_database(label='auto')
+    prune_backups()
+    return info
+
+BACKGROUND_JOBS.append(PeriodicJob('backup', BACKUP_CHECK_INTERVAL, scheduled_backup))
+
+# --- Archivio dei log vecchi (database collegato con ATTACH) ---
+_archive_lock = threading.Lock()
+# Le righe con una richiesta di rimozione in sospeso restano nel database principale
+_NOT_PENDING_REMOVAL = ("id NOT IN (SELECT work_log_id FROM removal_requests "
+                        "WHERE status='pending' AND work_log_id IS NOT NULL)")
+
+class ArchiveInProgress(RuntimeError):
+    pass
+
+def _archive_path():
+    return ARCHIVE_DB_PATH or os.path.join(os.path.dirname(DB_PATH), 'timbracart_archive.db')
+
+def _archive_attached(conn):
+    return any(r[1] == 'archive' for r in conn.execute('PRAGMA database_list'))
+
+def attach_archive(conn):
+    """Collega l'archivio come schema 'archive' (fuori da una transazione)"""
+    if not _archive_attached(conn):
+        conn.execute('ATTACH DATABASE ? AS archive', (_archive_path(),))
+
+def init_archive_db(conn):
+    """Schema dell'archivio (connessione aperta direttamente sul file dell'archivio).
+    batch = lotto che ha spostato la riga: le letture considerano solo i lotti confermati."""
+    c = conn.cursor()
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS work_logs (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        date TEXT,
+        hours REAL,
+        reason TEXT,
+        batch INTEGER
+    )
+    ''')
+    # Stessi indici coprenti del database principale (report per periodo e per utente)
+    c.execute('CREATE INDEX IF NOT EXISTS idx_archive_date ON work_logs(date, user_id, hours, batch)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_archive_user_date ON work_logs(user_id, date, hours, batch)')
+    conn.commit()
+
+def begin_logs_read(conn, date_from=None):
+    """BEGIN di lettura sui log. Se l'intervallo che parte da date_from (None = tutto)
+    arriva nell'archivio lo collega e ritorna l'ultimo lotto confermato, altrimenti None:
+    gli intervalli recenti leggono solo work_logs. Lotto e righe escono dalla stessa
+    fotografia del database principale."""
+    while True:
+        conn.execute('BEGIN')
+        batch, max_date = conn.execute('SELECT MAX(id), MAX(max_date) FROM archive_batches').fetchone()
+        if batch is None or (date_from is not None and date_from > max_date):
+            return None
+        if _archive_attached(conn):
+            return batch
+        conn.rollback()  # ATTACH non si può fare dentro una transazione
+        attach_archive(conn)
+
+def work_logs_tables(batch):
+    """Tabelle dei log per il lotto di begin_logs_read: [(tabella, condizione su w, parametri)].
+    Per aggregare conviene interrogarle una per una (indici coprenti) e sommare i parziali."""
+    if batch is None:
+        return [('work_logs', '1', [])]
+    return [('work_logs', '1', []), ('archive.work_logs', 'w.batch <= ?', [batch])]
+
+def work_logs_source(batch):
+    """Sorgente SQL unica dei log (da usare con alias w): work_logs, più l'archivio fino al lotto `batch`.
+    Ritorna (sql, parametri); i filtri esterni su date e utente scendono in entrambi i rami."""
+    if batch is None:
+        return 'work_logs', []
+    return ('(SELECT id, user_id, date, hours, reason FROM work_logs UNION ALL '
+            'SELECT id, user_id, date, hours, reason FROM archive.work_logs WHERE batch <= ?)', [batch])
+
+def archive_old_logs(days=None):
+    """Sposta nell'archivio i log più vecchi di `days` giorni, a lotti di ARCHIVE_BATCH righe.
+    Per ogni lotto, con il lock di scrittura del database principale:
+    1. le righe vengono scritte e confermate nell'archivio;
+    2. nel database principale si aggiornano i totali mensili, si eliminano le righe
+       e si registra il lotto, tutto in un commit.
+    Se il processo si ferma tra i due passi le righe restano nel database principale
+    e quelle già copiate non sono visibili (lotto non registrato): niente doppi conteggi.
+    Lo spostamento non finisce nel change log: per i client non è una cancellazione."""
+    days = ARCHIVE_AFTER_DAYS if days is None else days
+    if days is None:
+        return None
+    if not _archive_lock.acquire(blocking=False):
+        raise ArchiveInProgress('Archiviazione già in corso')
+    horizon = (datetime.now().date() - timedelta(days=days)).isoformat()
+    moved = batches = 0
+    t0 = time.perf_counter()
+    conn = get_db_connection()
+    arc = sqlite3.connect(_archive_path())
+    try:
+        init_archive_db(arc)
+        c = conn.cursor()
+        while True:
+            c.execute('BEGIN IMMEDIATE')
+            # Fine del lotto: si sposta tutto fino a quel timestamp compreso
+            c.execute(f"SELECT date FROM work_logs WHERE date < ? AND {_NOT_PENDING_REMOVAL} "
+                      "ORDER BY date LIMIT 1 OFFSET ?", (horizon, ARCHIVE_BATCH - 1))
+            r = c.fetchone()
+            if r is None:
+                c.execute(f"SELECT MAX(date) FROM work_logs WHERE date < ? AND {_NOT_PENDING_REMOVAL}", (horizon,))
+                r = c.fetchone()
+            if r[0] is None:
+                conn.rollback()
+                break
+            where = f"date <= ? AND date < ? AND {_NOT_PENDING_REMOVAL}"
+            params = (r[0], horizon)
+            batch = c.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM archive_batches').fetchone()[0]
+            rows = c.execute(f"SELECT id, user_id, date, hours, reason FROM work_logs WHERE {where}", params).fetchall()
+
+            # 1. archivio (eliminando prima i resti di un lotto interrotto)
+            arc.execute('DELETE FROM work_logs WHERE batch >= ?', (batch,))
+            arc.executemany('INSERT OR REPLACE INTO work_logs (id, user_id, date, hours, reason, batch) VALUES (?,?,?,?,?,?)',
+                            [tuple(row) + (batch,) for row in rows])
+            arc.commit()
+
+            # 2. database principale
+            c.execute(f'''INSERT INTO work_log_rollups (user_id, month, hours, entries)
+                          SELECT user_id, substr(date, 1, 7), COALESCE(SUM(hours), 0), COUNT(*)
+                          FROM work_logs WHERE {where} GROUP BY user_id, substr(date, 1, 7)
+                          ON CONFLICT(user_id, month) DO UPDATE SET
+                          hours = hours + excluded.hours, entries = entries + excluded.entries''', params)
+            # Cancellazioni fuori dal change log (la riga di pausa non sopravvive al commit)
+            c.execute('INSERT INTO change_log_paused (entity) VALUES (?)', (CHANGE_TRACKED['work_logs'][0],))
+            c.execute(f'DELETE FROM work_logs WHERE {where}', params)
+            c.execute('DELETE FROM change_log_paused WHERE entity=?', (CHANGE_TRACKED['work_logs'][0],))
+            c.execute('INSERT INTO archive_batches (id, archived_at, horizon, rows, max_date) VALUES (?,?,?,?,?)',
+                      (batch, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), horizon, len(rows),
+                       max(row['date'] for row in rows)))
+            conn.commit()
+            moved += len(rows)
+            batches += 1
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        arc.close()
+        conn.close()
+        _archive_lock.release()
+    info = {'horizon': horizon, 'moved': moved, 'batches': batches, 'seconds': round(time.perf_counter() - t0, 3)}
+    if moved:
+        response_cache.invalidate('work_logs')
+        print(f"[ARCHIVE] {moved} log precedenti al {horizon} archiviati in {batches} lotti ({info['seconds']}s)")
+        audit(None, 'archive_logs', f"horizon={horizon} rows={moved} batches={batches}")
+    return info
+
+BACKGROUND_JOBS.append(PeriodicJob('archive', ARCHIVE_INTERVAL, archive_old_logs))
+
+def maintain_database():
+    """Manutenzione periodica: ANALYZE (campionato), PRAGMA optimize e incremental_vacuum
+    a passi di MAINTENANCE_VACUUM_PAGES, così il database principale resta compatto.
+    Un database creato prima di auto_vacuum=INCREMENTAL non si compatta a passi: il VACUUM
+    completo che lo converte tiene il lock di scrittura per tutta la sua durata e si fa
+    a server fermo con aggiorna_database.py; qui ci si limita a segnalarlo."""
+    t0 = time.perf_counter()
+    conn = get_db_connection()
+    try:
+        conn.execute(f'PRAGMA analysis_limit = {int(MAINTENANCE_ANALYZE_LIMIT)}')
+        if os.path.exists(_archive_path()):
+            attach_archive(conn)
+        conn.execute('ANALYZE')
+        conn.execute('PRAGMA optimize')
         conn.commit()
-        rows_affected = c.rowcount
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        pages = conn.execute('PRAGMA page_count').fetchone()[0]
+        mode = conn.execute('PRAGMA main.auto_vacuum').fetchone()[0]
+        vacuumed = 0
+        if mode == 2:  # INCREMENTAL
+            while free:
+                conn.execute(f'PRAGMA main.incremental_vacuum({MAINTENANCE_VACUUM_PAGES})').fetchall()
+                remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                vacuumed += free - remaining
+                if remaining >= free:
+                    break
+                free = remaining
+        elif free > pages * MAINTENANCE_VACUUM_RATIO:
+            print(f"[MAINT] {free} pagine libere su {pages}: database senza auto_vacuum incrementale, "
+                  "convertirlo a server fermo con aggiorna_database.py")
+    finally:
         conn.close()
-        
-        print(f"[SERVER] Righe eliminate: {rows_affected}")
+    info = {'freed_pages': vacuumed, 'page_count': pages - vacuumed, 'seconds': round(time.perf_counter() - t0, 3)}
+    print(f"[MAINT] ANALYZE/optimize, {vacuumed} pagine liberate ({info['seconds']}s)")
+    return info
+
+BACKGROUND_JOBS.append(PeriodicJob('db-maintenance', MAINTENANCE_INTERVAL, maintain_database))
+
+def archive_and_maintain(days=None):
+    """Archiviazione richiesta da un admin, seguita dalla manutenzione che recupera lo spazio liberato"""
+    info = archive_old_logs(days)
+    maintain_database()
+    return info
+
+_archive_now = OneShotJob('archive-now', archive_and_maintain)
+
+# --- Copioni .docx: estrazione testo e anteprima ---
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+def _docx_paragraph(p):
+    """Un paragrafo Word -> (testo, html). Titoli, grassetto, corsivo, tab e a capo."""
+    text_parts = []
+    html_parts = []
+    for run in p.iter(f'{_W}r'):
+        chunk = []
+        for child in run:
+            if child.tag == f'{_W}t':
+                chunk.append(child.text or '')
+            elif child.tag == f'{_W}tab':
+                chunk.append('\t')
+            elif child.tag in (f'{_W}br', f'{_W}cr'):
+                chunk.append('\n')
+        chunk = ''.join(chunk)
+        if not chunk:
+            continue
+        text_parts.append(chunk)
+        frag = html_escape(chunk).replace('\n', '<br>')
+        rpr = run.find(f'{_W}rPr')
+        if rpr is not None:
+            for tag, html_tag in (('b', 'b'), ('i', 'i'), ('u', 'u')):
+                el = rpr.find(f'{_W}{tag}')
+                if el is not None and el.get(f'{_W}val') not in ('0', 'false', 'none'):
+                    frag = f'<{html_tag}>{frag}</{html_tag}>'
+        html_parts.append(frag)
+    text = ''.join(text_parts)
+    if not text.strip():
+        return text, ''
+    style = p.find(f'{_W}pPr/{_W}pStyle')
+    style = (style.get(f'{_W}val') or '').lower() if style is not None else ''
+    if style in ('title', 'titolo'):
+        tag = 'h1'
+    elif style.startswith(('heading', 'titolo')):
+        digits = ''.join(ch for ch in style if ch.isdigit())
+        tag = f'h{min(int(digits or 1) + 1, 6)}'
+    else:
+        tag = 'p'
+    return text, f'<{tag}>{"".join(html_parts)}</{tag}>'
+
+def extract_docx(path):
+    """Estrae da un .docx il testo completo e un'anteprima HTML leggera (solo zipfile + ElementTree)"""
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo('word/document.xml')
+        if info.file_size > SCRIPT_MAX_XML_SIZE:
+            raise ValueError('word/document.xml troppo grande')
+        root = ET.fromstring(zf.read(info))
+    body = root.find(f'{_W}body')
+    lines = []
+    html_parts = []
+    preview_chars = 0
+    for block in (body if body is not None else []):
+        if block.tag == f'{_W}p':
+            text, html_p = _docx_paragraph(block)
+            lines.append(text)
+            if html_p and preview_chars < SCRIPT_PREVIEW_MAX_CHARS:
+                html_parts.append(html_p)
+                preview_chars += len(text)
+        elif block.tag == f'{_W}tbl':
+            rows = []
+            for tr in block.iter(f'{_W}tr'):
+                cells = ['\n'.join(_docx_paragraph(p)[0] for p in tc.iter(f'{_W}p')) for tc in tr.findall(f'{_W}tc')]
+                lines.append('\t'.join(cells))
+                rows.append(cells)
+            if rows and preview_chars < SCRIPT_PREVIEW_MAX_CHARS:
+                html_rows = ''.join('<tr>' + ''.join(f'<td>{html_escape(cell)}</td>' for cell in row) + '</tr>'
+                                    for row in rows)
+                html_parts.append(f'<table border="1" cellpadding="4">{html_rows}</table>')
+                preview_chars += sum(len(cell) for row in rows for cell in row)
+    if preview_chars >= SCRIPT_PREVIEW_MAX_CHARS:
+        html_parts.append('<p><i>… anteprima troncata: scarica il copione per il testo completo</i></p>')
+    return '\n'.join(lines).strip(), '\n'.join(html_parts)
+
+def extract_character_script(cid):
+    """Aggiorna script_text e script_preview_html di un personaggio dal suo .docx.
+    Ritorna (testo, html), (None, html di ripiego) se il .docx non è leggibile
+    oppure None se il personaggio non ha copione."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    try:
+        c.execute('SELECT script_path FROM bacheca_characters WHERE id=?', (cid,))
+        r = c.fetchone()
+        if not r or not r[0]:
+            return None
+        script_rel = r[0]
+        t0 = time.perf_counter()
+        try:
+            text, preview = extract_docx(os.path.join(BASE_DIR, script_rel))
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile, ET.ParseError) as e:
+            print(f"[SCRIPT] Estrazione fallita per cid={cid}: {e}")
+            # Si salva comunque un'anteprima per non ritentare a ogni richiesta; il testo del copione
+            # precedente non vale più (né per la lista né per l'indice di ricerca)
+            preview = '<p><i>Anteprima non disponibile per questo copione</i></p>'
+            c.execute('UPDATE bacheca_characters SET script_text=NULL, script_preview_html=? WHERE id=? AND script_path=?',
+                      (preview, cid, script_rel))
+            conn.commit()
+            response_cache.invalidate('characters')
+            return None, preview
+        METRICS.observe_file_io('docx_extract', time.perf_counter() - t0, len(text))
+        # AND script_path=?: se nel frattempo è arrivato un altro copione, il risultato è obsoleto
+        c.execute('UPDATE bacheca_characters SET script_text=?, script_preview_html=? WHERE id=? AND script_path=?',
+                  (text, preview, cid, script_rel))
+        conn.commit()
+        response_cache.invalidate('characters')  # script_text fa parte della lista personaggi
+        return text, preview
+    finally:
+        conn.close()
+
+class ScriptExtractor:
+    """Coda di estrazione dei copioni: l'upload risponde subito, il testo arriva poco dopo"""
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.done = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, cid):
+        with self._lock:
+            if not (self._thread and self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name='script-extractor', daemon=True)
+                self._thread.start()
+        self.queue.put(cid)
+
+    def flush(self):
+        """Attende che le estrazioni accodate siano terminate"""
+        if self._thread and self._thread.is_alive():
+            self.queue.join()
+
+    def _run(self):
+        while True:
+            cid = self.queue.get()
+            try:
+                extract_character_script(cid)
+                self.done += 1
+            except Exception as e:
+                print(f"[SCRIPT] Errore estrazione cid={cid}: {e}")
+            finally:
+                self.queue.task_done()
+
+_script_extractor = ScriptExtractor()
+
+def enqueue_missing_script_previews():
+    """All'avvio: estrae i copioni caricati prima dell'introduzione delle anteprime"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("SELECT id FROM bacheca_characters WHERE script_path IS NOT NULL AND script_path != '' "
+              "AND script_preview_html IS NULL")
+    ids = [r[0] for r in c.fetchall()]
+    conn.close()
+    for cid in ids:
+        _script_extractor.submit(cid)
+    if ids:
+        print(f"[SCRIPT] {len(ids)} copioni accodati per l'estrazione")
+
+def _send_file_timed(path, **kwargs):
+    """send_file con misura del tempo di I/O (stat e apertura del file).
+    Il trasferimento vero e proprio lo fa il server WSGI (file_wrapper) e non è misurabile qui."""
+    t0 = time.perf_counter()
+    response = send_file(path, **kwargs)
+    METRICS.observe_file_io('send_file', time.perf_counter() - t0, response.content_length or 0)
+    return response
+
+# --- Metriche ---
+class _Histogram:
+    __slots__ = ('buckets', 'sum', 'count')
+
+    def __init__(self):
+        self.buckets = [0] * len(METRICS_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(METRICS_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+def _label_str(labels):
+    parts = []
+    for k, v in labels:
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{k}="{v}"')
+    return '{' + ','.join(parts) + '}'
+
+class Metrics:
+    """Contatori, gauge e istogrammi in memoria, serializzati in formato Prometheus"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}        # (route, method, status) -> conteggio
+        self.latency = {}         # (route, method) -> _Histogram
+        self.db_time = {}         # (route, method) -> _Histogram
+        self.db_queries = {}      # (route, method) -> conteggio query
+        self.request_bytes = {}   # (route, method) -> byte ricevuti
+        self.response_bytes = {}  # (route, method) -> byte inviati
+        self.in_flight = {}       # route -> richieste in corso
+        self.file_io = {}         # op -> _Histogram
+        self.file_io_bytes = {}   # op -> byte
+        self.gauges = {}          # nome -> funzione che ritorna il valore corrente
+
+    def request_started(self, route):
+        with self._lock:
+            self.in_flight[route] = self.in_flight.get(route, 0) + 1
+
+    def request_finished(self, route, method, status, seconds, req_bytes, resp_bytes, db_seconds, db_queries):
+        key = (route, method)
+        with self._lock:
+            self.in_flight[route] = self.in_flight.get(route, 1) - 1
+            rkey = (route, method, status)
+            self.requests[rkey] = self.requests.get(rkey, 0) + 1
+            self.latency.setdefault(key, _Histogram()).observe(seconds)
+            self.db_time.setdefault(key, _Histogram()).observe(db_seconds)
+            self.db_queries[key] = self.db_queries.get(key, 0) + db_queries
+            self.request_bytes[key] = self.request_bytes.get(key, 0) + req_bytes
+            self.response_bytes[key] = self.response_bytes.get(key, 0) + resp_bytes
+
+    def observe_file_io(self, op, seconds, nbytes=0):
+        with self._lock:
+            self.file_io.setdefault(op, _Histogram()).observe(seconds)
+            self.file_io_bytes[op] = self.file_io_bytes.get(op, 0) + nbytes
+
+    def register_gauge(self, name, help_text, fn):
+        self.gauges[name] = (help_text, fn)
+
+    def render(self):
+        p = METRICS_PREFIX
+        out = []
+
+        def counter(name, help_text, data, label_names, kind='counter'):
+            out.append(f"# HELP {p}_{name} {help_text}")
+            out.append(f"# TYPE {p}_{name} {kind}")
+            for key, value in sorted(data.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                out.append(f"{p}_{name}{_label_str(zip(label_names, key))} {value}")
+
+        def histogram(name, help_text, data, label_names):
+            out.append(f"# HELP {p}_{name} {help_text}")
+            out.append(f"# TYPE {p}_{name} histogram")
+            for key, h in sorted(data.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                labels = list(zip(label_names, key))
+                cumulative = 0
+                for bound, n in zip(METRICS_BUCKETS, h.buckets):
+                    cumulative += n
+                    out.append(f"{p}_{name}_bucket{_label_str(labels + [('le', bound)])} {cumulative}")
+                out.append(f"{p}_{name}_bucket{_label_str(labels + [('le', '+Inf')])} {h.count}")
+                out.append(f"{p}_{name}_sum{_label_str(labels)} {h.sum:.6f}")
+                out.append(f"{p}_{name}_count{_label_str(labels)} {h.count}")
+
+        with self._lock:
+            counter('http_requests_total', 'Richieste HTTP per route, metodo e stato', self.requests, ('route', 'method', 'status'))
+            histogram('http_request_duration_seconds', 'Latenza delle richieste HTTP', self.latency, ('route', 'method'))
+            histogram('db_time_seconds', 'Tempo speso in SQLite per richiesta', self.db_time, ('route', 'method'))
+            counter('db_queries_total', 'Query SQLite eseguite', self.db_queries, ('route', 'method'))
+            counter('http_request_bytes_total', 'Byte ricevuti nei corpi richiesta', self.request_bytes, ('route', 'method'))
+            counter('http_response_bytes_total', 'Byte inviati nelle risposte', self.response_bytes, ('route', 'method'))
+            counter('http_requests_in_flight', 'Richieste in corso', self.in_flight, ('route',), kind='gauge')
+            histogram('file_io_seconds', 'Tempo di I/O su file (upload e send_file)', self.file_io, ('op',))
+            counter('file_io_bytes_total', 'Byte letti/scritti su file', self.file_io_bytes, ('op',))
+            gauges = list(self.gauges.items())
+        for name, (help_text, fn) in gauges:
+            try:
+                value = fn()
+            except Exception:
+                continue
+            out.append(f"# HELP {p}_{name} {help_text}")
+            out.append(f"# TYPE {p}_{name} gauge")
+            out.append(f"{p}_{name} {value}")
+        return '\n'.join(out) + '\n'
+
+METRICS = Metrics()
+METRICS.register_gauge('audit_queue_size', 'Eventi audit in attesa di scrittura', lambda: _audit_writer.queue.qsize())
+METRICS.register_gauge('audit_written_total', 'Eventi audit scritti', lambda: _audit_writer.written)
+METRICS.register_gauge('audit_dropped_total', 'Eventi audit scartati per coda piena', lambda: _audit_writer.dropped)
+METRICS.register_gauge('write_queue_size', 'Scritture in attesa del thread scrittore', lambda: _db_writer.queue.qsize())
+METRICS.register_gauge('write_operations_total', 'Scritture confermate dal thread scrittore', lambda: _db_writer.operations)
+METRICS.register_gauge('write_transactions_total', 'Transazioni (commit di gruppo) del thread scrittore', lambda: _db_writer.transactions)
+METRICS.register_gauge('write_failed_total', 'Scritture fallite o annullate', lambda: _db_writer.failed)
+
+# Statistiche della richiesta corrente (thread-local: valgono anche durante lo streaming)
+_request_stats = threading.local()
+
+class _TimedCursor(sqlite3.Cursor):
+    """Cursore che accumula il tempo SQLite nella richiesta corrente"""
+    def _timed(self, fn, *args):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            stats = getattr(_request_stats, 'current', None)
+            if stats is not None:
+                stats['db_seconds'] += time.perf_counter() - t0
+                stats['db_queries'] += 1
+
+    def execute(self, *args):
+        return self._timed(super().execute, *args)
+
+    def executemany(self, *args):
+        return self._timed(super().executemany, *args)
+
+    def fetchone(self):
+        return self._timed(super().fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed(super().fetchmany, *args)
+
+    def fetchall(self):
+        return self._timed(super().fetchall)
+
+class _TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+# Questi hook vanno registrati prima di tutti gli altri: before_request gira per primo
+# (conta anche le richieste respinte dagli hook successivi e legge il Content-Length prima
+# che _decompress_request lo riscriva), after_request gira per ultimo (vede i byte compressi)
+@app.before_request
+def _metrics_start():
+    route = request.url_rule.rule if request.url_rule else '<unmatched>'
+    _request_stats.current = {'route': route, 'start': time.perf_counter(), 'db_seconds': 0.0, 'db_queries': 0,
+                              'req_bytes': request.content_length or 0}
+    METRICS.request_started(route)
+
+@app.after_request
+def _metrics_finish(response):
+    """Chiude la misura alla fine del trasferimento (anche per le risposte in streaming)"""
+    stats = getattr(_request_stats, 'current', None)
+    if stats is None:
+        return response
+    stats['finalized'] = True
+    method = request.method
+    req_bytes = stats['req_bytes']
+    status = response.status_code
+    if response.is_streamed and not response.direct_passthrough:
+        counted = [0]
+        inner = response.response
+
+        def counting():
+            try:
+                for chunk in inner:
+                    counted[0] += len(chunk)
+                    yield chunk
+            finally:
+                if hasattr(inner, 'close'):
+                    inner.close()
+        response.response = counting()
+        resp_bytes = lambda: counted[0]
+    else:
+        length = response.content_length or 0
+        resp_bytes = lambda: length
+
+    def finish():
+        METRICS.request_finished(stats['route'], method, status, time.perf_counter() - stats['start'],
+                                 req_bytes, resp_bytes(), stats['db_seconds'], stats['db_queries'])
+        if getattr(_request_stats, 'current', None) is stats:
+            _request_stats.current = None
+    if response.direct_passthrough:
+        # Werkzeug non chiama close() sulle risposte passthrough (send_file)
+        finish()
+    else:
+        response.call_on_close(finish)
+    return response
+
+@app.teardown_request
+def _metrics_teardown(exc):
+    # Se after_request non è stato eseguito la richiesta non resta "in corso" per sempre
+    stats = getattr(_request_stats, 'current', None)
+    if stats is not None and not stats.get('finalized'):
+        METRICS.request_finished(stats['route'], request.method, 500, time.perf_counter() - stats['start'],
+                                 stats['req_bytes'], 0, stats['db_seconds'], stats['db_queries'])
+        _request_stats.current = None
+
+# --- Rate limiting e load shedding ---
+class TokenBucketLimiter:
+    """Token bucket per (client, route), condivisi da tutti i thread del server"""
+    def __init__(self, max_buckets=RATE_LIMIT_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()  # (client, route) -> [token, ultimo aggiornamento]
+        self._lock = threading.Lock()
+
+    def acquire(self, client, route):
+        """Consuma un token: ritorna 0 se la richiesta passa, altrimenti i secondi da attendere"""
+        limit = RATE_LIMITS.get(route, RATE_LIMIT_DEFAULT)
+        if limit is None:
+            return 0
+        rate, burst = limit
+        key = (client, route)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(burst), now]
+                if len(self._buckets) > self.max_buckets:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(float(burst), bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+class _SlotRelease:
+    """Rilascia una sola volta gli slot di concorrenza presi da una richiesta"""
+    def __init__(self, slots):
+        self.slots = slots
+        self.scheduled = False
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            slots, self.slots = self.slots, []
+        for sem in slots:
+            sem.release()
+
+_rate_limiter = TokenBucketLimiter()
+_server_slots = threading.BoundedSemaphore(SERVER_MAX_IN_FLIGHT)
+_route_slots = {route: threading.BoundedSemaphore(n) for route, n in CONCURRENCY_LIMITS.items()}
+_rejections = {'rate_limited': 0, 'shed': 0}
+_rejections_lock = threading.Lock()
+
+METRICS.register_gauge('rate_limited_total', 'Richieste respinte con 429 dal rate limiter', lambda: _rejections['rate_limited'])
+METRICS.register_gauge('load_shed_total', 'Richieste respinte con 503 per sovraccarico', lambda: _rejections['shed'])
+METRICS.register_gauge('rate_limit_buckets', 'Bucket del rate limiter in memoria', lambda: len(_rate_limiter))
+
+def _reject(reason, status, message, retry_after):
+    with _rejections_lock:
+        _rejections[reason] += 1
+    resp = jsonify({'status': 'error', 'message': message})
+    resp.status_code = status
+    resp.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return resp
+
+@app.before_request
+def _rate_limit():
+    if not RATE_LIMIT_ENABLED or request.url_rule is None:
+        return None
+    route = request.url_rule.rule
+    if RATE_LIMITS.get(route, RATE_LIMIT_DEFAULT) is None:
+        return None
+    wait = _rate_limiter.acquire(request.remote_addr or '-', route)
+    if wait:
+        return _reject('rate_limited', 429, 'Troppe richieste, riprova tra poco', wait)
+    # Load shedding: meglio un 503 immediato che una coda di thread che fa cadere il server
+    taken = []
+    for sem in (_server_slots, _route_slots.get(route)):
+        if sem is None:
+            continue
+        if not sem.acquire(blocking=False):
+            for held in taken:
+                held.release()
+            return _reject('shed', 503, 'Server sovraccarico, riprova tra poco', LOAD_SHED_RETRY_AFTER)
+        taken.append(sem)
+    request.environ['badgeempire.slots'] = _SlotRelease(taken)
+    return None
+
+@app.after_request
+def _rate_limit_release(response):
+    """Gli slot restano occupati fino alla fine del trasferimento (anche in streaming)"""
+    release = request.environ.get('badgeempire.slots')
+    if release is None:
+        return response
+    release.scheduled = True
+    if response.direct_passthrough:
+        release()
+    else:
+        response.call_on_close(release)
+    return response
+
+@app.teardown_request
+def _rate_limit_teardown(exc):
+    release = request.environ.get('badgeempire.slots')
+    if release is not None and not release.scheduled:
+        release()
+
+@app.errorhandler(WriteUnavailable)
+def _write_unavailable(e):
+    """Scrittura non eseguita (coda piena o database occupato): il client può ritentare"""
+    return _reject('shed', 503, str(e), LOAD_SHED_RETRY_AFTER)
+
+# --- Compressione HTTP ---
+def _negotiate_encoding():
+    """Sceglie la codifica migliore tra quelle accettate dal client"""
+    offered = ['br', 'gzip', 'deflate'] if BROTLI_AVAILABLE else ['gzip', 'deflate']
+    return request.accept_encodings.best_match(offered)
+
+class _StreamCompressor:
+    """Compressore incrementale: ogni chunk viene svuotato subito (sync flush)"""
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._c = brotli.Compressor(quality=4)
+        else:
+            wbits = 31 if encoding == 'gzip' else 15
+            self._c = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, wbits)
+
+    def compress(self, chunk):
+        if self.encoding == 'br':
+            return self._c.process(chunk) + self._c.flush()
+        return self._c.compress(chunk) + self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._c.finish()
+        return self._c.flush(zlib.Z_FINISH)
+
+def _compress_bytes(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(data, COMPRESS_LEVEL)
+    return zlib.compress(data, COMPRESS_LEVEL)
+
+def _compress_stream(chunks, encoding):
+    """Comprime una risposta in streaming senza bufferizzarla"""
+    comp = _StreamCompressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = comp.compress(chunk)
+            if data:
+                yield data
+        yield comp.finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+def _brotli_decompress(data, limit):
+    """Decompressione brotli incrementale che si ferma dopo `limit` byte di output.
+    Con brotli >= 1.2 ogni chiamata ha un tetto di output; con le versioni precedenti
+    si limita l'input passato per volta (BROTLI_INPUT_STEP byte)."""
+    d = brotli.Decompressor()
+    bounded = hasattr(d, 'can_accept_more_data')
+    step = ASSET_CHUNK_SIZE if bounded else BROTLI_INPUT_STEP
+    out = bytearray()
+    pos = 0
+    while len(out) < limit:
+        if bounded and not d.can_accept_more_data():
+            chunk = b''  # output ancora in sospeso: va svuotato prima di dare altro input
+        elif pos < len(data):
+            chunk = data[pos:pos + step]
+            pos += step
+        else:
+            break
+        if bounded:
+            out += d.process(chunk, output_buffer_limit=limit - len(out))
+        else:
+            out += d.process(chunk)
+    if len(out) < limit and not d.is_finished():
+        raise brotli.error('Flusso brotli incompleto')
+    return bytes(out)
+
+def _decompress_body(data, encoding):
+    """Decomprime il corpo di una richiesta rispettando MAX_DECOMPRESSED_BODY"""
+    if encoding == 'br':
+        out = _brotli_decompress(data, MAX_DECOMPRESSED_BODY + 1)
+    else:
+        wbits = 47 if encoding == 'gzip' else 15  # 47 = gzip o zlib con rilevamento header
+        try:
+            d = zlib.decompressobj(wbits)
+            out = d.decompress(data, MAX_DECOMPRESSED_BODY + 1)
+        except zlib.error:
+            if encoding != 'deflate':
+                raise
+            # Alcuni client inviano deflate "raw" senza header zlib
+            d = zlib.decompressobj(-15)
+            out = d.decompress(data, MAX_DECOMPRESSED_BODY + 1)
+    if len(out) > MAX_DECOMPRESSED_BODY:
+        raise OverflowError('Corpo decompresso troppo grande')
+    return out
+
+@app.before_request
+def _decompress_request():
+    """Accetta corpi richiesta compressi (Content-Encoding: gzip/deflate/br)"""
+    encoding = request.headers.get('Content-Encoding', '').strip().lower()
+    if not encoding or encoding == 'identity':
+        return None
+    if encoding not in ('gzip', 'deflate', 'br') or (encoding == 'br' and not BROTLI_AVAILABLE):
+        return jsonify({'status':'error','message':f'Content-Encoding non supportato: {encoding}'}), 415
+    from werkzeug.wsgi import get_input_stream
+    try:
+        body = _decompress_body(get_input_stream(request.environ).read(), encoding)
+    except OverflowError as e:
+        return jsonify({'status':'error','message':str(e)}), 413
+    except Exception as e:
+        return jsonify({'status':'error','message':f'Corpo compresso non valido: {e}'}), 400
+    # Da qui in poi Flask vede un corpo normale, non compresso
+    request.environ['wsgi.input'] = io.BytesIO(body)
+    request.environ['CONTENT_LENGTH'] = str(len(body))
+    request.environ.pop('HTTP_CONTENT_ENCODING', None)
+    return None
+
+@app.after_request
+def _compress_response(response):
+    """Compressione negoziata delle risposte testuali/JSON"""
+    if request.method == 'HEAD' or response.direct_passthrough:
+        return response  # send_file e file statici: mai compressi qui
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return response
+    if 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_MIMETYPES:
+        return response
+    if os.path.splitext(request.path)[1].lower() in COMPRESS_EXCLUDED_EXT:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _negotiate_encoding()
+    if not encoding:
+        return response
+    if not response.is_streamed and len(response.get_data()) < COMPRESS_MIN_SIZE:
+        return response
+
+    # La rappresentazione compressa ha un ETag diverso da quella in chiaro. La view ha confrontato
+    # If-None-Match con l'ETag in chiaro: il client rimanda quello compresso, si riconfronta qui
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+        if request.method == 'GET' and response.status_code == 200 and not response.is_streamed:
+            response.make_conditional(request)
+            if response.status_code == 304:
+                return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(_compress_bytes(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+# --- Streaming NDJSON ---
+def _wants_ndjson():
+    """True se il client ha chiesto esplicitamente application/x-ndjson"""
+    return request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+def _ndjson_response(conn, cursor):
+    """Invia le righe direttamente dal cursore, un oggetto JSON per riga.
+    La connessione viene chiusa a fine stream (o se il client si disconnette)."""
+    def generate():
+        try:
+            while True:
+                rows = cursor.fetchmany(NDJSON_BATCH)
+                if not rows:
+                    break
+                yield ''.join(json.dumps(dict(r), ensure_ascii=False) + '\n' for r in rows)
+        finally:
+            conn.close()
+    return Response(generate(), mimetype=NDJSON_MIMETYPE)
+
+# --- Idempotency-Key sulle richieste che modificano dati ---
+# Solo le route in IDEMPOTENT_ROUTES: sulle altre la chiave viene ignorata. Controllo della
+# chiave, scrittura dell'endpoint e salvataggio del suo risultato sono una sola operazione
+# del thread scrittore (un solo commit): o c'è tutto o non c'è niente, e una ripetizione
+# concorrente, accodata dietro l'originale, ne trova già il risultato.
+class IdempotencyKeyReused(Exception):
+    """La chiave è già stata usata per una richiesta diversa"""
+    pass
+
+def _request_fingerprint():
+    """Impronta della richiesta: stessa chiave con un'altra richiesta è un errore del client"""
+    h = hashlib.sha256(f"{request.method} {request.full_path}".encode('utf-8'))
+    if (request.content_length or 0) <= IDEMPOTENCY_MAX_HASHED_BODY:
+        h.update(request.get_data(cache=True))  # resta in cache: form e JSON si leggono ancora
+    else:
+        h.update(str(request.content_length).encode('ascii'))
+    return h.hexdigest()
+
+@app.before_request
+def _idempotency_begin():
+    """Legge la chiave e calcola l'impronta prima che il parsing di form e file consumi il corpo"""
+    key = request.headers.get('Idempotency-Key')
+    if not key or request.url_rule is None or (request.method, request.url_rule.rule) not in IDEMPOTENT_ROUTES:
+        return None
+    if len(key) > 255:
+        return jsonify({'status':'error','message':'Idempotency-Key troppo lunga'}), 400
+    request.environ['badgeempire.idempotency'] = (key, _request_fingerprint())
+    return None
+
+def idempotent_write(fn):
+    """_db_writer.execute(fn) per le route in IDEMPOTENT_ROUTES. Con Idempotency-Key, nella stessa
+    operazione: se la chiave ha già un risultato fn non viene eseguita e si ritorna quello salvato
+    (l'endpoint costruisce la stessa risposta), altrimenti si esegue fn e se ne salva il valore
+    (serializzabile in JSON). Se fn fallisce non si salva nulla e il client può ritentare."""
+    idempotency = request.environ.get('badgeempire.idempotency')
+    if idempotency is None:
+        return _db_writer.execute(fn)
+    key, fingerprint = idempotency
+
+    def write(c):
+        now = time.time()
+        c.execute('SELECT fingerprint, result, created_at FROM idempotency_keys WHERE key=?', (key,))
+        r = c.fetchone()
+        if r is not None and now - r['created_at'] <= IDEMPOTENCY_TTL:
+            if r['fingerprint'] != fingerprint:
+                raise IdempotencyKeyReused('Idempotency-Key già usata per una richiesta diversa')
+            return True, json.loads(r['result'])
+        value = fn(c)
+        c.execute('INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, result, created_at) VALUES (?,?,?,?)',
+                  (key, fingerprint, json.dumps(value), now))
+        return False, value
+
+    replayed, value = _db_writer.execute(write)
+    if replayed:
+        request.environ['badgeempire.idempotent_replay'] = True
+    return value
+
+def idempotent_replay():
+    """True se la richiesta corrente ripete una già eseguita: niente effetti collaterali (audit & co.)"""
+    return request.environ.get('badgeempire.idempotent_replay', False)
+
+@app.after_request
+def _idempotency_mark(response):
+    if request.environ.get('badgeempire.idempotent_replay'):
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+@app.errorhandler(IdempotencyKeyReused)
+def _idempotency_key_reused(e):
+    return jsonify({'status':'error','message':str(e)}), 422
+
+def prune_idempotency_keys():
+    """Elimina le chiavi più vecchie di IDEMPOTENCY_TTL"""
+    conn = get_db_connection()
+    try:
+        conn.execute('DELETE FROM idempotency_keys WHERE created_at < ?', (time.time() - IDEMPOTENCY_TTL,))
+        conn.commit()
+    finally:
+        conn.close()
+
+BACKGROUND_JOBS.append(PeriodicJob('idempotency-prune', IDEMPOTENCY_PRUNE_INTERVAL, prune_idempotency_keys))
+
+# --- Cache delle risposte ---
+class _CacheEntry:
+    __slots__ = ('body', 'mimetype', 'etag', 'tags', 'expires', 'variants', 'size')
+
+    def __init__(self, body, mimetype, tags, ttl):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.tags = tags
+        self.expires = time.monotonic() + ttl
+        self.variants = {}  # codifica -> corpo compresso, calcolato alla prima richiesta
+        self.size = len(body)
+
+class ResponseCache:
+    """Cache LRU+TTL delle risposte GET, chiave (route, parametri, rappresentazione).
+    Ogni voce ha dei tag ('users', 'work_logs', 'characters'): le scritture invalidano per tag."""
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.generation = 0  # incrementato a ogni invalidazione
+        self._entries = OrderedDict()  # chiave -> _CacheEntry
+        self._by_tag = {}              # tag -> set di chiavi
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'invalidations': 0, 'evictions': 0, 'expired': 0}
+        self.route_stats = {}          # route -> [hit, miss]
+
+    def get(self, key):
+        route = key[0]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= time.monotonic():
+                self._remove(key)
+                self.stats['expired'] += 1
+                entry = None
+            counts = self.route_stats.setdefault(route, [0, 0])
+            if entry is None:
+                self.stats['misses'] += 1
+                counts[1] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            counts[0] += 1
+            return entry
+
+    def put(self, key, body, mimetype, tags, ttl, generation):
+        """Salva una risposta calcolata. Se nel frattempo c'è stata un'invalidazione
+        (generation cambiata) la risposta può essere già vecchia e non si salva."""
+        if len(body) > RESPONSE_CACHE_MAX_ENTRY:
+            return None
+        entry = _CacheEntry(body, mimetype, tags, ttl)
+        with self._lock:
+            if generation != self.generation:
+                return None
+            self._remove(key)
+            self._entries[key] = entry
+            self.size += entry.size
+            for tag in tags:
+                self._by_tag.setdefault(tag, set()).add(key)
+            self.stats['stores'] += 1
+            self._evict()
+        return entry
+
+    def add_variant(self, key, entry, encoding, data):
+        with self._lock:
+            if encoding in entry.variants:
+                return
+            entry.variants[encoding] = data
+            if self._entries.get(key) is entry:
+                entry.size += len(data)
+                self.size += len(data)
+                self._evict()
+
+    def invalidate(self, *tags):
+        with self._lock:
+            self.generation += 1
+            for tag in tags:
+                for key in list(self._by_tag.get(tag, ())):
+                    self._remove(key)
+                    self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._by_tag.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= entry.size
+        for tag in entry.tags:
+            keys = self._by_tag.get(tag)
+            if keys:
+                keys.discard(key)
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self.size > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.stats['evictions'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return dict(self.stats, entries=len(self._entries), bytes=self.size,
+                        hit_rate=round(self.stats['hits'] / lookups, 4) if lookups else 0.0,
+                        routes={r: {'hits': h, 'misses': m} for r, (h, m) in sorted(self.route_stats.items())})
+
+response_cache = ResponseCache()
+METRICS.register_gauge('response_cache_hits_total', 'Risposte servite dalla cache', lambda: response_cache.stats['hits'])
+METRICS.register_gauge('response_cache_misses_total', 'Risposte calcolate (cache miss)', lambda: response_cache.stats['misses'])
+METRICS.register_gauge('response_cache_entries', 'Voci nella cache delle risposte', lambda: len(response_cache._entries))
+METRICS.register_gauge('response_cache_bytes', 'Byte occupati dalla cache delle risposte', lambda: response_cache.size)
+
+def _cache_key():
+    """Route, parametri di percorso e query (user_id compreso) e formato richiesto"""
+    return (request.url_rule.rule,
+            tuple(sorted(request.view_args.items())),
+            tuple(sorted(request.args.items(multi=True))),
+            'ndjson' if _wants_ndjson() else 'json')
+
+def _serve_cached(key, entry):
+    """Risposta da una voce in cache, con la variante compressa già pronta se il client la accetta"""
+    body, etag = entry.body, entry.etag
+    compressible = entry.mimetype in COMPRESS_MIMETYPES and len(entry.body) >= COMPRESS_MIN_SIZE
+    encoding = _negotiate_encoding() if compressible else None
+    if encoding:
+        body = entry.variants.get(encoding)
+        if body is None:
+            body = _compress_bytes(entry.body, encoding)
+            response_cache.add_variant(key, entry, encoding, body)
+        etag = f"{etag}-{encoding}"
+    response = Response(body, mimetype=entry.mimetype)
+    if compressible:
+        response.vary.add('Accept-Encoding')
+    if encoding:
+        # Content-Encoding già presente: _compress_response non la tocca
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.headers['X-Cache'] = 'HIT'
+    return response.make_conditional(request)
+
+def cached_response(*tags, ttl=RESPONSE_CACHE_TTL):
+    """Mette in cache le risposte 200 dell'endpoint GET decorato. Anche le risposte NDJSON
+    in streaming vengono salvate, copiando i chunk mentre vengono inviati."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return fn(*args, **kwargs)
+            key = _cache_key()
+            entry = response_cache.get(key)
+            if entry is not None:
+                return _serve_cached(key, entry)
+            generation = response_cache.generation
+            rv = fn(*args, **kwargs)
+            if not isinstance(rv, Response) or rv.status_code != 200:
+                return rv
+            rv.headers['X-Cache'] = 'MISS'
+            if not rv.is_streamed:
+                entry = response_cache.put(key, rv.get_data(), rv.mimetype, tags, ttl, generation)
+                if entry is not None:
+                    rv.set_etag(entry.etag)
+                return rv
+
+            inner, mimetype = rv.response, rv.mimetype
+
+            def tee():
+                parts, size, complete = [], 0, False
+                try:
+                    for chunk in inner:
+                        if isinstance(chunk, str):
+                            chunk = chunk.encode('utf-8')
+                        if parts is not None:
+                            size += len(chunk)
+                            if size > RESPONSE_CACHE_MAX_ENTRY:
+                                parts = None  # troppo grande: si continua solo a inviare
+                            else:
+                                parts.append(chunk)
+                        yield chunk
+                    complete = True
+                finally:
+                    if hasattr(inner, 'close'):
+                        inner.close()
+                    # Solo una risposta arrivata fino in fondo va in cache
+                    if complete and parts is not None:
+                        response_cache.put(key, b''.join(parts), mimetype, tags, ttl, generation)
+            rv.response = tee()
+            return rv
+        return wrapper
+    return decorator
+
+def invalidates_cache(*tags):
+    """Dopo la scrittura (commit già fatto dall'endpoint) invalida le risposte con questi tag"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if request.method != 'GET':
+                    response_cache.invalidate(*tags)
+        return wrapper
+    return decorator
+
+# --- ENDPOINTS FLASK ---
+    
+_CHARACTER_COLUMNS = ("id, series_title, character_name, role, image_path, script_text, script_path, expiry_date, "
+                      "mov_path, last_modified, visible_to, assigned_to")
+
+# Filtro SQL dei personaggi non scaduti (parametro: expiry_today()); expires_at è indicizzata
+_NOT_EXPIRED = "(expires_at IS NULL OR expires_at >= ?)"
+
+def _character_visible(r, user_id):
+    """Filtro per visibilità: senza restrizioni (o senza user_id) il personaggio è visibile"""
+    visible_to = r.get('visible_to', '')
+    if visible_to:  # Se ha restrizioni di visibilità
+        allowed_users = [uid.strip() for uid in visible_to.split(',') if uid.strip()]
+        # Se user_id è specificato E non è nella lista → nascosto
+        if user_id and str(user_id) not in allowed_users:
+            return False
+    return True
+
+def _character_payload(r):
+    """Riga di bacheca_characters -> JSON per il client (URL degli asset con ?v=)"""
+    v_ts = int(datetime.strptime(r['last_modified'], '%Y-%m-%d %H:%M:%S').timestamp()) if r.get('last_modified') else int(time.time())
+    img_url = f"{SERVER_URL}/profile_image/{r['image_path']}?v={v_ts}" if r['image_path'] else None
+    mov_url = f"{SERVER_URL}/profile_image/{r['mov_path']}?v={v_ts}" if r['mov_path'] else None
+    script_url = f"{SERVER_URL}/profile_image/{r['script_path']}?v={v_ts}" if r['script_path'] else None
+    return {
+        'id': r['id'],
+        'series_title': r['series_title'],
+        'character_name': r['character_name'],
+        'role': r['role'],
+        'image_url': img_url,
+        'script_text': r.get('script_text'),
+        'script_url': script_url,
+        'expiry_date': r.get('expiry_date'),
+        'mov_url': mov_url,
+        'last_modified': r.get('last_modified'),
+        'visible_to': r.get('visible_to',''),
+        'assigned_to': r.get('assigned_to')
+    }
+
+@app.route('/bacheca/characters', methods=['GET'])
+@cached_response('characters')
+def api_bacheca_characters():
+    """Lista personaggi (esclusi gli scaduti). Con ?since=<version> risponde solo con le differenze:
+    {version, full, items, deleted}; deleted contiene anche i personaggi non più visibili."""
+    # ← AGGIUNTO: parametro opzionale user_id
+    user_id = request.args.get('user_id')  # Es: ?user_id=5
+    since = request.args.get('since', type=int)
+    
+    conn = get_db_connection()
+    c = conn.cursor()
+    today = expiry_today()
+    if since is None:
+        c.execute(f"SELECT {_CHARACTER_COLUMNS} FROM bacheca_characters WHERE {_NOT_EXPIRED} "
+                  "ORDER BY series_title, character_name", (today,))
+        rows = c.fetchall()
+        conn.close()
+        return jsonify([_character_payload(dict(r)) for r in rows if _character_visible(dict(r), user_id)])
+
+    # Versione e righe lette nella stessa transazione: nessuna modifica può cadere in mezzo
+    c.execute('BEGIN')
+    version, full, changed = changes_since(c, 'character', since)
+    if full:
+        c.execute(f"SELECT {_CHARACTER_COLUMNS} FROM bacheca_characters WHERE {_NOT_EXPIRED} "
+                  "ORDER BY series_title, character_name", (today,))
+        rows = c.fetchall()
+    else:
+        rows = []
+        for i in range(0, len(changed), 500):
+            chunk = changed[i:i + 500]
+            c.execute(f"SELECT {_CHARACTER_COLUMNS} FROM bacheca_characters "
+                      f"WHERE id IN ({','.join('?' * len(chunk))}) AND {_NOT_EXPIRED}", [*chunk, today])
+            rows.extend(c.fetchall())
+    conn.commit()
+    conn.close()
+
+    items = []
+    visible_ids = set()
+    for r in rows:
+        r = dict(r)
+        if _character_visible(r, user_id):
+            items.append(_character_payload(r))
+            visible_ids.add(r['id'])
+    # Tombstone: eliminati o non più visibili per questo utente
+    deleted = [cid for cid in changed if cid not in visible_ids]
+    return jsonify({'version': version, 'full': full, 'items': items, 'deleted': deleted})
+
+@app.route('/bacheca/last_update', methods=['GET'])
+def api_bacheca_last_update():
+    """Controllo leggero per il polling: ultima modifica e versione corrente del change log"""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT MAX(last_modified) FROM bacheca_characters')
+    last_update = c.fetchone()[0]
+    c.execute("SELECT MAX(version) FROM change_log WHERE entity='character'")
+    version = c.fetchone()[0] or 0
+    conn.close()
+    return jsonify({'last_update': last_update, 'version': version})
+
+# Campo del form multipart -> colonna con il percorso del file
+_CHARACTER_FILE_FIELDS = (('image_file', 'image_path'), ('script', 'script_path'), ('mov', 'mov_path'))
+_CHARACTER_PATCH_FIELDS = ('series_title', 'character_name', 'role', 'expiry_date', 'script_text',
+                           'visible_to', 'assigned_to')
+
+def _character_uploads():
+    """File allegati alla richiesta: {colonna: FileStorage}; ValueError se il copione non è .docx"""
+    uploads = {}
+    for field, column in _CHARACTER_FILE_FIELDS:
+        f = request.files.get(field)
+        if f:
+            uploads[column] = f
+    script_file = uploads.get('script_path')
+    if script_file and not (script_file.filename or '').endswith('.docx'):
+        raise ValueError('Il copione deve essere .docx')
+    return uploads
+
+def _character_patch_fields(data):
+    """Campi modificabili dal corpo della PATCH, con i tipi che le colonne si aspettano.
+    visible_to può arrivare anche come lista di id: si salva nel formato "1,2,3" letto da
+    _character_visible. ValueError se un valore ha un tipo non ammesso."""
+    fields = {}
+    for key in _CHARACTER_PATCH_FIELDS:
+        if key not in data:
+            continue
+        value = data[key]
+        if key == 'visible_to' and isinstance(value, list):
+            if not all(isinstance(v, (int, str)) and not isinstance(v, bool) for v in value):
+                raise ValueError('visible_to: lista di id utente')
+            value = ','.join(str(v).strip() for v in value if str(v).strip())
+        elif key == 'assigned_to' and isinstance(value, int) and not isinstance(value, bool):
+            pass
+        elif value is not None and not isinstance(value, str):
+            raise ValueError(f'{key}: tipo non valido ({type(value).__name__})')
+        if key in ('visible_to', 'assigned_to') and isinstance(value, str):
+            value = value.strip()
+        fields[key] = value
+    return fields
+
+@app.route('/bacheca/character', methods=['POST'])
+@invalidates_cache('characters')
+def api_bacheca_create_character():
+    """Crea un nuovo personaggio (supporta form-data con file opzionali)"""
+    if request is None: return jsonify({'status':'error','message':'Server not configured'}), 500
+    try:
+        series = request.form.get('series_title') or request.form.get('series') or ''
+        name = request.form.get('character_name') or ''
+        role = request.form.get('role') or ''
+        expiry = request.form.get('expiry_date') or ''
+        created_by = request.form.get('created_by')
+        visible_to = request.form.get('visible_to','').strip()
+        assigned_to = request.form.get('assigned_to','').strip()
+
+        if not name or not role:
+            return jsonify({'status':'error','message':'Nome e ruolo obbligatori'}), 400
+        try:
+            uploads = _character_uploads()
+        except ValueError as e:
+            return jsonify({'status':'error','message':str(e)}), 400
+
+        # I file sono già su disco (scritti durante il parsing): nel thread scrittore solo SQL
+        fields = {'series_title': series, 'character_name': name, 'role': role, 'expiry_date': expiry,
+                  'expires_at': parse_expiry(expiry), 'created_by': created_by, 'visible_to': visible_to, 'assigned_to': assigned_to,
+                  'last_modified': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+        files = {col: _save_uploaded_file(f) for col, f in uploads.items()}
+        fields.update(files)
+
+        def insert(c):
+            c.execute(f"INSERT INTO bacheca_characters ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})",
+                      list(fields.values()))
+            cid = c.lastrowid  # prima di _asset_ref, che fa altri INSERT sullo stesso cursore
+            for rel in files.values():
+                _asset_ref(c, rel)
+            return cid
+        cid = idempotent_write(insert)
+        if not idempotent_replay():
+            if 'script_path' in files:
+                _script_extractor.submit(cid)
+            audit(created_by, 'bacheca_create', f"cid={cid}")
+        return jsonify({'status':'ok', 'id': cid})
+    except (WriteUnavailable, IdempotencyKeyReused):
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'status':'error','message':str(e)}), 500
+
+
+def _delete_character(cid):
+    """Elimina un personaggio e rilascia i relativi file; ritorna (payload, status)"""
+    def delete(c):
+        c.execute('SELECT image_path, script_path, mov_path FROM bacheca_characters WHERE id=?', (cid,))
+        r = c.fetchone()
+        if not r:
+            raise LookupError('Personaggio non trovato')
+        # I file condivisi con altri personaggi restano: li elimina il GC quando nessuno li usa più
+        for file_path in [r[0], r[1], r[2]]:
+            _asset_unref(c, file_path)
+        c.execute('DELETE FROM bacheca_characters WHERE id=?', (cid,))
+        return c.rowcount
+
+    try:
+        try:
+            rows_affected = _db_writer.execute(delete)
+        except LookupError as e:
+            return {'status':'error','message':str(e)}, 404
         
         if rows_affected > 0:
             audit(None, 'bacheca_delete', f"Character ID {cid} deleted")
-            return jsonify({'status':'ok', 'message':'Personaggio eliminato con successo'})
+            return {'status':'ok', 'message':'Personaggio eliminato con successo'}, 200
         else:
-            return jsonify({'status':'error','message':'Nessun personaggio eliminato'}), 404
+            return {'status':'error','message':'Nessun personaggio eliminato'}, 404
             
+    except WriteUnavailable:
+        raise
     except Exception as e:
         print(f"[SERVER] Errore DELETE: {e}")
         traceback.print_exc()
-        return jsonify({'status':'error','message':str(e)}), 500
+        return {'status':'error','message':str(e)}, 500
+
+def _set_character_file(cid, column, rel, now, extra=''):
+    """Sostituisce un file del personaggio (percorso in `column`) aggiornando i riferimenti
+    ai blob nella stessa transazione; LookupError se il personaggio non esiste"""
+    def update(c):
+        c.execute(f'SELECT {column} FROM bacheca_characters WHERE id=?', (cid,))
+        r = c.fetchone()
+        if not r:
+            raise LookupError('Character non trovato')
+        c.execute(f'UPDATE bacheca_characters SET {column}=?, {extra}last_modified=? WHERE id=?', (rel, now, cid))
+        _asset_ref(c, rel)
+        _asset_unref(c, r[0])
+    _db_writer.execute(update)
+
+@app.route('/bacheca/character/<int:cid>/delete', methods=['POST'])
+@invalidates_cache('characters')
+def api_bacheca_delete_character(cid):
+    """Endpoint dedicato per eliminare un personaggio"""
+    if request is None: return jsonify({'status':'error','message':'Server not configured'}), 500
+    payload, status = _delete_character(cid)
+    return jsonify(payload), status
 
 @app.route('/bacheca/character/<int:cid>', methods=['PUT', 'DELETE'])
+@invalidates_cache('characters')
 def api_bacheca_update_or_delete_character(cid):
     if request is None: return jsonify({'status':'error','message':'Server not configured'}), 500
     
     # DELETE - Elimina personaggio
     if request.method == 'DELETE':
-        try:
-            print(f"[SERVER] Richiesta DELETE per personaggio ID: {cid}")
-            conn = get_db_connection()
-            c = conn.cursor()
-            # Recupera i file da eliminare
-            c.execute('SELECT image_path, script_path, mov_path FROM bacheca_characters WHERE id=?', (cid,))
-            r = c.fetchone()
-            
-            if not r:
-                conn.close()
-                print(f"[SERVER] Personaggio {cid} non trovato")
-                return jsonify({'status':'error','message':'Personaggio non trovato'}), 404
-            
-            print(f"[SERVER] Personaggio trovato, eliminazione file...")
-            # Elimina i file fisici
-            for file_path in [r[0], r[1], r[2]]:
-                if file_path:
-                    full_path = os.path.join(BASE_DIR, file_path)
-                    if os.path.exists(full_path):
-                        try:
-                            os.remove(full_path)
-                            print(f"[SERVER] File eliminato: {full_path}")
-                        except Exception as e:
-                            print(f"[SERVER] Errore eliminazione file {full_path}: {e}")
-            
-            # Elimina il record dal database
-            c.execute('DELETE FROM bacheca_characters WHERE id=?', (cid,))
-            conn.commit()
-            rows_affected = c.rowcount
-            conn.close()
-            
-            print(f"[SERVER] Righe eliminate: {rows_affected}")
-            
-            if rows_affected > 0:
-                audit(None, 'bacheca_delete', f"Character ID {cid} deleted")
-                return jsonify({'status':'ok', 'message':'Personaggio eliminato con successo'})
-            else:
-                return jsonify({'status':'error','message':'Nessun personaggio eliminato'}), 404
-                
-        except Exception as e:
-            print(f"[SERVER] Errore DELETE: {e}")
-            traceback.print_exc()
-            return jsonify({'status':'error','message':str(e)}), 500
+        payload, status = _delete_character(cid)
+        return jsonify(payload), status
     
     # PUT - Aggiorna personaggio
     elif request.method == 'PUT':
@@ -700,22 +3320,85 @@ def api_bacheca_update_or_delete_character(cid):
                     params.append(data[key])
             if not fields:
                 return jsonify({'status':'error','message':'Nessun campo da aggiornare'}), 400
+            if 'expiry_date' in data:
+                fields.append("expires_at=?")
+                params.append(parse_expiry(data['expiry_date']))
             now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             params.append(now)
             params.append(cid)
-            conn = get_db_connection()
-            c = conn.cursor()
-            c.execute(f"UPDATE bacheca_characters SET {', '.join(fields)}, last_modified=? WHERE id=?", params)
-            conn.commit()
-            conn.close()
+
+            def update(c):
+                c.execute(f"UPDATE bacheca_characters SET {', '.join(fields)}, last_modified=? WHERE id=?", params)
+            _db_writer.execute(update)
+            audit(None, 'bacheca_update', f"cid={cid}")
             return jsonify({'status':'ok', 'last_modified':now})
+        except WriteUnavailable:
+            raise
         except Exception as e:
             traceback.print_exc()
             return jsonify({'status':'error','message':str(e)}), 500
     
     return jsonify({'status':'error','message':'Metodo non supportato'}), 405
 
+@app.route('/bacheca/character/<int:cid>', methods=['PATCH'])
+@invalidates_cache('characters')
+def api_bacheca_patch_character(cid):
+    """Modifica in una sola richiesta: campi (multipart o JSON) e file (image_file, script, mov).
+    Campi, file e riferimenti ai blob cambiano nella stessa transazione con un solo last_modified.
+    Risponde con il personaggio aggiornato."""
+    if request is None: return jsonify({'status':'error','message':'Server not configured'}), 500
+    try:
+        data = request.get_json(silent=True) if request.is_json else request.form
+        if not isinstance(data, dict):
+            return jsonify({'status':'error','message':'JSON non valido'}), 400
+        try:
+            fields = _character_patch_fields(data)
+        except ValueError as e:
+            return jsonify({'status':'error','message':str(e)}), 400
+        if 'expiry_date' in fields:
+            fields['expires_at'] = parse_expiry(fields['expiry_date'])
+        try:
+            uploads = _character_uploads()
+        except ValueError as e:
+            return jsonify({'status':'error','message':str(e)}), 400
+        if not fields and not uploads:
+            return jsonify({'status':'error','message':'Nessun campo da aggiornare'}), 400
+
+        files = {col: _save_uploaded_file(f) for col, f in uploads.items()}
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        changes = dict(fields, **files, last_modified=now)
+        if 'script_path' in files:
+            changes['script_preview_html'] = None
+
+        def update(c):
+            c.execute(f"SELECT {', '.join(['id', *files])} FROM bacheca_characters WHERE id=?", (cid,))
+            old = c.fetchone()
+            if not old:
+                raise LookupError('Personaggio non trovato')
+            c.execute(f"UPDATE bacheca_characters SET {', '.join(f'{k}=?' for k in changes)} WHERE id=?",
+                      [*changes.values(), cid])
+            for col, rel in files.items():
+                _asset_ref(c, rel)
+                _asset_unref(c, old[col])
+            c.execute(f"SELECT {_CHARACTER_COLUMNS} FROM bacheca_characters WHERE id=?", (cid,))
+            return dict(c.fetchone())
+        try:
+            row = idempotent_write(update)
+        except LookupError as e:
+            return jsonify({'status':'error','message':str(e)}), 404
+        if not idempotent_replay():
+            if 'script_path' in files:
+                _script_extractor.submit(cid)
+            audit(None, 'bacheca_update', f"cid={cid} campi={','.join(changes)}")
+        return jsonify({'status':'ok', 'last_modified': row['last_modified'], 'character': _character_payload(row)})
+    except (WriteUnavailable, IdempotencyKeyReused):
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'status':'error','message':str(e)}), 500
+
 @app.route('/bacheca/character/<int:cid>/upload_script', methods=['POST'])
+@invalidates_cache('characters')
 def api_bacheca_upload_script(cid):
     """Endpoint per caricare file .docx del copione"""
     if request is None: return jsonify({'status':'error'}), 500
@@ -728,22 +3411,18 @@ def api_bacheca_upload_script(cid):
         if not script_file.filename.endswith('.docx'):
             return jsonify({'status':'error','message':'Solo file .docx sono permessi'}), 400
         
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute('SELECT series_title, character_name FROM bacheca_characters WHERE id=?', (cid,))
-        r = c.fetchone()
-        if not r:
-            conn.close()
-            return jsonify({'status':'error','message':'Character non trovato'}), 404
-        
-        series, name = r
-        script_rel = _save_uploaded_file(script_file, series, f"script_{secure_filename(name)}")
+        script_rel = _save_uploaded_file(script_file)
         now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        c.execute('UPDATE bacheca_characters SET script_path=?, last_modified=? WHERE id=?', (script_rel, now, cid))
-        conn.commit()
-        conn.close()
+        try:
+            _set_character_file(cid, 'script_path', script_rel, now, extra='script_preview_html=NULL, ')
+        except LookupError as e:
+            return jsonify({'status':'error','message':str(e)}), 404
+        _script_extractor.submit(cid)
+        audit(None, 'bacheca_upload_script', f"cid={cid}")
         
         return jsonify({'status':'ok', 'script_url': f"{SERVER_URL}/profile_image/{script_rel}", 'last_modified': now})
+    except WriteUnavailable:
+        raise
     except Exception as e:
         traceback.print_exc()
         return jsonify({'status':'error','message':str(e)}), 500
@@ -762,10 +3441,38 @@ def api_bacheca_download_script(cid):
     char_name = r[1]
     script_path = os.path.join(BASE_DIR, script_rel)
     if os.path.exists(script_path):
-        return send_file(script_path, as_attachment=True, download_name=f"Copione_{char_name}.docx")
+        return _send_file_timed(script_path, as_attachment=True, download_name=f"Copione_{char_name}.docx")
     return jsonify({'status':'error','message':'File not found'}), 404
 
+@app.route('/bacheca/character/<int:cid>/script_preview', methods=['GET'])
+def api_bacheca_script_preview(cid):
+    """Anteprima del copione (?format=html|text) senza scaricare il .docx; ETag sul contenuto"""
+    fmt = request.args.get('format', 'html')
+    if fmt not in ('html', 'text'):
+        return jsonify({'status':'error','message':'format deve essere html o text'}), 400
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT script_path, script_text, script_preview_html FROM bacheca_characters WHERE id=?', (cid,))
+    r = c.fetchone()
+    conn.close()
+    if not r or not r[0]:
+        return jsonify({'status':'error','message':'No script available'}), 404
+    text, preview = r[1], r[2]
+    if preview is None:
+        # Estrazione non ancora eseguita (coda in corso): la si fa subito per questa richiesta
+        extracted = extract_character_script(cid)
+        if extracted:
+            text, preview = extracted
+    if fmt == 'html':
+        response = Response(preview or '', mimetype='text/html')
+    else:
+        response = Response(text or '', mimetype='text/plain')
+    response.set_etag(hashlib.sha256(response.get_data()).hexdigest())
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
 @app.route('/bacheca/character/<int:cid>/upload_image', methods=['POST'])
+@invalidates_cache('characters')
 def api_bacheca_upload_image(cid):
     """Endpoint per aggiornare solo l'immagine di un personaggio"""
     if request is None: return jsonify({'status':'error'}), 500
@@ -774,27 +3481,23 @@ def api_bacheca_upload_image(cid):
         if not image_file:
             return jsonify({'status':'error','message':'Nessun file'}), 400
         
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute('SELECT series_title, character_name FROM bacheca_characters WHERE id=?', (cid,))
-        r = c.fetchone()
-        if not r:
-            conn.close()
-            return jsonify({'status':'error','message':'Character non trovato'}), 404
-        
-        series, name = r
-        img_rel = _save_uploaded_file(image_file, series, f"img_{secure_filename(name)}")
+        img_rel = _save_uploaded_file(image_file)
         now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        c.execute('UPDATE bacheca_characters SET image_path=?, last_modified=? WHERE id=?', (img_rel, now, cid))
-        conn.commit()
-        conn.close()
+        try:
+            _set_character_file(cid, 'image_path', img_rel, now)
+        except LookupError as e:
+            return jsonify({'status':'error','message':str(e)}), 404
+        audit(None, 'bacheca_upload_image', f"cid={cid}")
         
         return jsonify({'status':'ok', 'image_url': f"{SERVER_URL}/profile_image/{img_rel}", 'last_modified': now})
+    except WriteUnavailable:
+        raise
     except Exception as e:
         traceback.print_exc()
         return jsonify({'status':'error','message':str(e)}), 500
 
 @app.route('/bacheca/character/<int:cid>/upload_mov', methods=['POST'])
+@invalidates_cache('characters')
 def api_bacheca_upload_mov(cid):
     if request is None: return jsonify({'status':'error'}), 500
     try:
@@ -802,21 +3505,16 @@ def api_bacheca_upload_mov(cid):
         uploader = request.form.get('uploader')
         if not mov_file:
             return jsonify({'status':'error','message':'Nessun file'}), 400
-        conn = get_db_connection()
-        c = conn.cursor()
-        c.execute('SELECT series_title, character_name FROM bacheca_characters WHERE id=?', (cid,))
-        r = c.fetchone()
-        if not r:
-            conn.close()
-            return jsonify({'status':'error','message':'Character non trovato'}), 404
-        series, name = r
-        mov_rel = _save_uploaded_file(mov_file, series, f"mov_{secure_filename(name)}")
+        mov_rel = _save_uploaded_file(mov_file)
         now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        c.execute('UPDATE bacheca_characters SET mov_path=?, last_modified=? WHERE id=?', (mov_rel, now, cid))
-        conn.commit()
-        conn.close()
+        try:
+            _set_character_file(cid, 'mov_path', mov_rel, now)
+        except LookupError as e:
+            return jsonify({'status':'error','message':str(e)}), 404
         audit(uploader, 'bacheca_upload_mov', f"cid={cid}")
         return jsonify({'status':'ok', 'mov_url': f"{SERVER_URL}/profile_image/{mov_rel}", 'last_modified': now})
+    except WriteUnavailable:
+        raise
     except Exception as e:
         traceback.print_exc()
         return jsonify({'status':'error','message':str(e)}), 500
@@ -825,18 +3523,22 @@ def api_bacheca_upload_mov(cid):
 def api_bacheca_download_mov(cid):
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute('SELECT mov_path FROM bacheca_characters WHERE id=?', (cid,))
+    c.execute('SELECT mov_path, character_name FROM bacheca_characters WHERE id=?', (cid,))
     r = c.fetchone()
     conn.close()
     if not r or not r[0]:
         return jsonify({'status':'error','message':'No mov'}), 404
     mov_rel = r[0]
+    char_name = r[1]
     mov_path = os.path.join(BASE_DIR, mov_rel)
     if os.path.exists(mov_path):
-        return send_file(mov_path, as_attachment=True, download_name=os.path.basename(mov_path))
+        # Il file su disco ha per nome il suo hash: si propone il nome del personaggio
+        ext = os.path.splitext(mov_rel)[1]
+        return _send_file_timed(mov_path, as_attachment=True, download_name=f"{char_name}{ext}")
     return jsonify({'status':'error','message':'File not found'}), 404
 
 @app.route('/get_all_users', methods=['GET'])
+@cached_response('users')
 def api_get_all_users():
     """Ritorna lista di tutti gli utenti (per selezione visibilità)"""
     conn = get_db_connection()
@@ -846,12 +3548,47 @@ def api_get_all_users():
     conn.close()
     return jsonify([{'id': r[0], 'name': r[1], 'surname': r[2], 'email': r[3]} for r in rows])
 
+_asset_etags = {}  # percorso -> (mtime_ns, size, etag) per i file fuori dall'archivio blob
+
+def _asset_etag(rel, full_path):
+    """ETag forte: per i blob è lo SHA-256 nel nome, per gli altri file l'hash del contenuto
+    (ricalcolato solo se cambiano mtime o dimensione)"""
+    if _is_blob_path(rel):
+        return os.path.splitext(os.path.basename(full_path))[0]
+    st = os.stat(full_path)
+    cached = _asset_etags.get(full_path)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(full_path, 'rb') as f:
+        for chunk in iter(partial(f.read, ASSET_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    etag = digest.hexdigest()
+    _asset_etags[full_path] = (st.st_mtime_ns, st.st_size, etag)
+    return etag
+
+def _is_under_assets(path):
+    # realpath: neanche un link simbolico dentro assets può portare fuori
+    assets = os.path.realpath(ASSETS_DIR)
+    return os.path.commonpath([os.path.realpath(path), assets]) == assets
+
 @app.route('/profile_image/<path:filename>')
 def serve_asset(filename):
-    full_path = os.path.join(BASE_DIR, filename)
-    if os.path.exists(full_path):
-        return send_file(full_path)
-    return jsonify({'status':'error'}), 404
+    """Serve un asset. URL versionati (?v=) e blob sono immutabili e si mettono in cache per un anno;
+    gli altri vanno rivalidati (ETag / Last-Modified, 304 se invariati).
+    I percorsi sono relativi a BASE_DIR ma si serve solo ciò che sta sotto ASSETS_DIR:
+    database, backup e archivio non devono essere scaricabili."""
+    full_path = safe_join(BASE_DIR, filename)
+    if full_path is None or not _is_under_assets(full_path) or not os.path.isfile(full_path):
+        return jsonify({'status':'error'}), 404
+    etag = _asset_etag(filename, full_path)
+    if request.args.get('v') or _is_blob_path(filename):
+        response = _send_file_timed(full_path, etag=etag, max_age=ASSET_MAX_AGE)
+        response.cache_control.immutable = True
+    else:
+        response = _send_file_timed(full_path, etag=etag)
+        response.cache_control.no_cache = True
+    return response
 
 @app.route('/login', methods=['POST'])
 def api_login():
@@ -874,33 +3611,73 @@ def api_login():
         return jsonify({"status":"error", "message":"Credenziali non valide"}), 401
 
 @app.route('/add_hours', methods=['POST'])
+@invalidates_cache('work_logs')
 def api_add_hours():
     if request is None: return jsonify({'status':'error'}), 500
     data = request.get_json()
     user_id = data.get('user_id')
     hours = data.get('hours')
     reason = data.get('reason')
-    try:
-        conn = get_db_connection()
-        c = conn.cursor()
+
+    def insert(c):
         c.execute("INSERT INTO work_logs (user_id, date, hours, reason) VALUES (?, ?, ?, ?)",
                   (user_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), hours, reason))
-        conn.commit()
-        conn.close()
-        return jsonify({'status':'ok'})
+        return c.lastrowid
+    try:
+        log_id = idempotent_write(insert)
+    except (WriteUnavailable, IdempotencyKeyReused):
+        raise
     except Exception as e:
         return jsonify({'status':'error', 'message':str(e)}), 500
+    if not idempotent_replay():
+        audit(user_id, 'add_hours', f"log={log_id} hours={hours}")
+    return jsonify({'status':'ok', 'id': log_id})
 
 @app.route('/get_logs/<int:user_id>', methods=['GET'])
 def api_get_logs(user_id):
+    """Log di un utente. Con ?since=<version> solo le differenze: {version, full, items, deleted}.
+    Le liste complete comprendono i log archiviati; con ?from=YYYY-MM-DD solo quelli da quella data."""
+    since = request.args.get('since', type=int)
+    date_from = request.args.get('from')
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("SELECT * FROM work_logs WHERE user_id=? ORDER BY date DESC", (user_id,))
-    rows = c.fetchall()
+    # Nel delta un log modificato e poi archiviato va cercato anche nell'archivio,
+    # altrimenti finirebbe tra i cancellati e la replica locale lo perderebbe
+    batch = begin_logs_read(conn, date_from if since is None else None)
+    source, source_params = work_logs_source(batch)
+    sql = f"SELECT * FROM {source} w WHERE user_id=?"
+    params = source_params + [user_id]
+    if date_from:
+        sql += " AND date >= ?"
+        params.append(date_from)
+    sql += " ORDER BY date DESC"
+    if since is None:
+        c.execute(sql, params)
+        if _wants_ndjson():
+            return _ndjson_response(conn, c)
+        rows = c.fetchall()
+        conn.close()
+        return jsonify([dict(r) for r in rows])
+
+    version, full, changed = changes_since(c, 'work_log', since, owner_id=user_id)
+    if full:
+        c.execute(sql, params)
+        rows = c.fetchall()
+    else:
+        rows = []
+        for i in range(0, len(changed), 500):
+            chunk = changed[i:i + 500]
+            c.execute(f"SELECT * FROM {source} w WHERE user_id=? AND id IN ({','.join('?' * len(chunk))})",
+                      source_params + [user_id] + chunk)
+            rows.extend(c.fetchall())
+    conn.commit()
     conn.close()
-    return jsonify([dict(r) for r in rows])
+    present = {r['id'] for r in rows}
+    return jsonify({'version': version, 'full': full, 'items': [dict(r) for r in rows],
+                    'deleted': [lid for lid in changed if lid not in present]})
 
 @app.route('/register', methods=['POST'])
+@invalidates_cache('users')
 def api_register():
     if request is None: return jsonify({'status':'error'}), 500
     data = request.get_json()
@@ -910,18 +3687,23 @@ def api_register():
     password = data.get('password')
     if not all([name, surname, email, password]):
         return jsonify({'status':'error','message':'Dati incompleti'}), 400
-    conn = get_db_connection()
-    c = conn.cursor()
-    try:
-        code = f"USR{int(time.time())}"
+
+    def insert(c):
+        # Codice USR<timestamp>: con più registrazioni nello stesso secondo si prende il successivo libero
+        stamp = int(time.time())
+        while c.execute("SELECT 1 FROM users WHERE code=?", (f"USR{stamp}",)).fetchone():
+            stamp += 1
+        code = f"USR{stamp}"
         c.execute("INSERT INTO users (name, surname, email, password, code, role) VALUES (?,?,?,?,?,?)",
                   (name, surname, email, password, code, 'user'))
-        conn.commit()
-        conn.close()
-        return jsonify({'status':'ok','code':code})
+        return c.lastrowid, code
+    try:
+        new_id, code = _db_writer.execute(insert)
     except sqlite3.IntegrityError:
-        conn.close()
         return jsonify({'status':'error','message':'Email già esistente'}), 400
+    _user_codes.invalidate(code)
+    audit(new_id, 'register', f"code={code}")
+    return jsonify({'status':'ok','code':code})
 
 @app.route('/user_profile/<int:user_id>', methods=['GET', 'POST'])
 def api_user_profile(user_id):
@@ -944,69 +3726,860 @@ def api_user_profile(user_id):
         conn.close()
         return jsonify({'status':'ok'})
 
-@app.route('/request_removal', methods=['POST'])
-def api_request_removal():
-    if request is None: return jsonify({'status':'error'}), 500
-    data = request.get_json()
-    work_log_id = data.get('work_log_id')
-    requester_id = data.get('requester_id')
-    reason = data.get('reason')
+@app.route('/request_removal', methods=['POST'])
+def api_request_removal():
+    if request is None: return jsonify({'status':'error'}), 500
+    data = request.get_json()
+    work_log_id = data.get('work_log_id')
+    requester_id = data.get('requester_id')
+    reason = data.get('reason')
+
+    def insert(c):
+        c.execute("SELECT 1 FROM work_logs WHERE id=?", (work_log_id,))
+        if c.fetchone() is None:
+            raise LookupError('Log non trovato o archiviato')
+        c.execute("INSERT INTO removal_requests (work_log_id, requester_id, reason, request_date) VALUES (?,?,?,?)",
+                  (work_log_id, requester_id, reason, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        return c.lastrowid
+    try:
+        req_id = idempotent_write(insert)
+    except LookupError as e:
+        return jsonify({'status':'error','message':str(e)}), 404
+    if not idempotent_replay():
+        audit(requester_id, 'request_removal', f"log={work_log_id}")
+    return jsonify({'status':'ok', 'id': req_id})
+
+@app.route('/admin/removal_requests', methods=['GET'])
+def api_admin_removal_requests():
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute("""SELECT r.*, w.date as work_date, w.hours, w.reason as work_reason, w.user_id as work_user_id
+                 FROM removal_requests r 
+                 JOIN work_logs w ON r.work_log_id = w.id 
+                 WHERE r.status='pending'""")
+    if _wants_ndjson():
+        return _ndjson_response(conn, c)
+    rows = c.fetchall()
+    conn.close()
+    return jsonify([dict(r) for r in rows])
+
+class RemovalAlreadyDecided(RuntimeError):
+    pass
+
+class _DecisionFailed(Exception):
+    """Decisione `index` di un lotto non applicabile (l'errore originale è in `error`)"""
+    def __init__(self, index, error):
+        super().__init__(f"Decisione {index}: {error}")
+        self.index = index
+        self.error = error
+
+def _apply_removal_decision(c, req_id, action, admin_id, admin_reason, now, hours=None, log_reason=None):
+    """Applica una decisione su una richiesta di rimozione ancora 'pending' (senza commit).
+    Con 'rejected' si possono correggere ore e motivo del log. Ritorna l'utente interessato.
+    RemovalAlreadyDecided se la richiesta è già stata accettata o rifiutata."""
+    if action not in ('accepted', 'rejected'):
+        raise ValueError(f"Azione non valida: {action}")
+    c.execute("""SELECT r.work_log_id, w.user_id, r.status FROM removal_requests r
+                 LEFT JOIN work_logs w ON w.id = r.work_log_id WHERE r.id=?""", (req_id,))
+    r = c.fetchone()
+    if not r:
+        raise LookupError(f"Richiesta {req_id} non trovata")
+    wl_id, owner_id = r[0], r[1]
+    # Il controllo sullo stato sta anche nella UPDATE: due decisioni concorrenti non passano entrambe
+    c.execute("""UPDATE removal_requests SET status=?, admin_id=?, admin_reason=?, decision_date=?
+                 WHERE id=? AND status='pending'""",
+              (action, admin_id, admin_reason, now, req_id))
+    if c.rowcount == 0:
+        raise RemovalAlreadyDecided(f"Richiesta {req_id} già gestita ({r[2]})")
+    if action == 'accepted':
+        c.execute("DELETE FROM work_logs WHERE id=?", (wl_id,))
+    elif hours is not None or log_reason is not None:
+        c.execute("UPDATE work_logs SET hours=COALESCE(?, hours), reason=COALESCE(?, reason) WHERE id=?",
+                  (float(hours) if hours is not None else None, log_reason, wl_id))
+    return owner_id
+
+def _users_totals(c, user_ids):
+    """Ore totali aggiornate per un insieme di utenti"""
+    user_ids = sorted({u for u in user_ids if u is not None})
+    if not user_ids:
+        return []
+    marks = ','.join('?' * len(user_ids))
+    c.execute(f"""SELECT user_id, COALESCE(SUM(hours), 0) FROM
+                  (SELECT user_id, hours FROM work_logs WHERE user_id IN ({marks})
+                   UNION ALL SELECT user_id, hours FROM work_log_rollups WHERE user_id IN ({marks}))
+                  GROUP BY user_id""", user_ids + user_ids)
+    totals = {r[0]: r[1] for r in c.fetchall()}
+    return [{'id': uid, 'total_hours': totals.get(uid, 0)} for uid in user_ids]
+
+@app.route('/admin/handle_removal', methods=['POST'])
+@invalidates_cache('work_logs')
+def api_admin_handle_removal():
+    if request is None: return jsonify({'status':'error'}), 500
+    data = request.get_json()
+    req_id = data.get('request_id')
+    action = data.get('action')
+    admin_id = data.get('admin_id')
+    admin_reason = data.get('admin_reason')
+    conn = get_db_connection()
+    c = conn.cursor()
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        _apply_removal_decision(c, req_id, action, admin_id, admin_reason, now)
+    except LookupError as e:
+        conn.close()
+        return jsonify({'status':'error','message':str(e)}), 404
+    except RemovalAlreadyDecided as e:
+        conn.close()
+        return jsonify({'status':'error','message':str(e)}), 409
+    except ValueError as e:
+        conn.close()
+        return jsonify({'status':'error','message':str(e)}), 400
+    conn.commit()
+    conn.close()
+    audit(admin_id, 'handle_removal', f"req={req_id} action={action}")
+    return jsonify({'status':'ok'})
+
+@app.route('/admin/handle_removal_batch', methods=['POST'])
+@invalidates_cache('work_logs')
+def api_admin_handle_removal_batch():
+    """Applica molte decisioni (con eventuali modifiche a ore/motivo) in un'unica transazione"""
+    if request is None: return jsonify({'status':'error'}), 500
+    data = request.get_json(silent=True) or {}
+    admin_id = data.get('admin_id')
+    decisions = data.get('decisions') or []
+    if not isinstance(decisions, list) or not decisions:
+        return jsonify({'status':'error','message':'Nessuna decisione'}), 400
+    if not all(isinstance(d, dict) for d in decisions):
+        return jsonify({'status':'error','message':'Ogni decisione deve essere un oggetto'}), 400
+    seen = set()
+    for i, d in enumerate(decisions):
+        req_id = str(d.get('request_id'))  # 7 e "7" sono la stessa richiesta
+        if req_id in seen:
+            return jsonify({'status':'error','message':f"Decisione {i}: richiesta {req_id} ripetuta nel lotto",
+                            'index': i}), 400
+        seen.add(req_id)
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    def apply(c):
+        # Un'operazione del thread scrittore: se una decisione fallisce il SAVEPOINT annulla tutto il lotto
+        touched = []
+        for i, d in enumerate(decisions):
+            try:
+                touched.append(_apply_removal_decision(
+                    c, d.get('request_id'), d.get('action'), admin_id,
+                    d.get('admin_reason', data.get('admin_reason')), now,
+                    hours=d.get('hours'), log_reason=d.get('reason')))
+            except (RemovalAlreadyDecided, LookupError, ValueError, TypeError) as e:
+                raise _DecisionFailed(i, e)
+        return _users_totals(c, touched)
+    try:
+        totals = idempotent_write(apply)
+    except _DecisionFailed as e:
+        status = 409 if isinstance(e.error, RemovalAlreadyDecided) else 400
+        return jsonify({'status':'error','message':f"Decisione {e.index}: {e.error}", 'index': e.index}), status
+    except (WriteUnavailable, IdempotencyKeyReused):
+        raise
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'status':'error','message':str(e)}), 500
+    if not idempotent_replay():
+        for d in decisions:
+            audit(admin_id, 'handle_removal', f"req={d.get('request_id')} action={d.get('action')} batch=1")
+    return jsonify({'status':'ok', 'applied': len(decisions), 'totals': totals})
+
+@app.route('/admin/users_hours', methods=['GET'])
+@cached_response('users', 'work_logs')
+def api_admin_users_hours():
+    conn = get_db_connection()
+    c = conn.cursor()
+    # Ore dei log archiviati dai totali mensili: l'archivio non si apre
+    c.execute("""SELECT u.id, u.name, u.surname, u.email, 
+                 COALESCE(SUM(w.hours), 0)
+                 + COALESCE((SELECT SUM(r.hours) FROM work_log_rollups r WHERE r.user_id = u.id), 0) as total_hours
+                 FROM users u
+                 LEFT JOIN work_logs w ON u.id = w.user_id
+                 GROUP BY u.id""")
+    if _wants_ndjson():
+        return _ndjson_response(conn, c)
+    rows = c.fetchall()
+    conn.close()
+    return jsonify([dict(r) for r in rows])
+
+# Dimensioni di raggruppamento dei report: espressione SQL su work_logs w
+REPORT_DIMENSIONS = {
+    'user': 'w.user_id',
+    'day': 'substr(w.date, 1, 10)',
+    'week': "date(w.date, 'weekday 0', '-6 days')",  # lunedì della settimana
+    'month': 'substr(w.date, 1, 7)',
+    'reason': "COALESCE(NULLIF(TRIM(w.reason), ''), '-')",
+}
+# Bucket precedente di quello in k1, per il delta rispetto al periodo prima
+_REPORT_PREV_BUCKET = {
+    'day': "date(k1, '-1 day')",
+    'week': "date(k1, '-7 days')",
+    'month': "substr(date(k1 || '-01', '-1 month'), 1, 7)",
+}
+REPORT_SORTS = {'key': 'k1', 'hours': 'hours', 'entries': 'entries', 'share': 'share', 'delta': 'delta', 'rank': 'rank'}
+
+def _report_buckets(dim, day):
+    """Inizio del bucket temporale che contiene day e inizio del bucket precedente"""
+    if dim == 'day':
+        return day, day - timedelta(days=1)
+    if dim == 'week':
+        monday = day - timedelta(days=day.weekday())
+        return monday, monday - timedelta(days=7)
+    first = day.replace(day=1)
+    return first, (first - timedelta(days=1)).replace(day=1)
+
+@app.route('/admin/reports', methods=['GET'])
+@cached_response('users', 'work_logs')
+def api_admin_reports():
+    """Report ore su un intervallo di date, calcolato in SQL con funzioni finestra.
+    Parametri: from/to (YYYY-MM-DD, inclusi), group_by (una o due dimensioni tra
+    user/day/week/month/reason, es. "month,user"), user_id, sort, order, top, limit, offset.
+    Per ogni riga: ore, voci, quota sul gruppo, posizione, delta sul periodo precedente
+    e totale progressivo (questi ultimi due solo se la prima dimensione è temporale:
+    in quel caso 'from' viene esteso all'inizio del primo bucket)."""
+    today = datetime.now().date()
+    try:
+        date_from = datetime.strptime(request.args.get('from') or today.replace(day=1).isoformat(), '%Y-%m-%d').date()
+        date_to = datetime.strptime(request.args.get('to') or today.isoformat(), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'status':'error','message':'Date non valide (formato YYYY-MM-DD)'}), 400
+    if date_to < date_from:
+        return jsonify({'status':'error','message':"'to' precede 'from'"}), 400
+    dims = [d.strip() for d in request.args.get('group_by', 'user').split(',') if d.strip()]
+    if not dims or len(dims) > 2 or len(set(dims)) != len(dims) or any(d not in REPORT_DIMENSIONS for d in dims):
+        return jsonify({'status':'error','message':f"group_by: una o due tra {', '.join(REPORT_DIMENSIONS)}"}), 400
+    dim1 = dims[0]
+    dim2 = dims[1] if len(dims) > 1 else None
+    timed = dim1 in _REPORT_PREV_BUCKET
+    sort = request.args.get('sort', 'key' if timed else 'hours')
+    if sort not in REPORT_SORTS:
+        return jsonify({'status':'error','message':f"sort: uno tra {', '.join(REPORT_SORTS)}"}), 400
+    order = request.args.get('order', 'asc' if sort in ('key', 'rank') else 'desc').lower()
+    if order not in ('asc', 'desc'):
+        return jsonify({'status':'error','message':"order: asc o desc"}), 400
+    user_id = request.args.get('user_id', type=int)
+    top = request.args.get('top', type=int)
+    limit = max(1, min(request.args.get('limit', REPORT_PAGE_SIZE, type=int), REPORT_MAX_ROWS))
+    offset = max(0, request.args.get('offset', 0, type=int))
+
+    if timed:
+        # Bucket interi; si legge anche quello precedente al primo, che serve al delta della prima riga
+        date_from, scan_from = _report_buckets(dim1, date_from)
+    else:
+        scan_from = date_from
+    # Intervallo su w.date (testo ISO): la scansione usa idx_work_logs_date o idx_work_logs_user_date
+    end = (date_to + timedelta(days=1)).isoformat()
+    where = 'w.date >= ? AND w.date < ?'
+    filters = []
+    if user_id is not None:
+        where += ' AND w.user_id = ?'
+        filters.append(user_id)
+
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("INSERT INTO removal_requests (work_log_id, requester_id, reason, request_date) VALUES (?,?,?,?)",
-              (work_log_id, requester_id, reason, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+    # Righe e totali dalla stessa fotografia del database; l'archivio solo se l'intervallo ci arriva
+    tables = work_logs_tables(begin_logs_read(conn, scan_from.isoformat()))
+
+    group = 'PARTITION BY k1' if dim2 else ''
+    series = 'PARTITION BY k2' if dim2 else ''
+    if timed:
+        prev = _REPORT_PREV_BUCKET[dim1]
+        # Se il periodo precedente non ha ore LAG ne salterebbe uno: il delta è solo sul periodo adiacente
+        delta = (f"CASE WHEN LAG(k1) OVER ({series} ORDER BY k1) = {prev} "
+                 f"THEN hours - LAG(hours) OVER ({series} ORDER BY k1) ELSE hours END")
+        running = f"ROUND(SUM(hours) OVER ({series} ORDER BY k1 ROWS UNBOUNDED PRECEDING), 2)"
+        first_bucket = date_from.isoformat()[:7] if dim1 == 'month' else date_from.isoformat()
+    else:
+        delta = running = 'NULL'
+    # Nome e cognome solo per le dimensioni 'user'
+    labels = ', '.join(f"u{i}.name || ' ' || u{i}.surname AS k{i}_label" if d == 'user' else f"NULL AS k{i}_label"
+                       for i, d in ((1, dim1), (2, dim2)))
+    joins = ' '.join(f"LEFT JOIN users u{i} ON u{i}.id = r.k{i}" for i, d in ((1, dim1), (2, dim2)) if d == 'user')
+    # Parziali per tabella (work_logs ed eventualmente l'archivio), sommati in base
+    partials = ' UNION ALL '.join(
+        f"""SELECT {REPORT_DIMENSIONS[dim1]} AS k1, {REPORT_DIMENSIONS[dim2] if dim2 else 'NULL'} AS k2,
+                   SUM(w.hours) AS hours, COUNT(*) AS entries
+            FROM {table} w
+            WHERE {where} AND {cond}
+            GROUP BY k1, k2""" for table, cond, _ in tables)
+    # delta si calcola prima di scartare il bucket precedente; quote, posizioni e progressivi dopo
+    sql = f"""
+        WITH base AS (
+            SELECT k1, k2, ROUND(SUM(hours), 2) AS hours, SUM(entries) AS entries
+            FROM ({partials})
+            GROUP BY k1, k2
+        ), lagged AS (
+            SELECT *, ROUND({delta}, 2) AS delta FROM base
+        ), ranked AS (
+            SELECT k1, k2, hours, entries, delta,
+                   ROUND(hours * 100.0 / NULLIF(SUM(hours) OVER ({group}), 0), 2) AS share,
+                   RANK() OVER ({group} ORDER BY hours DESC) AS rank,
+                   {running} AS running
+            FROM lagged
+            {'WHERE k1 >= ?' if timed else ''}
+        )
+        SELECT r.*, {labels}
+        FROM ranked r {joins}
+        {'WHERE r.rank <= ?' if top else ''}
+        ORDER BY {'r.k1, ' if dim2 else ''}r.{REPORT_SORTS[sort]} {order.upper()}, r.k1, r.k2
+        LIMIT ? OFFSET ?"""
+    params = [p for _, _, cond_params in tables for p in [scan_from.isoformat(), end] + filters + cond_params]
+    if timed:
+        params.append(first_bucket)
+    if top:
+        params.append(top)
+    params += [limit + 1, offset]
+
+    c.execute(sql, params)
+    rows = c.fetchall()
+    partials = ' UNION ALL '.join(f"SELECT w.user_id, SUM(w.hours) AS hours, COUNT(*) AS entries FROM {table} w "
+                                  f"WHERE {where} AND {cond} GROUP BY w.user_id" for table, cond, _ in tables)
+    c.execute(f"SELECT ROUND(COALESCE(SUM(hours), 0), 2), COALESCE(SUM(entries), 0), COUNT(DISTINCT user_id) FROM ({partials})",
+              [p for _, _, cond_params in tables for p in [date_from.isoformat(), end] + filters + cond_params])
+    total_hours, total_entries, total_users = c.fetchone()
     conn.commit()
     conn.close()
-    return jsonify({'status':'ok'})
 
-@app.route('/admin/removal_requests', methods=['GET'])
-def api_admin_removal_requests():
+    out = []
+    for r in rows[:limit]:
+        out.append({
+            'key': r['k1'], 'label': r['k1_label'] or str(r['k1']),
+            'sub_key': r['k2'], 'sub_label': (r['k2_label'] or str(r['k2'])) if dim2 else None,
+            'hours': r['hours'], 'entries': r['entries'], 'share': r['share'], 'rank': r['rank'],
+            'delta': r['delta'], 'running': r['running'],
+        })
+    return jsonify({
+        'from': date_from.isoformat(), 'to': date_to.isoformat(), 'group_by': dims, 'sort': sort, 'order': order,
+        'totals': {'hours': total_hours, 'entries': total_entries, 'users': total_users},
+        'rows': out, 'more': len(rows) > limit,
+    })
+
+# --- Timbratura da badge (modalità kiosk) ---
+class UserCodeCache:
+    """Mappa in memoria codice badge -> utente per /kiosk/scan.
+    Caricata per intero al primo uso (o all'avvio del server) e ricaricata dopo
+    KIOSK_CODE_CACHE_TTL secondi; un codice sconosciuto si cerca sull'indice UNIQUE
+    di users.code. Le scritture sugli utenti chiamano invalidate()."""
+    def __init__(self):
+        self._users = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        conn = get_db_connection()
+        try:
+            rows = conn.execute('SELECT id, code, name, surname, role FROM users WHERE code IS NOT NULL').fetchall()
+        finally:
+            conn.close()
+        with self._lock:
+            self._users = {r['code']: dict(r) for r in rows}
+            self._loaded_at = time.monotonic()
+        return len(rows)
+
+    def get(self, code):
+        with self._lock:
+            stale = self._loaded_at is None or time.monotonic() - self._loaded_at > KIOSK_CODE_CACHE_TTL
+            user = None if stale else self._users.get(code)
+        if stale:
+            self.load()
+            with self._lock:
+                user = self._users.get(code)
+        if user is not None:
+            self.hits += 1
+            return user
+        self.misses += 1
+        conn = get_db_connection()
+        try:
+            r = conn.execute('SELECT id, code, name, surname, role FROM users WHERE code=?', (code,)).fetchone()
+        finally:
+            conn.close()
+        if r is None:
+            return None
+        with self._lock:
+            self._users[code] = dict(r)
+        return dict(r)
+
+    def invalidate(self, code=None):
+        """Dimentica un codice (o tutto, alla prossima lettura si ricarica)"""
+        with self._lock:
+            if code is None:
+                self._loaded_at = None
+            else:
+                self._users.pop(code, None)
+
+_user_codes = UserCodeCache()
+METRICS.register_gauge('kiosk_code_cache_hits_total', 'Badge risolti dalla cache in memoria', lambda: _user_codes.hits)
+METRICS.register_gauge('kiosk_code_cache_misses_total', 'Badge cercati nel database', lambda: _user_codes.misses)
+
+@app.route('/kiosk/scan', methods=['POST'])
+def api_kiosk_scan():
+    """Timbratura da badge in un solo passaggio: codice -> utente (cache in memoria) e punch.
+    Entrata e uscita si alternano; all'uscita le ore del turno diventano un log in work_logs.
+    Una seconda lettura dello stesso badge entro KIOSK_DEBOUNCE secondi non registra nulla,
+    così come un'entrata rimasta aperta oltre KIOSK_MAX_SHIFT_HOURS non chiude un turno."""
+    data = request.get_json(silent=True) or {}
+    code = str(data.get('code') or '').strip()
+    terminal = str(data.get('terminal') or request.remote_addr or '')[:64]
+    if not code:
+        return jsonify({'status':'error','message':'Codice mancante'}), 400
+    user = _user_codes.get(code)
+    if user is None:
+        return jsonify({'status':'error','message':'Badge non riconosciuto'}), 404
+    now = datetime.now()
+
+    def punch(c):
+        c.execute('SELECT kind, ts FROM punches WHERE user_id=? ORDER BY ts DESC, id DESC LIMIT 1', (user['id'],))
+        last = c.fetchone()
+        elapsed = (now - datetime.strptime(last['ts'], '%Y-%m-%d %H:%M:%S')).total_seconds() if last else None
+        if last and elapsed < KIOSK_DEBOUNCE:
+            return {'kind': last['kind'], 'ts': last['ts'], 'hours': None, 'duplicate': True}
+        ts = now.strftime('%Y-%m-%d %H:%M:%S')
+        hours = log_id = None
+        if last and last['kind'] == 'in' and elapsed <= KIOSK_MAX_SHIFT_HOURS * 3600:
+            kind = 'out'
+            hours = round(elapsed / 3600, 2)
+            c.execute("INSERT INTO work_logs (user_id, date, hours, reason) VALUES (?, ?, ?, ?)",
+                      (user['id'], ts, hours, KIOSK_LOG_REASON))
+            log_id = c.lastrowid
+        else:
+            kind = 'in'
+        c.execute('INSERT INTO punches (user_id, ts, kind, terminal, work_log_id) VALUES (?,?,?,?,?)',
+                  (user['id'], ts, kind, terminal, log_id))
+        return {'kind': kind, 'ts': ts, 'hours': hours, 'duplicate': False}
+
+    result = _db_writer.execute(punch)
+    if not result['duplicate']:
+        if result['hours'] is not None:
+            response_cache.invalidate('work_logs')
+        audit(user['id'], 'kiosk_punch', f"{result['kind']} terminal={terminal} hours={result['hours']}")
+    return jsonify({'status':'ok', 'user_id': user['id'], 'name': user['name'], 'surname': user['surname'], **result})
+
+# --- Export ore (CSV / XLSX in streaming) ---
+EXPORT_COLUMNS = [('log_id', 'ID log'), ('date', 'Data'), ('user_id', 'ID utente'), ('code', 'Codice'),
+                  ('surname', 'Cognome'), ('name', 'Nome'), ('email', 'Email'), ('hours', 'Ore'), ('reason', 'Motivo')]
+_XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def _export_batches(date_from, end, user_id=None):
+    """Righe di work_logs + users nell'intervallo, a blocchi di EXPORT_BATCH.
+    Paginazione per chiave (date, id) sull'indice di date: ogni blocco è una lettura breve,
+    così un export lungo non tiene il database bloccato per gli scrittori.
+    Finché la chiave è nel periodo archiviato si legge un blocco anche dall'archivio
+    e i due blocchi ordinati si fondono."""
+    conn = get_db_connection()
+    try:
+        key = (date_from, -1)
+        while True:
+            batch = begin_logs_read(conn, key[0])
+            rows = []
+            for table, cond, cond_params in work_logs_tables(batch):
+                sql = f'''SELECT w.id AS log_id, w.date, w.user_id, u.code, u.surname, u.name, u.email, w.hours, w.reason
+                          FROM {table} w LEFT JOIN users u ON u.id = w.user_id
+                          WHERE w.date >= ? AND w.date < ? AND NOT (w.date = ? AND w.id <= ?) AND {cond}'''
+                params = [key[0], end, key[0], key[1]] + cond_params
+                if user_id is not None:
+                    sql += ' AND w.user_id = ?'
+                    params.append(user_id)
+                rows += conn.execute(sql + ' ORDER BY w.date, w.id LIMIT ?', params + [EXPORT_BATCH]).fetchall()
+            conn.commit()
+            if not rows:
+                return
+            if batch is not None:
+                rows = sorted(rows, key=lambda r: (r['date'], r['log_id']))[:EXPORT_BATCH]
+            yield rows
+            key = (rows[-1]['date'], rows[-1]['log_id'])
+    finally:
+        conn.close()
+
+# Un testo che inizia così verrebbe letto da Excel come formula (CSV injection)
+_CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def _csv_cell(value):
+    """Testi che sembrano formule con un apostrofo davanti: Excel li mostra come testo"""
+    if isinstance(value, str) and value.startswith(_CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def _export_csv(batches, delimiter):
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter=delimiter, lineterminator='\r\n')
+    buf.write('\ufeff')  # BOM: Excel riconosce l'UTF-8
+    writer.writerow([label for _, label in EXPORT_COLUMNS])
+    for rows in batches:
+        writer.writerows([_csv_cell(r[col]) for col, _ in EXPORT_COLUMNS] for r in rows)
+        yield buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue().encode('utf-8')
+
+class _ZipStream(io.RawIOBase):
+    """File di sola scrittura per ZipFile: i byte scritti si raccolgono con drain().
+    Non è seekable, quindi zipfile usa i data descriptor e scrive tutto in avanti."""
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def _xlsx_cell(value):
+    # I testi restano inlineStr e non si scrive mai <f>: nessun valore diventa una formula
+    if value is None:
+        return '<c/>'
+    if isinstance(value, (int, float)):
+        return f'<c><v>{value}</v></c>'
+    text = html_escape(_XML_INVALID.sub('', str(value)), quote=False)
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+def _xlsx_row(values):
+    return '<row>' + ''.join(_xlsx_cell(v) for v in values) + '</row>'
+
+_XLSX_STATIC = {
+    '[Content_Types].xml': '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet2.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    '_rels/.rels': '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>',
+    'xl/workbook.xml': '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>'
+        '<sheet name="Ore" sheetId="1" r:id="rId1"/><sheet name="Totali" sheetId="2" r:id="rId2"/>'
+        '</sheets></workbook>',
+    'xl/_rels/workbook.xml.rels': '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet2.xml"/>'
+        '</Relationships>',
+}
+_XLSX_SHEET_HEAD = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+_XLSX_SHEET_TAIL = '</sheetData></worksheet>'
+
+def _export_xlsx(batches, totals):
+    """Cartella XLSX scritta in avanti (solo libreria standard): foglio "Ore" riga per riga
+    mentre arrivano i blocchi, foglio "Totali" con le ore per utente"""
+    out = _ZipStream()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED, compresslevel=COMPRESS_LEVEL) as zf:
+        for name, content in _XLSX_STATIC.items():
+            zf.writestr(name, content)
+        with zf.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write((_XLSX_SHEET_HEAD + _xlsx_row([label for _, label in EXPORT_COLUMNS])).encode('utf-8'))
+            for rows in batches:
+                sheet.write(''.join(_xlsx_row([r[col] for col, _ in EXPORT_COLUMNS]) for r in rows).encode('utf-8'))
+                yield out.drain()
+            sheet.write(_XLSX_SHEET_TAIL.encode('utf-8'))
+        with zf.open('xl/worksheets/sheet2.xml', 'w') as sheet:
+            sheet.write((_XLSX_SHEET_HEAD + _xlsx_row(['ID utente', 'Codice', 'Cognome', 'Nome', 'Voci', 'Ore'])).encode('utf-8'))
+            sheet.write(''.join(_xlsx_row(list(r)) for r in totals()).encode('utf-8'))
+            sheet.write(_XLSX_SHEET_TAIL.encode('utf-8'))
+    yield out.drain()
+
+@app.route('/admin/export/work_logs', methods=['GET'])
+def api_admin_export_work_logs():
+    """Export delle ore per le paghe: work_logs + users in un intervallo di date, in CSV
+    (format=csv, delimiter=, o ;) o XLSX (format=xlsx). La risposta è generata in streaming
+    a memoria costante; X-Export-Rows anticipa il numero di righe per la barra di avanzamento."""
+    today = datetime.now().date()
+    try:
+        date_from = datetime.strptime(request.args.get('from') or today.replace(day=1).isoformat(), '%Y-%m-%d').date()
+        date_to = datetime.strptime(request.args.get('to') or today.isoformat(), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'status':'error','message':'Date non valide (formato YYYY-MM-DD)'}), 400
+    if date_to < date_from:
+        return jsonify({'status':'error','message':"'to' precede 'from'"}), 400
+    fmt = request.args.get('format', 'csv').lower()
+    delimiter = request.args.get('delimiter', ',')
+    if fmt not in ('csv', 'xlsx') or delimiter not in (',', ';'):
+        return jsonify({'status':'error','message':"format: csv o xlsx; delimiter: ',' o ';'"}), 400
+    user_id = request.args.get('user_id', type=int)
+    start, end = date_from.isoformat(), (date_to + timedelta(days=1)).isoformat()
+
+    where = 'w.date >= ? AND w.date < ?' + (' AND w.user_id = ?' if user_id is not None else '')
+    params = [start, end] + ([user_id] if user_id is not None else [])
+    conn = get_db_connection()
+    tables = work_logs_tables(begin_logs_read(conn, start))
+    total_rows = sum(conn.execute(f'SELECT COUNT(*) FROM {table} w WHERE {where} AND {cond}', params + cond_params).fetchone()[0]
+                     for table, cond, cond_params in tables)
+    conn.close()
+
+    def totals():
+        conn = get_db_connection()
+        try:
+            tables = work_logs_tables(begin_logs_read(conn, start))
+            partials = ' UNION ALL '.join(f"SELECT w.user_id, COUNT(*) AS entries, SUM(w.hours) AS hours FROM {table} w "
+                                          f"WHERE {where} AND {cond} GROUP BY w.user_id" for table, cond, _ in tables)
+            return conn.execute(f'''SELECT t.user_id, u.code, u.surname, u.name, t.entries, t.hours FROM
+                                    (SELECT user_id, SUM(entries) AS entries, ROUND(SUM(hours), 2) AS hours
+                                     FROM ({partials}) GROUP BY user_id) t
+                                    LEFT JOIN users u ON u.id = t.user_id
+                                    ORDER BY u.surname, u.name, t.user_id''',
+                                [p for _, _, cond_params in tables for p in params + cond_params]).fetchall()
+        finally:
+            conn.close()
+
+    batches = _export_batches(start, end, user_id)
+    filename = f"ore_{date_from.isoformat()}_{date_to.isoformat()}"
+    if fmt == 'csv':
+        response = Response(_export_csv(batches, delimiter), mimetype='text/csv')
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    else:
+        response = Response(_export_xlsx(batches, totals),
+                            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}.xlsx"'
+    response.headers['X-Export-Rows'] = str(total_rows)
+    audit(None, 'export_work_logs', f"{fmt} {start}..{date_to.isoformat()} user={user_id} rows={total_rows}")
+    return response
+
+@app.route('/admin/audit', methods=['GET'])
+def api_admin_audit():
+    """Consultazione audit log con filtri per utente, azione e intervallo (since/until)"""
+    where = []
+    params = []
+    if request.args.get('user_id'):
+        where.append('user_id = ?')
+        params.append(request.args.get('user_id', type=int))
+    if request.args.get('action'):
+        where.append('action = ?')
+        params.append(request.args.get('action'))
+    if request.args.get('since'):
+        where.append('ts >= ?')
+        params.append(request.args.get('since'))
+    if request.args.get('until'):
+        where.append('ts <= ?')
+        params.append(request.args.get('until'))
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    sql = "SELECT id, ts, user_id, action, details FROM audit_log"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY ts DESC, id DESC LIMIT ? OFFSET ?"
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("""SELECT r.*, w.date as work_date, w.hours 
-                 FROM removal_requests r 
-                 JOIN work_logs w ON r.work_log_id = w.id 
-                 WHERE r.status='pending'""")
+    c.execute(sql, params + [limit, offset])
+    if _wants_ndjson():
+        return _ndjson_response(conn, c)
     rows = c.fetchall()
     conn.close()
     return jsonify([dict(r) for r in rows])
 
-@app.route('/admin/handle_removal', methods=['POST'])
-def api_admin_handle_removal():
-    if request is None: return jsonify({'status':'error'}), 500
-    data = request.get_json()
-    req_id = data.get('request_id')
-    action = data.get('action')
-    admin_id = data.get('admin_id')
-    admin_reason = data.get('admin_reason')
+def _fts_query(text):
+    """Testo libero -> query FTS5 sicura: ogni parola quotata e cercata come prefisso (AND implicito)"""
+    tokens = re.findall(r'\w+', text or '')
+    return ' '.join(f'"{t}"*' for t in tokens[:SEARCH_MAX_TERMS])
+
+@app.route('/search', methods=['GET'])
+def api_search():
+    """Ricerca full-text ordinata per pertinenza (bm25) su personaggi e motivazioni dei log.
+    Parametri: q, scope (all|characters|logs), user_id (solo log), limit, offset"""
+    if not SEARCH_AVAILABLE:
+        return jsonify({'status':'error','message':'Ricerca non disponibile: SQLite senza FTS5'}), 501
+    match = _fts_query(request.args.get('q'))
+    if not match:
+        return jsonify({'status':'error','message':'Testo di ricerca mancante'}), 400
+    scope = request.args.get('scope', 'all')
+    if scope not in ('all', 'characters', 'logs'):
+        return jsonify({'status':'error','message':'scope non valido'}), 400
+    limit = max(1, min(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), 200))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    out = {'status':'ok', 'limit': limit, 'offset': offset}
+
     conn = get_db_connection()
     c = conn.cursor()
-    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    c.execute("UPDATE removal_requests SET status=?, admin_id=?, admin_reason=?, decision_date=? WHERE id=?",
-              (action, admin_id, admin_reason, now, req_id))
-    if action == 'accepted':
-        c.execute("SELECT work_log_id FROM removal_requests WHERE id=?", (req_id,))
-        wl_id = c.fetchone()[0]
-        c.execute("DELETE FROM work_logs WHERE id=?", (wl_id,))
-    conn.commit()
+    if scope in ('all', 'characters'):
+        # Pesi bm25: nome > ruolo/serie > testo del copione
+        c.execute('''SELECT b.id, b.series_title, b.character_name, b.role, b.expiry_date,
+                     snippet(characters_fts, -1, '[', ']', '…', 12) AS snippet,
+                     bm25(characters_fts, 10.0, 4.0, 4.0, 1.0) AS score
+                     FROM characters_fts JOIN bacheca_characters b ON b.id = characters_fts.rowid
+                     WHERE characters_fts MATCH ? ORDER BY score LIMIT ? OFFSET ?''',
+                  (match, limit + 1, offset))
+        rows = c.fetchall()
+        out['characters'] = [dict(r) for r in rows[:limit]]
+        out['characters_more'] = len(rows) > limit
+    if scope in ('all', 'logs'):
+        sql = '''SELECT w.id, w.user_id, u.name, u.surname, w.date, w.hours, w.reason,
+                 snippet(work_logs_fts, 0, '[', ']', '…', 12) AS snippet,
+                 bm25(work_logs_fts) AS score
+                 FROM work_logs_fts JOIN work_logs w ON w.id = work_logs_fts.rowid
+                 LEFT JOIN users u ON u.id = w.user_id
+                 WHERE work_logs_fts MATCH ?'''
+        params = [match]
+        if request.args.get('user_id'):
+            sql += ' AND w.user_id = ?'
+            params.append(request.args.get('user_id', type=int))
+        c.execute(sql + ' ORDER BY score LIMIT ? OFFSET ?', params + [limit + 1, offset])
+        rows = c.fetchall()
+        out['logs'] = [dict(r) for r in rows[:limit]]
+        out['logs_more'] = len(rows) > limit
     conn.close()
-    return jsonify({'status':'ok'})
+    return jsonify(out)
 
-@app.route('/admin/users_hours', methods=['GET'])
-def api_admin_users_hours():
+@app.route('/admin/backups', methods=['GET', 'POST'])
+def api_admin_backups():
+    """GET: backup presenti. POST: backup immediato (verificato) e retention"""
+    if request.method == 'GET':
+        return jsonify({'directory': _backup_dir(), 'keep': BACKUP_KEEP, 'interval': BACKUP_INTERVAL,
+                        'backups': list_backups()})
+    data = request.get_json(silent=True) or {}
+    try:
+        info = backup_database(label=data.get('label') or 'manual')
+    except BackupInProgress as e:
+        return jsonify({'status':'error','message':str(e)}), 409
+    except (RuntimeError, sqlite3.Error, OSError) as e:
+        traceback.print_exc()
+        return jsonify({'status':'error','message':str(e)}), 500
+    info.pop('path', None)
+    info['pruned'] = prune_backups()
+    return jsonify(dict(info, status='ok'))
+
+@app.route('/admin/archive', methods=['GET', 'POST'])
+def api_admin_archive():
+    """GET: stato dell'archivio dei log. POST {days}: avvia in background archiviazione e
+    manutenzione e risponde 202 (409 se ce n'è già una in corso); l'esito si legge con GET"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        days = data.get('days', ARCHIVE_AFTER_DAYS)
+        # bool è una sottoclasse di int: {"days": true} non vale 1 giorno
+        if days is None or isinstance(days, bool) or not isinstance(days, int) or days < 0:
+            return jsonify({'status':'error','message':'days: numero di giorni non negativo'}), 400
+        # Il job periodico potrebbe avere il lock: in quel caso l'avvio fallirebbe solo nel thread
+        if _archive_lock.locked() or not _archive_now.start(days):
+            return jsonify({'status':'error','message':'Archiviazione già in corso'}), 409
+        return jsonify({'status':'accepted', 'days': days}), 202
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute("""SELECT u.id, u.name, u.surname, u.email, 
-                 COALESCE(SUM(w.hours), 0) as total_hours
-                 FROM users u
-                 LEFT JOIN work_logs w ON u.id = w.user_id
-                 GROUP BY u.id""")
-    rows = c.fetchall()
+    c.execute('SELECT COUNT(*), COALESCE(SUM(rows), 0), MAX(max_date), MAX(archived_at) FROM archive_batches')
+    batches, rows, max_date, last_run = c.fetchone()
+    hot_rows = c.execute('SELECT COUNT(*) FROM work_logs').fetchone()[0]
+    page_size = c.execute('PRAGMA page_size').fetchone()[0]
+    pages = c.execute('PRAGMA page_count').fetchone()[0]
+    free = c.execute('PRAGMA freelist_count').fetchone()[0]
     conn.close()
-    return jsonify([dict(r) for r in rows])
+    archive_path = _archive_path()
+    return jsonify({
+        'after_days': ARCHIVE_AFTER_DAYS, 'batches': batches, 'archived_rows': rows,
+        'archived_until': max_date, 'last_run': last_run, 'hot_rows': hot_rows,
+        'running': _archive_lock.locked() or _archive_now.running(),
+        'db_size': pages * page_size, 'free_bytes': free * page_size,
+        'archive_size': os.path.getsize(archive_path) if os.path.exists(archive_path) else 0,
+    })
+
+@app.route('/admin/cache', methods=['GET', 'DELETE'])
+def api_admin_cache():
+    """Statistiche della cache delle risposte (hit/miss per route); DELETE la svuota"""
+    if request.method == 'DELETE':
+        response_cache.clear()
+        audit(None, 'cache_clear', '')
+    return jsonify(response_cache.snapshot())
+
+@app.route('/metrics', methods=['GET'])
+def api_metrics():
+    """Metriche in formato testo Prometheus"""
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
 
 # ---------------- CLIENT SIDE ----------------
 if PYQT_AVAILABLE:
+
+    class _TaskSignals(QtCore.QObject):
+        done = QtCore.pyqtSignal(object)
+        failed = QtCore.pyqtSignal(object)
+        progress = QtCore.pyqtSignal(object)
+
+    class _BackgroundTask(QtCore.QRunnable):
+        def __init__(self, fn, with_progress=False):
+            super().__init__()
+            self.fn = fn
+            self.with_progress = with_progress
+            self.signals = _TaskSignals()
+
+        def run(self):
+            try:
+                # Con with_progress fn riceve una callback per inviare risultati parziali alla GUI
+                result = self.fn(self.signals.progress.emit) if self.with_progress else self.fn()
+            except Exception as e:
+                self.signals.failed.emit(e)
+            else:
+                self.signals.done.emit(result)
+
+    _pending_tasks = set()  # riferimenti vivi finché i segnali non sono consegnati
+
+    def run_in_background(fn, on_done=None, on_error=None, on_progress=None):
+        """Esegue fn nel QThreadPool; on_done/on_error (e on_progress, se dato) vengono chiamati
+        nel thread della GUI. Con on_progress fn riceve come argomento la funzione emit."""
+        task = _BackgroundTask(fn, with_progress=on_progress is not None)
+        task.setAutoDelete(False)
+        _pending_tasks.add(task)
+
+        def release():
+            # deleteLater libera anche le connessioni (e con esse le closure che puntano al task)
+            _pending_tasks.discard(task)
+            task.signals.deleteLater()
+
+        def done(result):
+            release()
+            if on_done:
+                on_done(result)
+
+        def failed(error):
+            release()
+            if on_error:
+                on_error(error)
+            else:
+                print(f"[BG] Errore: {error}")
+
+        task.signals.done.connect(done)
+        task.signals.failed.connect(failed)
+        if on_progress:
+            task.signals.progress.connect(on_progress)
+        QtCore.QThreadPool.globalInstance().start(task)
+        return task
+
+    def load_ndjson_in_background(url, on_rows, on_done=None, on_error=None, timeout=8):
+        """Legge uno stream NDJSON fuori dal thread GUI e consegna le righe a on_rows
+        a blocchi di NDJSON_CLIENT_BATCH (sempre nel thread della GUI, in ordine)"""
+        def read(emit):
+            batch = []
+            for obj in iter_ndjson(url, timeout=timeout):
+                batch.append(obj)
+                if len(batch) >= NDJSON_CLIENT_BATCH:
+                    emit(batch)
+                    batch = []
+            if batch:
+                emit(batch)
+
+        return run_in_background(read, on_done=lambda _: on_done and on_done(),
+                                 on_error=on_error, on_progress=on_rows)
+
+    def _load_scaled_image(url, width, height):
+        """Scarica e decodifica un'immagine fuori dal thread GUI (QImage, non QPixmap, è thread-safe)"""
+        image = QtGui.QImage()
+        if not image.loadFromData(fetch_asset(url)):
+            raise ValueError('immagine non valida')
+        return image.scaled(width, height, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+
+    def _get_json(url, timeout=8):
+        r = http_session.get(url, timeout=timeout)
+        r.raise_for_status()
+        return r.json()
     
     class BachecaWindow(QDialog):
         def __init__(self, server_url, user, parent=None):
@@ -1030,16 +4603,37 @@ if PYQT_AVAILABLE:
             self.characters = { 'After School': [], 'Empire Office': [] }
             self.current_index = { 'After School': 0, 'Empire Office': 0 }
             self.last_update = None
+            # Copia locale per la sincronizzazione incrementale (id -> personaggio)
+            self._by_id = {}
+            self.version = 0
+            # Immagini già scaricate e decodificate (url -> QImage), LRU entro BACHECA_DECODED_BYTES
+            self._decoded = OrderedDict()
+            self._decoded_bytes = 0
+            self._loading = set()
 
             self._build_tab_ui(self.tab_after, 'After School')
             self._build_tab_ui(self.tab_empire, 'Empire Office')
 
+            # Il polling gira solo mentre la finestra è visibile (vedi showEvent/hideEvent):
+            # la bacheca preriscaldata al login non interroga il server
             self.poll_timer = QtCore.QTimer(self)
+            self.poll_timer.setInterval(BACHECA_POLL_INTERVAL)
             self.poll_timer.timeout.connect(self.check_updates)
-            self.poll_timer.start(25000)
+            self._polling = False
 
             self.load_characters()
 
+        def showEvent(self, event):
+            super().showEvent(event)
+            if not self.poll_timer.isActive():
+                self.poll_timer.start()
+                if self.version:
+                    self.check_updates()  # allinea subito le modifiche arrivate mentre era nascosta
+
+        def hideEvent(self, event):
+            self.poll_timer.stop()
+            super().hideEvent(event)
+
         def _build_tab_ui(self, widget, series_title):
             layout = QHBoxLayout()
             left = QVBoxLayout()
@@ -1097,6 +4691,12 @@ if PYQT_AVAILABLE:
             btn_refresh = QPushButton('Aggiorna')
             btn_refresh.clicked.connect(self.load_characters)
 
+            # Anteprima del copione estratta dal server (niente download del .docx)
+            preview = QTextBrowser()
+            preview.setObjectName(f'preview_{series_title}')
+            preview.setOpenLinks(False)
+            preview.setPlaceholderText('Nessun copione')
+
             right.addWidget(btn_script)
             right.addWidget(expiry)
             right.addWidget(role)
@@ -1104,43 +4704,79 @@ if PYQT_AVAILABLE:
             right.addWidget(btn_download_mov)
             right.addLayout(nav)
             right.addWidget(btn_refresh)
-            right.addStretch()
+            right.addWidget(QLabel('Anteprima copione:'))
+            right.addWidget(preview, 1)
 
             layout.addLayout(left, 3)
             layout.addLayout(right, 2)
             widget.setLayout(layout)
 
-        def load_characters(self):
-            try:
-                # ← MODIFICATO: passa user_id per filtrare
-                user_id = str(self.user.get('id', ''))
-                r = requests.get(f"{self.server_url}/bacheca/characters?user_id={user_id}", timeout=8)
-        
-                if r.status_code == 200:
-                    items = r.json()
-                    groups = {}
-                    for it in items:
-                        groups.setdefault(it['series_title'], []).append(it)
-                    self.characters['After School'] = groups.get('After School', [])
-                    self.characters['Empire Office'] = groups.get('Empire Office', [])
-            
-                    self.last_update = max([item.get('last_modified') for item in items if item.get('last_modified')] or [''], default=None)
-
-                    self.refresh_current_view('After School')
-                    self.refresh_current_view('Empire Office')
-            except Exception as e:
-                QMessageBox.warning(self, 'Errore', f'Errore caricamento: {e}')
+        def load_characters(self, full=False):
+            """Scarica in background solo le differenze dall'ultima versione ricevuta
+            (tutto alla prima volta o con full=True); la finestra resta reattiva"""
+            # ← MODIFICATO: passa user_id per filtrare
+            user_id = str(self.user.get('id', ''))
+            since = 0 if full else self.version
+            url = f"{self.server_url}/bacheca/characters?user_id={user_id}&since={since}"
+            run_in_background(partial(_get_json, url), self._apply_characters, self._load_failed)
+
+        def _apply_characters(self, delta):
+            if delta['full']:
+                self._by_id = {}
+            elif not delta['items'] and not delta['deleted']:
+                self.version = delta['version']
+                return  # niente di nuovo: nessun ridisegno
+            for it in delta['items']:
+                self._by_id[it['id']] = it
+            for cid in delta['deleted']:
+                self._by_id.pop(cid, None)
+            self.version = delta['version']
+
+            # Il personaggio mostrato resta lo stesso anche se la lista cambia
+            shown = {series: self._current_item(series) for series in self.characters}
+            items = sorted(self._by_id.values(), key=lambda it: (it['series_title'] or '', it['character_name'] or ''))
+            groups = {}
+            for it in items:
+                groups.setdefault(it['series_title'], []).append(it)
+            self.characters['After School'] = groups.get('After School', [])
+            self.characters['Empire Office'] = groups.get('Empire Office', [])
+            for series, item in shown.items():
+                ids = [it['id'] for it in self.characters[series]]
+                if item and item['id'] in ids:
+                    self.current_index[series] = ids.index(item['id'])
+
+            self.last_update = max([item.get('last_modified') for item in items if item.get('last_modified')] or [''], default=None)
+
+            self.refresh_current_view('After School')
+            self.refresh_current_view('Empire Office')
+
+        def _load_failed(self, error):
+            # Durante il preriscaldamento la finestra è nascosta: niente popup
+            if self.isVisible():
+                QMessageBox.warning(self, 'Errore', f'Errore caricamento: {error}')
+            else:
+                print(f"[BACHECA] Errore caricamento: {error}")
 
         def check_updates(self):
-            try:
-                r = requests.get(f"{self.server_url}/bacheca/last_update", timeout=6)
-                if r.status_code==200:
-                    lu = r.json().get('last_update')
-                    if lu and lu != self.last_update:
-                        self.last_update = lu
-                        self.load_characters()
-            except Exception:
-                pass
+            # Il delta è vuoto se non è cambiato nulla: il polling costa una risposta minima
+            if self._polling:
+                return  # il controllo precedente è ancora in corso: non si accodano richieste
+            self._polling = True
+            url = f"{self.server_url}/bacheca/characters?user_id={self.user.get('id', '')}&since={self.version}"
+            run_in_background(partial(_get_json, url, 6), self._poll_done, self._poll_failed)
+
+        def _poll_done(self, delta):
+            self._polling = False
+            if self.poll_timer.interval() != BACHECA_POLL_INTERVAL:
+                self.poll_timer.setInterval(BACHECA_POLL_INTERVAL)
+            self._apply_characters(delta)
+
+        def _poll_failed(self, e):
+            # Server sovraccarico (429/503 anche dopo i tentativi) o irraggiungibile: si rallenta
+            self._polling = False
+            interval = min(self.poll_timer.interval() * 2, BACHECA_POLL_MAX_INTERVAL)
+            self.poll_timer.setInterval(interval)
+            print(f"[BACHECA] Aggiornamento fallito: {e}, prossimo tentativo tra {interval // 1000}s")
 
         def refresh_current_view(self, series):
             lst = self.characters.get(series, [])
@@ -1152,12 +4788,68 @@ if PYQT_AVAILABLE:
             self.current_index[series] = idx
             item = lst[idx]
             self._set_tab_display(series, item)
+            self._prefetch_around(series)
+
+        def _current_item(self, series):
+            lst = self.characters.get(series, [])
+            if not lst:
+                return None
+            return lst[self.current_index.get(series, 0) % len(lst)]
+
+        def _prefetch_around(self, series):
+            """Precarica le immagini dei BACHECA_PREFETCH_RADIUS personaggi prima e dopo quello corrente"""
+            lst = self.characters.get(series, [])
+            if len(lst) < 2:
+                return
+            idx = self.current_index.get(series, 0)
+            for d in range(1, min(BACHECA_PREFETCH_RADIUS, len(lst) // 2) + 1):
+                for j in (idx + d, idx - d):
+                    url = lst[j % len(lst)].get('image_url')
+                    if url and url not in self._decoded:
+                        self._request_image(url)
+
+        def _request_image(self, url):
+            if url in self._loading:
+                return
+            self._loading.add(url)
+            img_label = self.findChild(QLabel, 'img_label_After School')
+            size = (img_label.width(), img_label.height()) if img_label else (320, 320)
+            run_in_background(partial(_load_scaled_image, url, *size),
+                              partial(self._image_ready, url), partial(self._image_failed, url))
+
+        def _image_ready(self, url, image):
+            self._loading.discard(url)
+            self._decoded[url] = image
+            self._decoded_bytes += image.byteCount()
+            while self._decoded_bytes > BACHECA_DECODED_BYTES and len(self._decoded) > 1:
+                _, old = self._decoded.popitem(last=False)
+                self._decoded_bytes -= old.byteCount()
+            for series in self.characters:
+                item = self._current_item(series)
+                if item and item.get('image_url') == url:
+                    self._show_image(series, image)
+
+        def _image_failed(self, url, error):
+            self._loading.discard(url)
+            print(f"[BACHECA] Errore caricamento immagine: {error}")
+            for series in self.characters:
+                item = self._current_item(series)
+                img_label = self.findChild(QLabel, f'img_label_{series}')
+                if item and item.get('image_url') == url and img_label:
+                    img_label.setText("Immagine\nnon disponibile")
+                    img_label.setStyleSheet("color: #999; font-size: 12px;")
+
+        def _show_image(self, series, image):
+            img_label = self.findChild(QLabel, f'img_label_{series}')
+            if img_label:
+                img_label.setPixmap(QtGui.QPixmap.fromImage(image))
 
         def _set_tab_display(self, series, item):
             name_lbl = self.findChild(QLabel, f'name_{series}')
             expiry_lbl = self.findChild(QLabel, f'expiry_{series}')
             role_lbl = self.findChild(QLabel, f'role_{series}')
             img_label = self.findChild(QLabel, f'img_label_{series}')
+            self._show_script_preview(series, item)
             
             if not item:
                 if name_lbl: name_lbl.setText('')
@@ -1173,33 +4865,48 @@ if PYQT_AVAILABLE:
             if expiry_lbl: expiry_lbl.setText('Scadenza: ' + (item.get('expiry_date') or '-'))
             if role_lbl: role_lbl.setText('Ruolo: ' + (item.get('role') or '-'))
             
-            # Carica e mostra l'immagine del personaggio
+            # Mostra l'immagine del personaggio: già decodificata se precaricata, altrimenti in background
             if img_label and item.get('image_url'):
-                try:
-                    print(f"[BACHECA] Caricamento immagine: {item['image_url']}")
-                    data = requests.get(item['image_url'], timeout=6).content
-                    pix = QtGui.QPixmap()
-                    if pix.loadFromData(data):
-                        # Scala l'immagine mantenendo le proporzioni
-                        pix = pix.scaled(img_label.width(), img_label.height(), 
-                                       QtCore.Qt.KeepAspectRatio, 
-                                       QtCore.Qt.SmoothTransformation)
-                        img_label.setPixmap(pix)
-                        print(f"[BACHECA] Immagine caricata con successo per {item['character_name']}")
-                    else:
-                        print(f"[BACHECA] Impossibile caricare l'immagine per {item['character_name']}")
-                        img_label.setText("Immagine\nnon disponibile")
-                        img_label.setStyleSheet("color: #999; font-size: 12px;")
-                except Exception as e:
-                    print(f"[BACHECA] Errore caricamento immagine: {e}")
-                    img_label.setText("Errore\ncaricamento")
-                    img_label.setStyleSheet("color: #ff0000; font-size: 12px;")
+                url = item['image_url']
+                image = self._decoded.get(url)
+                if image is not None:
+                    self._decoded.move_to_end(url)
+                    self._show_image(series, image)
+                else:
+                    img_label.clear()
+                    img_label.setText("Caricamento...")
+                    self._request_image(url)
             else:
                 if img_label: 
                     img_label.clear()
                     img_label.setText("Nessuna\nimmagine")
                     img_label.setStyleSheet("color: #999; font-size: 12px;")
 
+        def _show_script_preview(self, series, item):
+            """Mostra l'anteprima HTML del copione; passa dalla cache asset (ETag, 304 se invariata)"""
+            preview = self.findChild(QTextBrowser, f'preview_{series}')
+            if not preview:
+                return
+            preview.clear()
+            if not item or not item.get('script_url'):
+                return
+            cid = item['id']
+
+            def show(data):
+                # Nel frattempo l'utente potrebbe essere passato a un altro personaggio
+                current = self._current_item(series)
+                if current and current['id'] == cid:
+                    preview.setHtml(data.decode('utf-8'))
+
+            def failed(error):
+                print(f"[BACHECA] Errore anteprima copione: {error}")
+                current = self._current_item(series)
+                if current and current['id'] == cid:
+                    preview.setPlainText('Anteprima non disponibile')
+
+            url = f"{self.server_url}/bacheca/character/{cid}/script_preview?format=html"
+            run_in_background(partial(fetch_asset, url), show, failed)
+
         def change_index(self, series, delta):
             if not self.characters.get(series): return
             self.current_index[series] = (self.current_index[series] + delta) % len(self.characters[series])
@@ -1217,7 +4924,7 @@ if PYQT_AVAILABLE:
                 return
             
             try:
-                r = requests.get(f"{self.server_url}/bacheca/character/{item['id']}/download_script", timeout=30)
+                r = http_session.get(f"{self.server_url}/bacheca/character/{item['id']}/download_script", timeout=30)
                 if r.status_code == 200:
                     fn, _ = QFileDialog.getSaveFileName(self, 'Salva Copione', 
                                                        f"Copione_{item['character_name']}.docx", 
@@ -1245,7 +4952,7 @@ if PYQT_AVAILABLE:
             
             files = {'mov': open(path, 'rb')}
             try:
-                r = requests.post(f"{self.server_url}/bacheca/character/{item['id']}/upload_mov", 
+                r = http_session.post(f"{self.server_url}/bacheca/character/{item['id']}/upload_mov", 
                                 files=files, data={'uploader': self.user.get('id')}, timeout=30)
                 if r.status_code==200 and r.json().get('status')=='ok':
                     QMessageBox.information(self, 'OK', 'File caricato')
@@ -1264,7 +4971,7 @@ if PYQT_AVAILABLE:
                 QMessageBox.information(self, 'Info', 'Nessun mov disponibile')
                 return
             try:
-                r = requests.get(f"{self.server_url}/bacheca/character/{item['id']}/download_mov", timeout=30)
+                r = http_session.get(f"{self.server_url}/bacheca/character/{item['id']}/download_mov", timeout=30)
                 if r.status_code==200:
                     fn, _ = QFileDialog.getSaveFileName(self, 'Salva .mov', item['character_name'] + '.mov', 'Movies (*.mov *.mp4)')
                     if fn:
@@ -1368,7 +5075,7 @@ if PYQT_AVAILABLE:
         def save(self):
             data = {"nickname": self.nickname.text(), "image_b64": self.selected_b64}
             try:
-                r = requests.post(f"{self.server_url}/user_profile/{self.user_id}", json=data, timeout=8)
+                r = post_json(f"{self.server_url}/user_profile/{self.user_id}", data, timeout=8)
                 if r.status_code==200 and r.json().get("status")=="ok":
                     QMessageBox.information(self, "OK", "Profilo aggiornato")
                     self.accept()
@@ -1412,7 +5119,7 @@ if PYQT_AVAILABLE:
             data = {"name": self.name.text(), "surname": self.surname.text(), 
                    "email": self.email.text(), "password": self.pw.text()}
             try:
-                r = requests.post(f"{self.server_url}/register", json=data, timeout=10)
+                r = http_session.post(f"{self.server_url}/register", json=data, timeout=10)
                 if r.status_code==200:
                     resp = r.json()
                     if resp.get("status")=="ok":
@@ -1476,7 +5183,7 @@ if PYQT_AVAILABLE:
                 return
             data = {"code": code, "password": pw}
             try:
-                r = requests.post(f"{self.server_url}/login", json=data, timeout=8)
+                r = http_session.post(f"{self.server_url}/login", json=data, timeout=8)
                 if r.status_code==200 and r.json().get("status")=="ok":
                     user = r.json()
                     self.close()
@@ -1501,11 +5208,95 @@ if PYQT_AVAILABLE:
             else:
                 print("[LOGIN] Nessun aggiornamento disponibile")
 
+    class KioskWindow(QWidget):
+        """Terminale di timbratura all'ingresso: il lettore di badge scrive il codice e preme Invio.
+        Ogni lettura è una sola POST /kiosk/scan fuori dal thread della GUI."""
+        def __init__(self, server_url, terminal='kiosk'):
+            super().__init__()
+            self.server_url = server_url
+            self.terminal = terminal
+            self.setWindowTitle("Timbracart - Kiosk")
+            self.setStyleSheet(QSS)
+            self.setWindowIcon(make_icon("clock", size=48))
+
+            layout = QVBoxLayout()
+            layout.setAlignment(QtCore.Qt.AlignCenter)
+            layout.setSpacing(30)
+            self.lbl_clock = QLabel()
+            self.lbl_clock.setAlignment(QtCore.Qt.AlignCenter)
+            self.lbl_clock.setStyleSheet("font-size: 64px; font-weight: 700; color: #333333;")
+            layout.addWidget(self.lbl_clock)
+            self.lbl_status = QLabel()
+            self.lbl_status.setAlignment(QtCore.Qt.AlignCenter)
+            self.lbl_status.setWordWrap(True)
+            layout.addWidget(self.lbl_status)
+            self.code_input = QLineEdit()
+            self.code_input.setPlaceholderText("Avvicina il badge al lettore")
+            self.code_input.setAlignment(QtCore.Qt.AlignCenter)
+            self.code_input.setEchoMode(QLineEdit.Password)  # il codice non resta a schermo
+            self.code_input.setStyleSheet("font-size: 20px;")
+            self.code_input.returnPressed.connect(self.scan)
+            layout.addWidget(self.code_input)
+            self.setLayout(layout)
+
+            self._reset_timer = QtCore.QTimer(self)
+            self._reset_timer.setSingleShot(True)
+            self._reset_timer.timeout.connect(self.show_idle)
+            self._clock_timer = QtCore.QTimer(self)
+            self._clock_timer.timeout.connect(self.update_clock)
+            self._clock_timer.start(1000)
+            QtWidgets.QShortcut(QtGui.QKeySequence("Ctrl+Q"), self, activated=self.close)
+            self.update_clock()
+            self.show_idle()
+
+        def update_clock(self):
+            self.lbl_clock.setText(datetime.now().strftime('%H:%M:%S'))
+
+        def show_idle(self):
+            self._show("Timbratura: passa il badge", "#333333")
+
+        def _show(self, text, color):
+            self.lbl_status.setText(text)
+            self.lbl_status.setStyleSheet(f"font-size: 32px; font-weight: 600; color: {color};")
+            self.code_input.setFocus()
+
+        def scan(self):
+            code = self.code_input.text().strip()
+            self.code_input.clear()
+            if not code:
+                return
+            self._show("…", "#333333")
+            run_in_background(partial(self._post_scan, code), on_done=self._scan_done, on_error=self._scan_failed)
+
+        def _post_scan(self, code):
+            r = http_session.post(f"{self.server_url}/kiosk/scan", json={'code': code, 'terminal': self.terminal}, timeout=8)
+            return r.status_code, r.json()
+
+        def _scan_done(self, result):
+            status, data = result
+            if status != 200 or data.get('status') != 'ok':
+                self._show(data.get('message') or f"Errore {status}", "#D32F2F")
+            else:
+                name = f"{data.get('name')} {data.get('surname')}"
+                when = data['ts'][11:16]
+                if data.get('duplicate'):
+                    text = f"{name}\nGià timbrato alle {when}"
+                elif data['kind'] == 'in':
+                    text = f"Entrata {when}\n{name}"
+                else:
+                    text = f"Uscita {when}\n{name} - {data['hours']} ore"
+                self._show(text, "#4CAF50")
+            self._reset_timer.start(KIOSK_MESSAGE_MS)
+
+        def _scan_failed(self, error):
+            self._show(f"Server non raggiungibile, riprova\n{error}", "#D32F2F")
+            self._reset_timer.start(KIOSK_MESSAGE_MS)
+
     class MainWindow(QMainWindow):
         def load_users_for_visibility(self):
             """Carica lista utenti nella QListWidget e la combobox di assegnazione"""
             try:
-                r = requests.get(f"{self.server_url}/get_all_users", timeout=8)
+                r = http_session.get(f"{self.server_url}/get_all_users", timeout=8)
                 if r.status_code == 200:
                     users = r.json()
                     # lista visibilità
@@ -1563,6 +5354,11 @@ if PYQT_AVAILABLE:
             self.setStyleSheet(QSS)
             self.setWindowIcon(make_icon("clock", size=48))
             self._bacheca_win = None
+            # Caricamenti NDJSON in corso: un nuovo caricamento non parte finché il precedente non finisce
+            self._users_loading = False
+            self._removals_loading = False
+            self._removals_reload = False
+            self.log_replica = LocalLogReplica(self.server_url, self.user['id'])
 
             central = QWidget()
             v_main = QVBoxLayout()
@@ -1626,11 +5422,17 @@ if PYQT_AVAILABLE:
                 
                 self.tab_admin_users = QWidget()
                 self.tab_admin_bacheca = QWidget()
+                self.tab_admin_search = QWidget()
+                self.tab_admin_reports = QWidget()
                 self.tabs_admin.addTab(self.tab_admin_users, "Utenti & Log")
                 self.tabs_admin.addTab(self.tab_admin_bacheca, "Bacheca (Personaggi)")
+                self.tabs_admin.addTab(self.tab_admin_search, "Ricerca")
+                self.tabs_admin.addTab(self.tab_admin_reports, "Report")
                 
                 self.build_admin_users()
                 self.build_admin_bacheca()
+                self.build_admin_search()
+                self.build_admin_reports()
                 
                 self.poll = QtCore.QTimer(self)
                 self.poll.timeout.connect(self.load_removal_requests)
@@ -1640,6 +5442,12 @@ if PYQT_AVAILABLE:
 
             self.load_profile()
             self.load_months()
+            # Prepara la bacheca in background: al primo click è già pronta
+            QtCore.QTimer.singleShot(0, self.warm_bacheca)
+
+        def warm_bacheca(self):
+            if self._bacheca_win is None:
+                self._bacheca_win = BachecaWindow(self.server_url, self.user, parent=self)
 
         def open_bacheca(self):
             if self._bacheca_win is None:
@@ -1658,7 +5466,7 @@ if PYQT_AVAILABLE:
 
         def load_profile(self):
             try:
-                r = requests.get(f"{self.server_url}/user_profile/{self.user['id']}", timeout=6)
+                r = http_session.get(f"{self.server_url}/user_profile/{self.user['id']}", timeout=6)
                 if r.status_code==200:
                     p = r.json()
                     nickname = p.get("nickname") or ""
@@ -1704,7 +5512,7 @@ if PYQT_AVAILABLE:
                 return
             data = {"user_id": self.user['id'], "hours": h, "reason": self.reason.text()}
             try:
-                r = requests.post(f"{self.server_url}/add_hours", json=data, timeout=8)
+                r = http_session.post(f"{self.server_url}/add_hours", json=data, timeout=8)
                 if r.status_code == 200 and r.json().get("status") == "ok":
                     QMessageBox.information(self, "OK", "Ore aggiunte correttamente")
                     self.hours.clear()
@@ -1717,16 +5525,11 @@ if PYQT_AVAILABLE:
                 QMessageBox.warning(self, "Errore", f"Errore rete: {e}")
 
         def load_recent_logs(self):
-            try:
-                r = requests.get(f"{self.server_url}/get_logs/{self.user['id']}", timeout=8)
-                if r.status_code == 200:
-                    logs = r.json()
-                    self.recent_logs.clear()
-                    for log in logs[:10]:
-                        item_text = f"{log['date']}: {log['hours']}h - {log['reason']}"
-                        self.recent_logs.addItem(item_text)
-            except Exception as e:
-                print(f"Errore caricamento log recenti: {e}")
+            """Ultimi log dalla replica locale"""
+            self.recent_logs.clear()
+            for log in self.log_replica.recent(10):
+                item_text = f"{log['date']}: {log['hours']}h - {log['reason']}"
+                self.recent_logs.addItem(item_text)
 
         def build_analytics(self):
             layout = QVBoxLayout()
@@ -1745,51 +5548,55 @@ if PYQT_AVAILABLE:
             self.tab_analytics.setLayout(layout)
 
         def load_months(self):
-            try:
-                r = requests.get(f"{self.server_url}/get_logs/{self.user['id']}", timeout=8)
-                if r.status_code == 200:
-                    logs = r.json()
-                    months = set()
-                    for log in logs:
-                        try:
-                            dt = datetime.strptime(log['date'], '%Y-%m-%d %H:%M:%S')
-                            months.add(dt.strftime('%Y-%m'))
-                        except Exception:
-                            pass
-                    
-                    self.month_combo.clear()
-                    for month in sorted(months, reverse=True):
-                        self.month_combo.addItem(month)
-                    
-                    current_month = datetime.now().strftime('%Y-%m')
-                    total = sum(log['hours'] for log in logs if log['date'].startswith(current_month))
-                    self.lbl_total.setText(f"Totale ore mese: {total:.1f}")
-                    self.load_recent_logs()
-            except Exception as e:
-                print(f"Errore caricamento mesi: {e}")
+            """Mostra subito la dashboard dalla replica locale, poi la allinea col server in background"""
+            self.render_log_views()
+            self.sync_logs()
+
+        def sync_logs(self):
+            def synced(changed):
+                if changed:
+                    self.render_log_views()
+            run_in_background(self.log_replica.sync, synced,
+                              lambda e: print(f"Errore sincronizzazione log: {e}"))
+
+        def render_log_views(self):
+            # Ripopola i mesi mantenendo quello selezionato, senza un evento per ogni voce
+            selected = self.month_combo.currentText()
+            months = self.log_replica.months()
+            self.month_combo.blockSignals(True)
+            self.month_combo.clear()
+            for month in months:
+                self.month_combo.addItem(month)
+            if selected in months:
+                self.month_combo.setCurrentIndex(months.index(selected))
+            self.month_combo.blockSignals(False)
+
+            current_month = datetime.now().strftime('%Y-%m')
+            total = self.log_replica.month_total(current_month)
+            self.lbl_total.setText(f"Totale ore mese: {total:.1f}")
+            self.load_recent_logs()
+            self.on_month_selected()
 
         def on_month_selected(self):
             selected_month = self.month_combo.currentText()
             if not selected_month:
+                self.month_table.setRowCount(0)
                 return
             try:
-                r = requests.get(f"{self.server_url}/get_logs/{self.user['id']}", timeout=8)
-                if r.status_code == 200:
-                    logs = r.json()
-                    month_logs = [log for log in logs if log['date'].startswith(selected_month)]
+                month_logs = self.log_replica.month_logs(selected_month)
+                
+                self.month_table.setRowCount(0)
+                for log in month_logs:
+                    row = self.month_table.rowCount()
+                    self.month_table.insertRow(row)
+                    self.month_table.setItem(row, 0, QTableWidgetItem(str(log['id'])))
+                    self.month_table.setItem(row, 1, QTableWidgetItem(log['date']))
+                    self.month_table.setItem(row, 2, QTableWidgetItem(str(log['hours'])))
+                    self.month_table.setItem(row, 3, QTableWidgetItem(log['reason']))
                     
-                    self.month_table.setRowCount(0)
-                    for log in month_logs:
-                        row = self.month_table.rowCount()
-                        self.month_table.insertRow(row)
-                        self.month_table.setItem(row, 0, QTableWidgetItem(str(log['id'])))
-                        self.month_table.setItem(row, 1, QTableWidgetItem(log['date']))
-                        self.month_table.setItem(row, 2, QTableWidgetItem(str(log['hours'])))
-                        self.month_table.setItem(row, 3, QTableWidgetItem(log['reason']))
-                        
-                        btn_remove = QPushButton("Richiedi Rimozione")
-                        btn_remove.clicked.connect(partial(self.request_removal, log['id']))
-                        self.month_table.setCellWidget(row, 4, btn_remove)
+                    btn_remove = QPushButton("Richiedi Rimozione")
+                    btn_remove.clicked.connect(partial(self.request_removal, log['id']))
+                    self.month_table.setCellWidget(row, 4, btn_remove)
             except Exception as e:
                 QMessageBox.warning(self, "Errore", f"Errore caricamento log: {e}")
 
@@ -1798,7 +5605,7 @@ if PYQT_AVAILABLE:
             if ok and reason:
                 data = {"work_log_id": log_id, "requester_id": self.user['id'], "reason": reason}
                 try:
-                    r = requests.post(f"{self.server_url}/request_removal", json=data, timeout=8)
+                    r = http_session.post(f"{self.server_url}/request_removal", json=data, timeout=8)
                     if r.status_code == 200 and r.json().get("status") == "ok":
                         QMessageBox.information(self, "OK", "Richiesta inviata")
                         self.on_month_selected()
@@ -1821,104 +5628,210 @@ if PYQT_AVAILABLE:
             layout.addWidget(QLabel("Utenti e ore totali:"))
             layout.addWidget(self.admin_users_table)
 
-            self.removal_table = QTableWidget(0,6)
-            self.removal_table.setHorizontalHeaderLabels(["ReqID","Utente","Data","Ore","Motivo","Azioni"])
-            layout.addWidget(QLabel("Richieste di rimozione"))
+            self.removal_table = QTableWidget(0,7)
+            self.removal_table.setHorizontalHeaderLabels(["ReqID","Utente","Data","Ore","Motivo","Motivo log","Azioni"])
+            # Selezione multipla per le azioni di gruppo; Ore e Motivo log sono modificabili (doppio click)
+            self.removal_table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+            self.removal_table.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+            self.removal_table.setEditTriggers(QtWidgets.QAbstractItemView.DoubleClicked)
+            hbulk = QHBoxLayout()
+            hbulk.addWidget(QLabel("Richieste di rimozione"))
+            hbulk.addStretch()
+            btn_bulk_accept = QPushButton("Accetta selezionate")
+            btn_bulk_accept.clicked.connect(lambda: self.bulk_handle_requests('accepted'))
+            btn_bulk_reject = QPushButton("Rifiuta selezionate (salva modifiche)")
+            btn_bulk_reject.clicked.connect(lambda: self.bulk_handle_requests('rejected'))
+            hbulk.addWidget(btn_bulk_accept)
+            hbulk.addWidget(btn_bulk_reject)
+            layout.addLayout(hbulk)
             layout.addWidget(self.removal_table)
             self.tab_admin_users.setLayout(layout)
 
         def load_users_hours(self):
-            try:
-                r = requests.get(f"{self.server_url}/admin/users_hours", timeout=8)
-                if r.status_code == 200:
-                    users = r.json()
-                    self.admin_users_table.setRowCount(0)
-                    for u in users:
-                        row = self.admin_users_table.rowCount()
-                        self.admin_users_table.insertRow(row)
-                        self.admin_users_table.setItem(row, 0, QTableWidgetItem(str(u['id'])))
-                        self.admin_users_table.setItem(row, 1, QTableWidgetItem(u.get('name', '')))
-                        self.admin_users_table.setItem(row, 2, QTableWidgetItem(u.get('surname', '')))
-                        self.admin_users_table.setItem(row, 3, QTableWidgetItem(u.get('email', '')))
-                        self.admin_users_table.setItem(row, 4, QTableWidgetItem(str(u.get('total_hours', 0))))
-                        
-                        btn_detail = QPushButton("Vedi Dettaglio")
-                        btn_detail.clicked.connect(partial(self.show_user_logs, u['id']))
-                        self.admin_users_table.setCellWidget(row, 5, btn_detail)
-            except Exception as e:
-                print(f"Errore caricamento utenti: {e}")
+            # Le righe arrivano in streaming NDJSON da un thread in background: la tabella si riempie a blocchi
+            if self._users_loading:
+                return
+            self._users_loading = True
+            self.admin_users_table.setRowCount(0)
+
+            def finished(error=None):
+                self._users_loading = False
+                if error is not None:
+                    print(f"Errore caricamento utenti: {error}")
+
+            load_ndjson_in_background(f"{self.server_url}/admin/users_hours", self._append_users_hours,
+                                      on_done=finished, on_error=finished)
+
+        def _append_users_hours(self, users):
+            for u in users:
+                row = self.admin_users_table.rowCount()
+                self.admin_users_table.insertRow(row)
+                self.admin_users_table.setItem(row, 0, QTableWidgetItem(str(u['id'])))
+                self.admin_users_table.setItem(row, 1, QTableWidgetItem(u.get('name', '')))
+                self.admin_users_table.setItem(row, 2, QTableWidgetItem(u.get('surname', '')))
+                self.admin_users_table.setItem(row, 3, QTableWidgetItem(u.get('email', '')))
+                self.admin_users_table.setItem(row, 4, QTableWidgetItem(str(u.get('total_hours', 0))))
+                
+                btn_detail = QPushButton("Vedi Dettaglio")
+                btn_detail.clicked.connect(partial(self.show_user_logs, u['id']))
+                self.admin_users_table.setCellWidget(row, 5, btn_detail)
 
         def show_user_logs(self, user_id):
-            try:
-                r = requests.get(f"{self.server_url}/get_logs/{user_id}", timeout=8)
-                if r.status_code == 200:
-                    logs = r.json()
-                    dlg = QDialog(self)
-                    dlg.setWindowTitle(f"Log Utente ID: {user_id}")
-                    dlg.resize(700, 400)
-                    layout = QVBoxLayout()
-                    
-                    table = QTableWidget(0, 4)
-                    table.setHorizontalHeaderLabels(["ID", "Data", "Ore", "Motivo"])
-                    for log in logs:
-                        row = table.rowCount()
-                        table.insertRow(row)
-                        table.setItem(row, 0, QTableWidgetItem(str(log['id'])))
-                        table.setItem(row, 1, QTableWidgetItem(log['date']))
-                        table.setItem(row, 2, QTableWidgetItem(str(log['hours'])))
-                        table.setItem(row, 3, QTableWidgetItem(log['reason']))
-                    
-                    layout.addWidget(table)
-                    dlg.setLayout(layout)
-                    dlg.exec_()
-            except Exception as e:
-                QMessageBox.warning(self, "Errore", f"Errore caricamento log: {e}")
+            dlg = QDialog(self)
+            dlg.setWindowTitle(f"Log Utente ID: {user_id}")
+            dlg.resize(700, 400)
+            layout = QVBoxLayout()
+            
+            table = QTableWidget(0, 4)
+            table.setHorizontalHeaderLabels(["ID", "Data", "Ore", "Motivo"])
+            layout.addWidget(table)
+            dlg.setLayout(layout)
+
+            def add_logs(logs):
+                for log in logs:
+                    row = table.rowCount()
+                    table.insertRow(row)
+                    table.setItem(row, 0, QTableWidgetItem(str(log['id'])))
+                    table.setItem(row, 1, QTableWidgetItem(log['date']))
+                    table.setItem(row, 2, QTableWidgetItem(str(log['hours'])))
+                    table.setItem(row, 3, QTableWidgetItem(log['reason']))
+
+            def failed(error):
+                QMessageBox.warning(dlg, "Errore", f"Errore caricamento log: {error}")
+
+            # Il dialog è già aperto mentre i log arrivano in streaming dal thread in background
+            load_ndjson_in_background(f"{self.server_url}/get_logs/{user_id}", add_logs, on_error=failed)
+            dlg.exec_()
 
         def load_removal_requests(self):
-            try:
-                r = requests.get(f"{self.server_url}/admin/removal_requests", timeout=8)
-                if r.status_code == 200:
-                    requests_list = r.json()
-                    self.removal_table.setRowCount(0)
-                    for req in requests_list:
-                        if req.get('status') != 'pending':
-                            continue
-                        row = self.removal_table.rowCount()
-                        self.removal_table.insertRow(row)
-                        self.removal_table.setItem(row, 0, QTableWidgetItem(str(req['id'])))
-                        self.removal_table.setItem(row, 1, QTableWidgetItem(f"User {req['requester_id']}"))
-                        self.removal_table.setItem(row, 2, QTableWidgetItem(req.get('work_date', '')))
-                        self.removal_table.setItem(row, 3, QTableWidgetItem(str(req.get('hours', ''))))
-                        self.removal_table.setItem(row, 4, QTableWidgetItem(req.get('reason', '')))
-                        
-                        btn_layout = QHBoxLayout()
-                        btn_accept = QPushButton("Accetta")
-                        btn_reject = QPushButton("Rifiuta")
-                        btn_accept.clicked.connect(partial(self.handle_request, req['id'], 'accepted'))
-                        btn_reject.clicked.connect(partial(self.handle_request, req['id'], 'rejected'))
-                        btn_layout.addWidget(btn_accept)
-                        btn_layout.addWidget(btn_reject)
-                        
-                        widget = QWidget()
-                        widget.setLayout(btn_layout)
-                        self.removal_table.setCellWidget(row, 5, widget)
-            except Exception as e:
-                print(f"Errore caricamento richieste: {e}")
+            # Non ricaricare (polling) mentre l'admin sta modificando una cella
+            if self.removal_table.state() == QtWidgets.QAbstractItemView.EditingState:
+                return
+            # Un caricamento è già in corso: lo si ripete alla fine invece di svuotare la tabella a metà
+            if self._removals_loading:
+                self._removals_reload = True
+                return
+            self._removals_loading = True
+            self._removals_reload = False
+            self.removal_table.setRowCount(0)
+
+            def finished(error=None):
+                self._removals_loading = False
+                if error is not None:
+                    print(f"Errore caricamento richieste: {error}")
+                if self._removals_reload:
+                    self.load_removal_requests()
+
+            load_ndjson_in_background(f"{self.server_url}/admin/removal_requests", self._append_removal_requests,
+                                      on_done=finished, on_error=finished)
+
+        def _append_removal_requests(self, requests_):
+            for req in requests_:
+                if req.get('status') != 'pending':
+                    continue
+                row = self.removal_table.rowCount()
+                self.removal_table.insertRow(row)
+                self.removal_table.setItem(row, 0, self._readonly_item(str(req['id'])))
+                self.removal_table.setItem(row, 1, self._readonly_item(f"User {req['requester_id']}"))
+                self.removal_table.setItem(row, 2, self._readonly_item(req.get('work_date', '')))
+                self.removal_table.setItem(row, 3, self._editable_item(str(req.get('hours', ''))))
+                self.removal_table.setItem(row, 4, self._readonly_item(req.get('reason', '')))
+                self.removal_table.setItem(row, 5, self._editable_item(req.get('work_reason') or ''))
+                
+                btn_layout = QHBoxLayout()
+                btn_accept = QPushButton("Accetta")
+                btn_reject = QPushButton("Rifiuta")
+                btn_accept.clicked.connect(partial(self.handle_request, req['id'], 'accepted'))
+                btn_reject.clicked.connect(partial(self.handle_request, req['id'], 'rejected'))
+                btn_layout.addWidget(btn_accept)
+                btn_layout.addWidget(btn_reject)
+                
+                widget = QWidget()
+                widget.setLayout(btn_layout)
+                self.removal_table.setCellWidget(row, 6, widget)
+
+        def _readonly_item(self, text):
+            item = QTableWidgetItem(text)
+            item.setFlags(item.flags() & ~QtCore.Qt.ItemIsEditable)
+            return item
+
+        def _editable_item(self, text):
+            """Cella modificabile che ricorda il valore originale"""
+            item = QTableWidgetItem(text)
+            item.setData(QtCore.Qt.UserRole, text)
+            return item
+
+        def _removal_row(self, req_id):
+            for row in range(self.removal_table.rowCount()):
+                item = self.removal_table.item(row, 0)
+                if item and item.text() == str(req_id):
+                    return row
+            return None
+
+        def _collect_decision(self, row, action):
+            """Decisione per una riga, con le eventuali modifiche inline a ore e motivo"""
+            decision = {"request_id": int(self.removal_table.item(row, 0).text()), "action": action}
+            if action == 'rejected':
+                hours_item = self.removal_table.item(row, 3)
+                if hours_item and hours_item.text() != hours_item.data(QtCore.Qt.UserRole):
+                    decision["hours"] = float(hours_item.text().replace(',', '.'))
+                reason_item = self.removal_table.item(row, 5)
+                if reason_item and reason_item.text() != reason_item.data(QtCore.Qt.UserRole):
+                    decision["reason"] = reason_item.text()
+            return decision
 
         def handle_request(self, req_id, action):
+            row = self._removal_row(req_id)
+            try:
+                decision = self._collect_decision(row, action) if row is not None else {"request_id": req_id, "action": action}
+            except ValueError:
+                QMessageBox.warning(self, "Errore", "Ore non valide")
+                return
             reason, ok = QtWidgets.QInputDialog.getText(self, "Motivo Decisione", f"Inserisci motivo per {action}:")
             if ok:
-                data = {"request_id": req_id, "action": action, "admin_id": self.user['id'], "admin_reason": reason}
-                try:
-                    r = requests.post(f"{self.server_url}/admin/handle_removal", json=data, timeout=8)
-                    if r.status_code == 200 and r.json().get("status") == "ok":
-                        QMessageBox.information(self, "OK", f"Richiesta {action}")
-                        self.load_removal_requests()
-                        self.load_users_hours()
-                    else:
-                        QMessageBox.warning(self, "Errore", "Errore elaborazione richiesta")
-                except Exception as e:
-                    QMessageBox.warning(self, "Errore", f"Errore rete: {e}")
+                self.submit_decisions([decision], reason)
+
+        def bulk_handle_requests(self, action):
+            """Accetta/rifiuta in un colpo solo tutte le richieste selezionate"""
+            rows = sorted({idx.row() for idx in self.removal_table.selectedIndexes()})
+            if not rows:
+                QMessageBox.information(self, "Info", "Seleziona almeno una richiesta")
+                return
+            try:
+                decisions = [self._collect_decision(row, action) for row in rows]
+            except ValueError:
+                QMessageBox.warning(self, "Errore", "Ore non valide in una delle righe selezionate")
+                return
+            reason, ok = QtWidgets.QInputDialog.getText(self, "Motivo Decisione",
+                                                        f"Motivo per {action} ({len(decisions)} richieste):")
+            if ok:
+                self.submit_decisions(decisions, reason)
+
+        def submit_decisions(self, decisions, admin_reason):
+            """Invia le decisioni in un'unica transazione e aggiorna le tabelle senza ricaricarle"""
+            data = {"admin_id": self.user['id'], "admin_reason": admin_reason, "decisions": decisions}
+            try:
+                r = post_json(f"{self.server_url}/admin/handle_removal_batch", data, timeout=15)
+                if r.status_code == 200 and r.json().get("status") == "ok":
+                    decided = {str(d["request_id"]) for d in decisions}
+                    for row in range(self.removal_table.rowCount() - 1, -1, -1):
+                        item = self.removal_table.item(row, 0)
+                        if item and item.text() in decided:
+                            self.removal_table.removeRow(row)
+                    self._update_users_totals(r.json().get("totals", []))
+                    QMessageBox.information(self, "OK", f"{len(decisions)} richieste elaborate")
+                else:
+                    msg = r.json().get("message", "Errore elaborazione richiesta") if r.headers.get('Content-Type', '').startswith('application/json') else "Errore elaborazione richiesta"
+                    QMessageBox.warning(self, "Errore", msg)
+            except Exception as e:
+                QMessageBox.warning(self, "Errore", f"Errore rete: {e}")
+
+        def _update_users_totals(self, totals):
+            by_id = {str(t['id']): t['total_hours'] for t in totals}
+            for row in range(self.admin_users_table.rowCount()):
+                item = self.admin_users_table.item(row, 0)
+                if item and item.text() in by_id:
+                    self.admin_users_table.setItem(row, 4, QTableWidgetItem(str(by_id[item.text()])))
 
         def build_admin_bacheca(self):
             layout = QVBoxLayout()
@@ -2009,6 +5922,234 @@ if PYQT_AVAILABLE:
                 pass
 
             
+        def build_admin_search(self):
+            """Ricerca full-text lato server su personaggi (nome, ruolo, serie, copione) e motivazioni dei log"""
+            layout = QVBoxLayout()
+            htop = QHBoxLayout()
+            self.search_input = QLineEdit()
+            self.search_input.setPlaceholderText("Cerca personaggi, copioni e motivazioni...")
+            self.search_scope = QComboBox()
+            self.search_scope.addItem("Tutto", 'all')
+            self.search_scope.addItem("Personaggi", 'characters')
+            self.search_scope.addItem("Log ore", 'logs')
+            htop.addWidget(self.search_input, 1)
+            htop.addWidget(self.search_scope)
+            layout.addLayout(htop)
+
+            self.search_table = QTableWidget(0, 5)
+            self.search_table.setHorizontalHeaderLabels(["Tipo", "ID", "Titolo", "Dettagli", "Estratto"])
+            self.search_table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+            self.search_table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+            self.search_table.horizontalHeader().setStretchLastSection(True)
+            self.search_table.cellDoubleClicked.connect(self.open_search_result)
+            layout.addWidget(self.search_table)
+
+            hbottom = QHBoxLayout()
+            self.search_status = QLabel("")
+            self.search_more_btn = QPushButton("Altri risultati")
+            self.search_more_btn.setEnabled(False)
+            self.search_more_btn.clicked.connect(lambda: self.run_search(more=True))
+            hbottom.addWidget(self.search_status)
+            hbottom.addStretch()
+            hbottom.addWidget(self.search_more_btn)
+            layout.addLayout(hbottom)
+            self.tab_admin_search.setLayout(layout)
+
+            # La ricerca parte quando l'utente smette di scrivere
+            self._search_offset = 0
+            self._search_timer = QtCore.QTimer(self)
+            self._search_timer.setSingleShot(True)
+            self._search_timer.setInterval(300)
+            self._search_timer.timeout.connect(self.run_search)
+            self.search_input.textChanged.connect(lambda _: self._search_timer.start())
+            self.search_input.returnPressed.connect(self.run_search)
+            self.search_scope.currentIndexChanged.connect(lambda _: self.run_search())
+
+        def run_search(self, more=False):
+            text = self.search_input.text().strip()
+            if not more:
+                self._search_offset = 0
+                self.search_table.setRowCount(0)
+            self.search_more_btn.setEnabled(False)
+            if not text:
+                self.search_status.setText("")
+                return
+            try:
+                params = {'q': text, 'scope': self.search_scope.currentData(),
+                          'limit': SEARCH_PAGE_SIZE, 'offset': self._search_offset}
+                r = http_session.get(f"{self.server_url}/search", params=params, timeout=8)
+                res = r.json()
+                if r.status_code != 200:
+                    self.search_status.setText(res.get('message', f"Errore HTTP {r.status_code}"))
+                    return
+                for ch in res.get('characters', []):
+                    self._add_search_row('Personaggio', ch['id'], ch['character_name'],
+                                         f"{ch.get('series_title') or ''} - {ch.get('role') or ''}",
+                                         ch.get('snippet'), ('character', ch['id']))
+                for log in res.get('logs', []):
+                    self._add_search_row('Log', log['id'], f"{log.get('name') or ''} {log.get('surname') or ''}".strip(),
+                                         f"{log['date']} - {log['hours']} ore", log.get('snippet'),
+                                         ('log', log['user_id']))
+                self._search_offset += SEARCH_PAGE_SIZE
+                more_available = res.get('characters_more') or res.get('logs_more')
+                self.search_more_btn.setEnabled(bool(more_available))
+                self.search_status.setText(f"{self.search_table.rowCount()} risultati" + ("+" if more_available else ""))
+            except Exception as e:
+                self.search_status.setText(f"Errore ricerca: {e}")
+
+        def _add_search_row(self, kind, item_id, title, details, snippet, target):
+            row = self.search_table.rowCount()
+            self.search_table.insertRow(row)
+            first = QTableWidgetItem(kind)
+            first.setData(Qt.UserRole, target)
+            self.search_table.setItem(row, 0, first)
+            self.search_table.setItem(row, 1, QTableWidgetItem(str(item_id)))
+            self.search_table.setItem(row, 2, QTableWidgetItem(title))
+            self.search_table.setItem(row, 3, QTableWidgetItem(details))
+            self.search_table.setItem(row, 4, QTableWidgetItem(snippet or ''))
+
+        def open_search_result(self, row, _col):
+            """Doppio click: log -> dettaglio utente, personaggio -> riga nella tabella Bacheca"""
+            item = self.search_table.item(row, 0)
+            if not item:
+                return
+            kind, target_id = item.data(Qt.UserRole)
+            if kind == 'log':
+                self.show_user_logs(target_id)
+                return
+            self.tabs_admin.setCurrentWidget(self.tab_admin_bacheca)
+            for r in range(self.admin_chars_table.rowCount()):
+                id_item = self.admin_chars_table.item(r, 0)
+                if id_item and id_item.text() == str(target_id):
+                    self.admin_chars_table.selectRow(r)
+                    self.admin_chars_table.scrollToItem(id_item)
+                    break
+
+        def build_admin_reports(self):
+            """Report ore per utente/giorno/settimana/mese/motivo, calcolati dal server (/admin/reports)"""
+            layout = QVBoxLayout()
+            htop = QHBoxLayout()
+            today = QtCore.QDate.currentDate()
+            self.report_from = QDateEdit(QtCore.QDate(today.year(), today.month(), 1))
+            self.report_to = QDateEdit(today)
+            for w in (self.report_from, self.report_to):
+                w.setCalendarPopup(True)
+                w.setDisplayFormat("yyyy-MM-dd")
+            dims = [("Utente", 'user'), ("Giorno", 'day'), ("Settimana", 'week'), ("Mese", 'month'), ("Motivo", 'reason')]
+            self.report_group = QComboBox()
+            self.report_split = QComboBox()
+            self.report_split.addItem("—", None)
+            for label, key in dims:
+                self.report_group.addItem(label, key)
+                self.report_split.addItem(label, key)
+            self.report_sort = QComboBox()
+            for label, key in [("Predefinito", None), ("Ore", 'hours'), ("Voci", 'entries'), ("Quota", 'share'),
+                               ("Delta", 'delta'), ("Chiave", 'key')]:
+                self.report_sort.addItem(label, key)
+            self.report_top = QSpinBox()
+            self.report_top.setRange(0, 1000)
+            self.report_top.setSpecialValueText("Tutti")
+            self.report_top.setToolTip("Prime N righe per gruppo (0 = tutte)")
+            btn = QPushButton("Genera")
+            btn.clicked.connect(self.load_report)
+            btn_csv = QPushButton("Esporta CSV")
+            btn_csv.clicked.connect(lambda: self.export_logs('csv'))
+            btn_xlsx = QPushButton("Esporta XLSX")
+            btn_xlsx.clicked.connect(lambda: self.export_logs('xlsx'))
+            for label, w in [("Dal", self.report_from), ("al", self.report_to), ("Per", self.report_group),
+                             ("poi per", self.report_split), ("Ordina", self.report_sort), ("Top", self.report_top)]:
+                htop.addWidget(QLabel(label))
+                htop.addWidget(w)
+            htop.addWidget(btn)
+            htop.addWidget(btn_csv)
+            htop.addWidget(btn_xlsx)
+            htop.addStretch()
+            layout.addLayout(htop)
+
+            self.report_table = QTableWidget(0, 8)
+            self.report_table.setHorizontalHeaderLabels(
+                ["Gruppo", "Sottogruppo", "Ore", "Voci", "Quota %", "Pos.", "Delta", "Progressivo"])
+            self.report_table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+            self.report_table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+            self.report_table.horizontalHeader().setStretchLastSection(True)
+            layout.addWidget(self.report_table)
+            self.report_status = QLabel("")
+            layout.addWidget(self.report_status)
+            self.tab_admin_reports.setLayout(layout)
+
+        def load_report(self):
+            params = {'from': self.report_from.date().toString('yyyy-MM-dd'),
+                      'to': self.report_to.date().toString('yyyy-MM-dd'),
+                      'group_by': ','.join(d for d in (self.report_group.currentData(), self.report_split.currentData()) if d)}
+            if self.report_sort.currentData():
+                params['sort'] = self.report_sort.currentData()
+            if self.report_top.value():
+                params['top'] = self.report_top.value()
+            url = f"{self.server_url}/admin/reports"
+
+            def fetch():
+                r = http_session.get(url, params=params, timeout=15)
+                res = r.json()
+                if r.status_code != 200:
+                    raise RuntimeError(res.get('message', f"HTTP {r.status_code}"))
+                return res
+            self.report_status.setText("Calcolo in corso...")
+            run_in_background(fetch, self._show_report, lambda e: self.report_status.setText(f"Errore report: {e}"))
+
+        def export_logs(self, fmt):
+            """Export per le paghe di tutte le ore nell'intervallo del report, scaricato su disco in streaming"""
+            date_from = self.report_from.date().toString('yyyy-MM-dd')
+            date_to = self.report_to.date().toString('yyyy-MM-dd')
+            filters = {'csv': "CSV (*.csv)", 'xlsx': "Excel (*.xlsx)"}
+            path, _ = QFileDialog.getSaveFileName(self, "Esporta ore", f"ore_{date_from}_{date_to}.{fmt}", filters[fmt])
+            if not path:
+                return
+            state = {'bytes': 0, 'cancel': False}
+            dlg = QProgressDialog("Export in corso...", "Annulla", 0, 0, self)
+            dlg.setWindowTitle("Export ore")
+            dlg.setWindowModality(Qt.WindowModal)
+            dlg.canceled.connect(lambda: state.update(cancel=True))
+            timer = QtCore.QTimer(dlg)
+            timer.timeout.connect(lambda: dlg.setLabelText(f"Scaricati {state['bytes'] / 1e6:.1f} MB..."))
+            timer.start(200)
+            dlg.show()
+
+            def done(result):
+                timer.stop()
+                dlg.close()
+                nbytes, headers = result
+                QMessageBox.information(self, "Export completato",
+                                        f"{headers.get('X-Export-Rows', '?')} righe ({nbytes / 1e6:.1f} MB) salvate in\n{path}")
+
+            def failed(e):
+                timer.stop()
+                dlg.close()
+                if not state['cancel']:
+                    QMessageBox.warning(self, "Errore", f"Export fallito: {e}")
+            params = {'from': date_from, 'to': date_to, 'format': fmt}
+            run_in_background(partial(download_to_file, f"{self.server_url}/admin/export/work_logs", path, params,
+                                      lambda n: state.update(bytes=n), lambda: state['cancel'], 60),
+                              done, failed)
+
+        def _show_report(self, res):
+            def fmt(v):
+                return '' if v is None else (f"{v:+.2f}" if isinstance(v, float) else str(v))
+            rows = res.get('rows', [])
+            self.report_table.setRowCount(len(rows))
+            for i, row in enumerate(rows):
+                values = [row['label'], row.get('sub_label') or '', f"{row['hours']:.2f}", str(row['entries']),
+                          f"{row['share']:.2f}" if row.get('share') is not None else '', str(row['rank']),
+                          fmt(row.get('delta')), f"{row['running']:.2f}" if row.get('running') is not None else '']
+                for j, v in enumerate(values):
+                    item = QTableWidgetItem(v)
+                    if j >= 2:
+                        item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                    self.report_table.setItem(i, j, item)
+            totals = res.get('totals', {})
+            self.report_status.setText(
+                f"{res['from']} → {res['to']}: {totals.get('hours', 0):.2f} ore, {totals.get('entries', 0)} voci, "
+                f"{totals.get('users', 0)} utenti" + (" (risultati troncati)" if res.get('more') else ""))
+
         def select_script_file(self):
             """Seleziona file .docx del copione"""
             path, _ = QFileDialog.getOpenFileName(self, "Scegli Copione", "", "Word Documents (*.docx)")
@@ -2018,7 +6159,7 @@ if PYQT_AVAILABLE:
         def load_admin_characters(self):
             """Carica tutti i personaggi nella tabella admin"""
             try:
-                r = requests.get(f"{self.server_url}/bacheca/characters", timeout=8)
+                r = http_session.get(f"{self.server_url}/bacheca/characters", timeout=8)
                 if r.status_code == 200:
                     chars = r.json()
                     self.admin_chars_table.setRowCount(0)
@@ -2063,7 +6204,7 @@ if PYQT_AVAILABLE:
                 try:
                     print(f"[DEBUG] Tentativo eliminazione personaggio ID: {char['id']}")
                     # Usa POST invece di DELETE per evitare problemi con alcuni server
-                    r = requests.post(f"{self.server_url}/bacheca/character/{char['id']}/delete", timeout=10)
+                    r = http_session.post(f"{self.server_url}/bacheca/character/{char['id']}/delete", timeout=10)
                     print(f"[DEBUG] Status code: {r.status_code}")
                     print(f"[DEBUG] Response: {r.text}")
                     
@@ -2129,7 +6270,7 @@ if PYQT_AVAILABLE:
             current_img_label = QLabel()
             if char.get('image_url'):
                 try:
-                    img_data = requests.get(char['image_url'], timeout=6).content
+                    img_data = fetch_asset(char['image_url'])
                     pix = QtGui.QPixmap()
                     pix.loadFromData(img_data)
                     pix = pix.scaled(150, 150, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
@@ -2192,36 +6333,17 @@ if PYQT_AVAILABLE:
                     'expiry_date': edit_expiry.text()
                 }
                 
-                # Se c'è un nuovo copione, caricalo
-                new_script = new_script_path.text()
-                if new_script and os.path.exists(new_script):
-                    try:
-                        files = {'script': open(new_script, 'rb')}
-                        r = requests.post(f"{self.server_url}/bacheca/character/{char['id']}/upload_script",
-                                        files=files, timeout=15)
-                        files['script'].close()
-                        if r.status_code != 200:
-                            QMessageBox.warning(dlg, "Attenzione", "Errore caricamento copione")
-                    except Exception as e:
-                        QMessageBox.warning(dlg, "Errore", f"Errore caricamento copione: {e}")
-                
-                # Se c'è una nuova immagine, caricala
-                new_img = new_img_path.text()
-                if new_img and os.path.exists(new_img):
-                    try:
-                        files = {'image_file': open(new_img, 'rb')}
-                        r = requests.post(f"{self.server_url}/bacheca/character/{char['id']}/upload_image",
-                                        files=files, timeout=15)
-                        files['image_file'].close()
-                        if r.status_code != 200:
-                            QMessageBox.warning(dlg, "Attenzione", "Errore caricamento immagine")
-                    except Exception as e:
-                        QMessageBox.warning(dlg, "Errore", f"Errore caricamento immagine: {e}")
-                
-                # Aggiorna i dati testuali
+                # Campi, nuovo copione e nuova immagine in un'unica richiesta
+                files = {}
                 try:
-                    r = requests.put(f"{self.server_url}/bacheca/character/{char['id']}", 
-                                   json=update_data, timeout=8)
+                    new_script = new_script_path.text()
+                    if new_script and os.path.exists(new_script):
+                        files['script'] = open(new_script, 'rb')
+                    new_img = new_img_path.text()
+                    if new_img and os.path.exists(new_img):
+                        files['image_file'] = open(new_img, 'rb')
+                    r = http_session.patch(f"{self.server_url}/bacheca/character/{char['id']}",
+                                           data=update_data, files=files, timeout=30 if files else 8)
                     if r.status_code == 200 and r.json().get('status') == 'ok':
                         QMessageBox.information(dlg, "OK", "Personaggio aggiornato con successo")
                         dlg.accept()
@@ -2229,9 +6351,12 @@ if PYQT_AVAILABLE:
                         if self._bacheca_win:
                             self._bacheca_win.load_characters()
                     else:
-                        QMessageBox.warning(dlg, "Errore", "Impossibile aggiornare il personaggio")
+                        QMessageBox.warning(dlg, "Errore", r.json().get('message', "Impossibile aggiornare il personaggio"))
                 except Exception as e:
                     QMessageBox.warning(dlg, "Errore", f"Errore aggiornamento: {e}")
+                finally:
+                    for fh in files.values():
+                        fh.close()
             
             btn_save.clicked.connect(save_changes)
             btn_cancel.clicked.connect(dlg.reject)
@@ -2267,51 +6392,24 @@ if PYQT_AVAILABLE:
                 'assigned_to': assigned_to
             }
 
+            # Immagine e copione viaggiano nella stessa richiesta di creazione
             files = {}
-            if os.path.exists(img_path):
-                try:
+            try:
+                if os.path.exists(img_path):
                     files['image_file'] = open(img_path, 'rb')
-                except Exception as e:
-                    QMessageBox.critical(self, "Errore File", f"Impossibile aprire l'immagine: {e}")
-                    self.btn_add_char.setEnabled(True)
-                    return
+                if script_path and os.path.exists(script_path):
+                    files['script'] = open(script_path, 'rb')
+            except Exception as e:
+                for fh in files.values():
+                    fh.close()
+                QMessageBox.critical(self, "Errore File", f"Impossibile aprire il file: {e}")
+                self.btn_add_char.setEnabled(True)
+                return
 
             try:
-                # Crea il personaggi
-                r = requests.post(f"{self.server_url}/bacheca/character", data=data, files=files, timeout=15)
-                try:
-                    for fh in files.values():
-                        fh.close()
-                except Exception:
-                    pass
-
-                
+                # Crea il personaggio
+                r = http_session.post(f"{self.server_url}/bacheca/character", data=data, files=files, timeout=30)
                 if r.status_code == 200 and r.json().get('status') == 'ok':
-                    char_id = None
-                    
-                    # Se c'è un copione, caricalo separatamente
-                    if script_path and os.path.exists(script_path):
-                        # Recupera l'ID del personaggio appena creato
-                        chars_response = requests.get(f"{self.server_url}/bacheca/characters", timeout=8)
-                        if chars_response.status_code == 200:
-                            chars = chars_response.json()
-                            # Trova il personaggio con questo nome
-                            for ch in chars:
-                                if ch['character_name'] == name and ch['series_title'] == series:
-                                    char_id = ch['id']
-                                    break
-                        
-                        if char_id:
-                            try:
-                                script_files = {'script': open(script_path, 'rb')}
-                                script_r = requests.post(f"{self.server_url}/bacheca/character/{char_id}/upload_script",
-                                                        files=script_files, timeout=15)
-                                script_files['script'].close()
-                                if script_r.status_code != 200:
-                                    QMessageBox.warning(self, "Attenzione", "Personaggio creato ma errore nel caricamento del copione")
-                            except Exception as e:
-                                QMessageBox.warning(self, "Attenzione", f"Personaggio creato ma errore copione: {e}")
-                    
                     QMessageBox.information(self, "OK", f"Personaggio '{name}' aggiunto con successo")
                     self.char_name.clear()
                     self.char_role.clear()
@@ -2330,16 +6428,25 @@ if PYQT_AVAILABLE:
                 self.btn_add_char.setEnabled(True)
 
 # ---------------- MAIN ----------------
-def run_server():
+def run_server(host=None, port=None):
     if not FLASK_AVAILABLE:
         print("Impossibile avviare il server: Flask non installato")
         return
+    host = host or SERVER_HOST
+    port = port or SERVER_PORT
     try:
         init_db()
-        print(f"[server] Avvio Flask su http://{SERVER_HOST}:{SERVER_PORT}")
-        app.run(host=SERVER_HOST, port=SERVER_PORT, debug=False)
+        _user_codes.load()  # i primi badge letti non aspettano il database
+        start_background_jobs()
+        enqueue_missing_script_previews()
+        print(f"[server] Avvio Flask su http://{host}:{port}")
+        app.run(host=host, port=port, debug=False, threaded=True)
     except Exception as e:
         print(f"ERRORE AVVIO SERVER: {e}")
+    finally:
+        stop_background_jobs()
+        _db_writer.stop()
+        _audit_writer.stop()
 
 def run_client():
     if not PYQT_AVAILABLE:
@@ -2355,10 +6462,23 @@ def run_client():
     splash.start(timeout=1200, finished_callback=after)
     sys.exit(qt_app.exec_())
 
+def run_kiosk(terminal='kiosk'):
+    if not PYQT_AVAILABLE:
+        print("Impossibile avviare il kiosk: PyQt5 non installato")
+        return
+    qt_app = QtWidgets.QApplication(sys.argv)
+    qt_app.setStyleSheet(QSS)
+    global kiosk_window
+    kiosk_window = KioskWindow(SERVER_URL, terminal)
+    kiosk_window.showFullScreen()
+    sys.exit(qt_app.exec_())
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--server", action="store_true", help="Avvia server Flask")
     parser.add_argument("--url", type=str, help="Server URL override")
+    parser.add_argument("--kiosk", nargs="?", const="kiosk", metavar="TERMINALE",
+                        help="Terminale di timbratura con badge (nome opzionale del terminale)")
     args = parser.parse_args()
 
     if args.url:
@@ -2366,5 +6486,7 @@ if __name__ == "__main__":
 
     if args.server:
         run_server()
+    elif args.kiosk:
+        run_kiosk(args.kiosk)
     else:
         run_client()
\ No newline at end of file
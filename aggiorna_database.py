@@ -113,20 +113,54 @@ def list_admins():
     finally:
         conn.close()
 
+def convert_auto_vacuum():
+    """Converte un database creato prima di auto_vacuum=INCREMENTAL.
+    Serve un VACUUM completo, che tiene il lock di scrittura per tutta la durata:
+    va fatto UNA volta, a server fermo. Dopo, la manutenzione del server lo compatta a passi."""
+    if not os.path.exists(DB_PATH):
+        print(f"\n❌ Database non trovato in {DB_PATH}")
+        return
+    
+    conn = sqlite3.connect(DB_PATH)
+    
+    try:
+        mode = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        if mode == 2:
+            print("\n✅ Il database usa già auto_vacuum incrementale, niente da fare.")
+            return
+        pages = conn.execute('PRAGMA page_count').fetchone()[0]
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        print(f"\nPagine: {pages}, libere: {free}")
+        confirm = input("Il server è fermo? Procedere con il VACUUM (s/n): ").strip().lower()
+        if confirm != 's':
+            print("Annullato.")
+            return
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        pages_after = conn.execute('PRAGMA page_count').fetchone()[0]
+        print(f"\n✅ Conversione completata: {pages} -> {pages_after} pagine")
+    except sqlite3.OperationalError as e:
+        print(f'\n❌ ERRORE Database (il server è acceso?): {e}')
+    finally:
+        conn.close()
+
 def main():
     print("\n")
     print("1. Aggiungi nuovo admin")
     print("2. Visualizza admin esistenti")
-    print("3. Esci")
+    print("3. Converti il database ad auto_vacuum incrementale (server fermo)")
+    print("4. Esci")
     print()
     
-    choice = input("Scegli un'opzione (1-3): ").strip()
+    choice = input("Scegli un'opzione (1-4): ").strip()
     
     if choice == "1":
         add_admin()
     elif choice == "2":
         list_admins()
     elif choice == "3":
+        convert_auto_vacuum()
+    elif choice == "4":
         print("Uscita.")
     else:
         print("Opzione non valida.")
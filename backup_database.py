@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# backup_database.py
+# Backup online di timbracart.db con l'API di backup di SQLite.
+# Si può lanciare anche con il server acceso: gli scrittori non vengono bloccati.
+#
+#   python backup_database.py                 # backup + retention
+#   python backup_database.py --list          # elenca i backup
+#   python backup_database.py --verify FILE   # PRAGMA integrity_check su un backup
+#
+# Per ripristinare: fermare il server e copiare il backup al posto di timbracart.db
+# (e l'eventuale <backup>.archive.db al posto di timbracart_archive.db).
+
+import os
+import sys
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+import BadgeEmpire as be
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backup online del database TimbraCart")
+    parser.add_argument('--db', default=os.path.join(BASE_DIR, 'timbracart.db'), help="Database da copiare")
+    parser.add_argument('--dest', help="Cartella dei backup (default: backups/ accanto al database)")
+    parser.add_argument('--label', default='cli', help="Etichetta aggiunta al nome del file")
+    parser.add_argument('--keep', type=int, default=be.BACKUP_KEEP, help="Backup da conservare")
+    parser.add_argument('--no-prune', action='store_true', help="Non eliminare i backup più vecchi")
+    parser.add_argument('--list', action='store_true', help="Elenca i backup presenti")
+    parser.add_argument('--verify', metavar='FILE', help="Verifica l'integrità di un backup")
+    args = parser.parse_args()
+
+    be.DB_PATH = os.path.abspath(args.db)
+    be.BASE_DIR = os.path.dirname(be.DB_PATH)
+    dest = os.path.abspath(args.dest) if args.dest else None
+
+    if args.verify:
+        problems = be.verify_backup(args.verify)
+        if problems:
+            print(f"❌ {args.verify} NON integro:")
+            for p in problems[:20]:
+                print(f"   {p}")
+            return 1
+        print(f"✅ {args.verify}: integrity_check ok")
+        return 0
+
+    if args.list:
+        backups = be.list_backups(dest)
+        if not backups:
+            print("Nessun backup presente.")
+        for b in backups:
+            print(f"{b['file']:<50} {b['size'] / 1e6:>10.1f} MB   {b['created']}")
+        return 0
+
+    if not os.path.exists(be.DB_PATH):
+        print(f"❌ Database non trovato in {be.DB_PATH}")
+        return 1
+    try:
+        info = be.backup_database(dest, label=args.label)
+    except Exception as e:
+        print(f"❌ Backup fallito: {e}")
+        return 1
+    finally:
+        be._audit_writer.stop()
+    print(f"✅ Backup creato: {info['path']} ({info['size'] / 1e6:.1f} MB, {info['seconds']}s, integrity_check ok)")
+    if not args.no_prune:
+        for name in be.prune_backups(args.keep, dest):
+            print(f"   eliminato {name}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+# benchmark_endpoints.py
+# Micro-benchmark di tutti gli endpoint Flask su un database sintetico
+#
+# Esempi:
+#   python benchmark_endpoints.py --scale small
+#   python benchmark_endpoints.py --users 10000 --logs 10000000 --characters 5000 --save baseline.json
+#   python benchmark_endpoints.py --scale small --compare baseline.json --tolerance 0.25
+
+import os
+import sys
+import io
+import re
+import json
+import time
+import random
+import itertools
+import shutil
+import sqlite3
+import zipfile
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+import BadgeEmpire as be
+
+SCALES = {
+    'small':  {'users': 1000,  'logs': 100000,   'characters': 500},
+    'medium': {'users': 5000,  'logs': 1000000,  'characters': 2000},
+    'large':  {'users': 10000, 'logs': 10000000, 'characters': 5000},
+}
+
+REASONS = [
+    'Riunione settimanale', 'Doppiaggio episodio', 'Revisione copione', 'Prove voce',
+    'Montaggio audio', 'Registrazione', 'Formazione', 'Supporto tecnico', 'Casting',
+    'Mixaggio', 'Sincronizzazione labiale', 'Traduzione', 'Adattamento dialoghi',
+]
+SERIES = ['After School', 'Empire Office']
+
+
+# ---------------- DATASET SINTETICO ----------------
+def dataset_path(db_dir, users, logs, characters, seed):
+    return os.path.join(db_dir, f"timbracart_u{users}_l{logs}_c{characters}_s{seed}.db")
+
+def removal_count(logs):
+    return min(2000, logs // 50 + 1)
+
+def make_docx_bytes(text):
+    """Un .docx minimale ma valido (solo word/document.xml)"""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('[Content_Types].xml',
+                   '<?xml version="1.0" encoding="UTF-8"?>'
+                   '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                   '<Override PartName="/word/document.xml" ContentType="application/'
+                   'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>')
+        paras = ''.join(f'<w:p><w:r><w:t>{line}</w:t></w:r></w:p>' for line in text.split('\n'))
+        z.writestr('word/document.xml',
+                   '<?xml version="1.0" encoding="UTF-8"?>'
+                   '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                   f'<w:body>{paras}</w:body></w:document>')
+    return buf.getvalue()
+
+def build_dataset(path, users, logs, characters, seed):
+    """Crea un timbracart.db sintetico con lo schema reale del server"""
+    rnd = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    be.DB_PATH = path
+    be.init_db()
+
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('PRAGMA journal_mode=MEMORY')
+    t0 = time.time()
+
+    conn.executemany(
+        "INSERT INTO users (name, surname, email, password, code, role) VALUES (?,?,?,?,?,?)",
+        ((f"Nome{i}", f"Cognome{i}", f"utente{i}@bench.local", 'password', f"USRB{i:07d}",
+          'admin' if i % 500 == 0 else 'user') for i in range(users)))
+    conn.commit()
+    max_uid = conn.execute("SELECT MAX(id) FROM users").fetchone()[0]
+    print(f"[BENCH] {users} utenti creati")
+
+    start = datetime.now() - timedelta(days=730)
+    batch = 100000
+    done = 0
+    while done < logs:
+        n = min(batch, logs - done)
+        conn.executemany(
+            "INSERT INTO work_logs (user_id, date, hours, reason) VALUES (?,?,?,?)",
+            ((rnd.randint(1, max_uid),
+              (start + timedelta(seconds=rnd.randint(0, 730 * 86400))).strftime('%Y-%m-%d %H:%M:%S'),
+              round(rnd.uniform(0.5, 8.0), 1),
+              f"{rnd.choice(REASONS)} #{rnd.randint(1, 999)}") for _ in range(n)))
+        conn.commit()
+        done += n
+        print(f"\r[BENCH] work_logs: {done}/{logs}", end='', flush=True)
+    print()
+
+    conn.executemany(
+        "INSERT INTO removal_requests (work_log_id, requester_id, reason, request_date) VALUES (?,?,?,?)",
+        ((rnd.randint(1, max(1, logs)), rnd.randint(1, max_uid), 'Inserimento errato',
+          datetime.now().strftime('%Y-%m-%d %H:%M:%S')) for _ in range(removal_count(logs))))
+
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    rows = []
+    for i in range(characters):
+        # Metà dei personaggi ha una ACL di visibilità con 1-20 utenti
+        visible = ''
+        if rnd.random() < 0.5:
+            visible = ','.join(str(rnd.randint(1, max_uid)) for _ in range(rnd.randint(1, 20)))
+        script = '\n'.join(f"BATTUTA {j}: {rnd.choice(REASONS)} " * 3 for j in range(rnd.randint(20, 80)))
+        rows.append((rnd.choice(SERIES), f"Personaggio {i}", f"Doppiatore {rnd.randint(1, 300)}",
+                     'assets/bacheca/bench/image.png', script, 'assets/bacheca/bench/script.docx',
+                     (datetime.now() + timedelta(days=rnd.randint(-30, 365))).strftime('%Y-%m-%d'),
+                     'assets/bacheca/bench/video.mov', 1, now, visible,
+                     rnd.randint(1, max_uid) if rnd.random() < 0.3 else None))
+    conn.executemany(
+        "INSERT INTO bacheca_characters (series_title, character_name, role, image_path, script_text, "
+        "script_path, expiry_date, mov_path, created_by, last_modified, visible_to, assigned_to) "
+        "VALUES (?,?,?,?,?,?,?,?,?,?,?,?)", rows)
+    conn.commit()
+    conn.close()
+    print(f"[BENCH] Dataset creato in {time.time() - t0:.1f}s: {path}")
+
+def prepare_assets(base_dir):
+    """File fittizi referenziati dai personaggi sintetici"""
+    d = os.path.join(base_dir, 'assets', 'bacheca', 'bench')
+    os.makedirs(d, exist_ok=True)
+    shutil.copy(os.path.join(BASE_DIR, 'assets', 'logo.png'), os.path.join(d, 'image.png'))
+    with open(os.path.join(d, 'script.docx'), 'wb') as f:
+        f.write(make_docx_bytes('SCENA 1\nBATTUTA: prova'))
+    with open(os.path.join(d, 'video.mov'), 'wb') as f:
+        f.write(os.urandom(256 * 1024))
+
+
+def latest_change_version():
+    """Versione corrente del change log: un delta da qui in poi è (quasi) vuoto"""
+    conn = be.get_db_connection()
+    try:
+        return max(1, be.current_change_version(conn.cursor()))
+    finally:
+        conn.close()
+
+
+# ---------------- CASI DI BENCHMARK ----------------
+def build_cases(ctx):
+    """Un caso per ogni route (più varianti NDJSON). Le route nuove non elencate
+    qui vengono coperte automaticamente se sono GET (vedi auto_cases)."""
+    rnd = ctx['rnd']
+    uid = lambda: rnd.randint(1, ctx['users'])
+    cid = lambda: rnd.randint(1, ctx['characters'])
+    png = open(os.path.join(BASE_DIR, 'assets', 'logo.png'), 'rb').read()
+    docx = make_docx_bytes('SCENA 1\nBATTUTA: benchmark')
+    ndjson = {'Accept': be.NDJSON_MIMETYPE}
+    # I personaggi si eliminano a partire dagli ultimi, così gli altri casi restano validi
+    delete_ids = iter(range(ctx['characters'], 0, -1))
+    # Ogni richiesta di rimozione si decide una volta sola: le decisioni consumano id ancora pending
+    pending_ids = itertools.count(1)
+    year_ago = (datetime.now() - timedelta(days=365)).strftime('%Y-%m-%d')
+    month_ago = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+
+    return [
+        ('GET /bacheca/characters', 'GET', lambda: '/bacheca/characters', lambda: {}),
+        ('GET /bacheca/characters?user_id', 'GET', lambda: f'/bacheca/characters?user_id={uid()}', lambda: {}),
+        ('GET /bacheca/characters?since=0', 'GET', lambda: f'/bacheca/characters?user_id={uid()}&since=0', lambda: {}),
+        ('GET /bacheca/characters?since=<latest>', 'GET',
+         lambda: f'/bacheca/characters?user_id={uid()}&since={ctx["version"]()}', lambda: {}),
+        ('POST /bacheca/character', 'POST', lambda: '/bacheca/character', lambda: {
+            'data': {'series_title': rnd.choice(SERIES), 'character_name': f'Bench {rnd.random()}',
+                     'role': 'Bench', 'created_by': '1',
+                     'image_file': (io.BytesIO(png), 'img.png')},
+            'content_type': 'multipart/form-data'}),
+        ('PUT /bacheca/character/<cid>', 'PUT', lambda: f'/bacheca/character/{cid()}',
+         lambda: {'json': {'role': f'Doppiatore {rnd.randint(1, 300)}'}}),
+        ('PATCH /bacheca/character/<cid>', 'PATCH', lambda: f'/bacheca/character/{cid()}', lambda: {
+            'data': {'role': f'Doppiatore {rnd.randint(1, 300)}', 'expiry_date': '2099-12-31',
+                     'image_file': (io.BytesIO(png), 'img.png')},
+            'content_type': 'multipart/form-data'}),
+        ('POST /bacheca/character/<cid>/upload_script', 'POST', lambda: f'/bacheca/character/{cid()}/upload_script',
+         lambda: {'data': {'script': (io.BytesIO(docx), 'copione.docx')}, 'content_type': 'multipart/form-data'}),
+        ('GET /bacheca/character/<cid>/download_script', 'GET', lambda: f'/bacheca/character/{cid()}/download_script', lambda: {}),
+        ('GET /bacheca/character/<cid>/script_preview', 'GET', lambda: f'/bacheca/character/{cid()}/script_preview', lambda: {}),
+        ('POST /bacheca/character/<cid>/upload_image', 'POST', lambda: f'/bacheca/character/{cid()}/upload_image',
+         lambda: {'data': {'image_file': (io.BytesIO(png), 'img.png')}, 'content_type': 'multipart/form-data'}),
+        ('POST /bacheca/character/<cid>/upload_mov', 'POST', lambda: f'/bacheca/character/{cid()}/upload_mov',
+         lambda: {'data': {'mov': (io.BytesIO(b'\0' * 65536), 'clip.mov'), 'uploader': '1'},
+                  'content_type': 'multipart/form-data'}),
+        ('GET /bacheca/character/<cid>/download_mov', 'GET', lambda: f'/bacheca/character/{cid()}/download_mov', lambda: {}),
+        ('GET /get_all_users', 'GET', lambda: '/get_all_users', lambda: {}),
+        ('GET /profile_image/<path>', 'GET', lambda: f"/profile_image/{ctx['image_path']}", lambda: {}),
+        ('POST /login', 'POST', lambda: '/login', lambda: {'json': {'code': f"USRB{rnd.randint(0, ctx['users'] - 1):07d}", 'password': 'password'}}),
+        ('POST /add_hours', 'POST', lambda: '/add_hours', lambda: {'json': {'user_id': uid(), 'hours': 1.5, 'reason': 'Benchmark'}}),
+        # Badge casuali: entrate e uscite alternate, le letture ripetute entro KIOSK_DEBOUNCE sono rare
+        ('POST /kiosk/scan', 'POST', lambda: '/kiosk/scan', lambda: {'json': {
+            'code': f"USRB{rnd.randint(0, ctx['users'] - 1):07d}", 'terminal': 'bench'}}),
+        ('GET /get_logs/<uid>', 'GET', lambda: f'/get_logs/{uid()}', lambda: {}),
+        ('GET /get_logs/<uid>?since=0', 'GET', lambda: f'/get_logs/{uid()}?since=0', lambda: {}),
+        ('GET /get_logs/<uid>?since=<latest>', 'GET', lambda: f'/get_logs/{uid()}?since={ctx["version"]()}', lambda: {}),
+        ('GET /get_logs/<uid> (ndjson)', 'GET', lambda: f'/get_logs/{uid()}', lambda: {'headers': ndjson}),
+        ('POST /register', 'POST', lambda: '/register', lambda: {'json': {
+            'name': 'Bench', 'surname': 'Bench', 'email': f'bench{rnd.random()}@bench.local', 'password': 'x'}}),
+        ('GET /user_profile/<uid>', 'GET', lambda: f'/user_profile/{uid()}', lambda: {}),
+        ('POST /user_profile/<uid>', 'POST', lambda: f'/user_profile/{uid()}', lambda: {'json': {'nickname': 'bench', 'image_b64': None}}),
+        ('POST /request_removal', 'POST', lambda: '/request_removal', lambda: {'json': {
+            'work_log_id': rnd.randint(1, max(1, ctx['logs'])), 'requester_id': uid(), 'reason': 'Benchmark'}}),
+        ('GET /admin/removal_requests', 'GET', lambda: '/admin/removal_requests', lambda: {}),
+        ('GET /admin/removal_requests (ndjson)', 'GET', lambda: '/admin/removal_requests', lambda: {'headers': ndjson}),
+        ('POST /admin/handle_removal', 'POST', lambda: '/admin/handle_removal', lambda: {'json': {
+            'request_id': next(pending_ids), 'action': 'rejected', 'admin_id': 1, 'admin_reason': 'Benchmark'}}),
+        ('POST /admin/handle_removal_batch', 'POST', lambda: '/admin/handle_removal_batch', lambda: {'json': {
+            'admin_id': 1, 'admin_reason': 'Benchmark',
+            'decisions': [{'request_id': next(pending_ids), 'action': 'rejected', 'hours': 1.0} for _ in range(20)]}}),
+        ('GET /admin/users_hours', 'GET', lambda: '/admin/users_hours', lambda: {}),
+        ('GET /admin/users_hours (ndjson)', 'GET', lambda: '/admin/users_hours', lambda: {'headers': ndjson}),
+        ('GET /admin/audit', 'GET', lambda: '/admin/audit?limit=100', lambda: {}),
+        ('GET /admin/reports?group_by=month (1 anno)', 'GET', lambda: f'/admin/reports?from={year_ago}&group_by=month', lambda: {}),
+        ('GET /admin/reports?group_by=user (1 mese)', 'GET', lambda: f'/admin/reports?from={month_ago}&group_by=user&limit=10', lambda: {}),
+        ('GET /admin/reports?group_by=month,user&top=3', 'GET',
+         lambda: f'/admin/reports?from={year_ago}&group_by=month,user&top=3', lambda: {}),
+        ('GET /admin/reports?group_by=reason', 'GET', lambda: f'/admin/reports?from={month_ago}&group_by=reason&limit=20', lambda: {}),
+        ('GET /admin/reports?group_by=week&user_id', 'GET',
+         lambda: f'/admin/reports?from={year_ago}&group_by=week&user_id={uid()}', lambda: {}),
+        ('GET /admin/export/work_logs (csv, 1 mese)', 'GET', lambda: f'/admin/export/work_logs?from={month_ago}', lambda: {}),
+        ('GET /admin/export/work_logs (xlsx, 1 mese)', 'GET',
+         lambda: f'/admin/export/work_logs?from={month_ago}&format=xlsx', lambda: {}),
+        ('GET /search', 'GET', lambda: f"/search?q={rnd.choice(REASONS).split()[0][:5]}", lambda: {}),
+        ('GET /search?scope=logs&user_id', 'GET',
+         lambda: f"/search?q={rnd.choice(REASONS).split()[0][:5]}&scope=logs&user_id={uid()}", lambda: {}),
+        ('GET /metrics', 'GET', lambda: '/metrics', lambda: {}),
+        ('DELETE /admin/cache', 'DELETE', lambda: '/admin/cache', lambda: {}),
+        # Backup completo e verificato del dataset: la retention tiene la cartella entro BACKUP_KEEP file
+        ('POST /admin/backups', 'POST', lambda: '/admin/backups', lambda: {'json': {'label': 'bench'}}),
+        # Risponde 202 e lavora in background: si misura l'avvio (409 se il lavoro precedente è ancora in corso)
+        ('POST /admin/archive', 'POST', lambda: '/admin/archive', lambda: {'json': {'days': 365}}),
+        ('POST /bacheca/character/<cid>/delete', 'POST', lambda: f'/bacheca/character/{next(delete_ids)}/delete', lambda: {}),
+        ('DELETE /bacheca/character/<cid>', 'DELETE', lambda: f'/bacheca/character/{next(delete_ids)}', lambda: {}),
+    ]
+
+def auto_cases(cases):
+    """Aggiunge un caso GET generico per le route non ancora elencate"""
+    adapter = be.app.url_map.bind('localhost')
+    covered = set()
+    for name, method, _, _ in cases:
+        generic = re.sub(r'<[^>]+>', '1', name.split(' ')[1].split('?')[0])
+        try:
+            endpoint, _ = adapter.match(generic, method=method)
+            covered.add((method, endpoint))
+        except Exception:
+            pass
+    extra = []
+    for rule in be.app.url_map.iter_rules():
+        if rule.endpoint == 'static':
+            continue
+        generic = re.sub(r'<(int:)?[^>]+>', lambda m: '1' if m.group(1) else 'x', rule.rule)
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            if (method, rule.endpoint) in covered:
+                continue
+            if method == 'GET':
+                extra.append((f'GET {rule.rule} (auto)', 'GET', lambda g=generic: g, lambda: {}))
+            else:
+                print(f"[BENCH] ⚠️  Route non coperta dal benchmark: {method} {rule.rule}")
+    return cases + extra
+
+
+# ---------------- MISURA ----------------
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(round(p / 100.0 * len(values) + 0.5)) - 1))
+    return values[k]
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+def run_case(client, case, iterations, warmup):
+    name, method, path_fn, kwargs_fn = case
+    for _ in range(warmup):
+        with client.open(path_fn(), method=method, **kwargs_fn()) as r:
+            r.data
+    latencies = []
+    statuses = {}
+    rss_before = peak_rss_kb()
+    t_start = time.perf_counter()
+    for _ in range(iterations):
+        path, kwargs = path_fn(), kwargs_fn()
+        t0 = time.perf_counter()
+        with client.open(path, method=method, **kwargs) as r:
+            r.data
+            status = r.status_code
+        latencies.append(time.perf_counter() - t0)
+        statuses[status] = statuses.get(status, 0) + 1
+    elapsed = time.perf_counter() - t_start
+    rss_after = peak_rss_kb()
+    return {
+        'iterations': iterations,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': sum(latencies) / len(latencies) * 1000,
+        'throughput_rps': iterations / elapsed if elapsed else 0.0,
+        'peak_rss_kb': rss_after,
+        'rss_growth_kb': (rss_after - rss_before) if rss_after is not None else None,
+        'statuses': {str(k): v for k, v in sorted(statuses.items())},
+    }
+
+def compare(results, baseline, tolerance):
+    """Ritorna la lista delle regressioni rispetto al baseline (su p95)"""
+    regressions = []
+    base = baseline.get('results', {})
+    for name, res in results.items():
+        old = base.get(name)
+        if not old or not old.get('p95_ms'):
+            continue
+        ratio = res['p95_ms'] / old['p95_ms']
+        if ratio > 1 + tolerance:
+            regressions.append((name, old['p95_ms'], res['p95_ms'], ratio))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark endpoint BadgeEmpire su dataset sintetico")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--logs', type=int)
+    parser.add_argument('--characters', type=int)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--only', type=str, help="Esegue solo i casi che contengono questo testo")
+    parser.add_argument('--db-dir', default=os.path.join(BASE_DIR, 'bench_data'),
+                        help="Cartella dei dataset sintetici (riutilizzati tra un'esecuzione e l'altra)")
+    parser.add_argument('--rebuild', action='store_true', help="Ricrea il dataset anche se esiste")
+    parser.add_argument('--no-response-cache', action='store_true',
+                        help="Disattiva la cache delle risposte (misura il costo delle query)")
+    parser.add_argument('--save', type=str, help="Salva i risultati come baseline JSON")
+    parser.add_argument('--compare', type=str, help="Confronta con un baseline JSON")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Regressione ammessa su p95 (0.25 = +25%%)")
+    args = parser.parse_args()
+
+    scale = dict(SCALES[args.scale])
+    for k in ('users', 'logs', 'characters'):
+        if getattr(args, k) is not None:
+            scale[k] = getattr(args, k)
+
+    os.makedirs(args.db_dir, exist_ok=True)
+    src = dataset_path(args.db_dir, scale['users'], scale['logs'], scale['characters'], args.seed)
+    if args.rebuild or not os.path.exists(src):
+        build_dataset(src, scale['users'], scale['logs'], scale['characters'], args.seed)
+
+    # Si lavora su una copia: gli endpoint di scrittura non sporcano il dataset
+    work_dir = tempfile.mkdtemp(prefix='badgeempire_bench_')
+    try:
+        be.DB_PATH = os.path.join(work_dir, 'timbracart.db')
+        shutil.copy(src, be.DB_PATH)
+        be.BASE_DIR = work_dir
+        be.ASSETS_DIR = os.path.join(work_dir, 'assets')
+        be.RATE_LIMIT_ENABLED = False  # si misura il costo degli endpoint, non il rate limiter
+        if args.no_response_cache:
+            be.response_cache.max_entries = 0
+        prepare_assets(work_dir)
+        be.init_db()  # applica eventuali migrazioni al dataset copiato
+
+        # Dopo la migrazione i file vivono nell'archivio per contenuto: il percorso si legge dal DB
+        conn = be.get_db_connection()
+        image_path = conn.execute('SELECT image_path FROM bacheca_characters WHERE image_path IS NOT NULL LIMIT 1').fetchone()[0]
+        conn.close()
+        ctx = dict(scale, rnd=random.Random(args.seed), removals=removal_count(scale['logs']), image_path=image_path)
+        ctx['version'] = latest_change_version
+        cases = auto_cases(build_cases(ctx))
+        if args.only:
+            cases = [c for c in cases if args.only in c[0]]
+
+        client = be.app.test_client()
+        results = {}
+        print(f"\n{'Endpoint':<52} {'p50':>8} {'p95':>8} {'p99':>8} {'req/s':>9} {'RSS MB':>8}  stati")
+        print("-" * 110)
+        for case in cases:
+            res = run_case(client, case, args.iterations, args.warmup)
+            results[case[0]] = res
+            rss = f"{res['peak_rss_kb'] / 1024:.0f}" if res['peak_rss_kb'] is not None else '-'
+            print(f"{case[0]:<52} {res['p50_ms']:>7.2f}m {res['p95_ms']:>7.2f}m {res['p99_ms']:>7.2f}m "
+                  f"{res['throughput_rps']:>9.1f} {rss:>8}  {res['statuses']}")
+        be._audit_writer.stop()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'app_version': be.APP_VERSION,
+        'dataset': scale,
+        'iterations': args.iterations,
+        'results': results,
+    }
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n[BENCH] Baseline salvato in {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('dataset') != scale:
+            print(f"[BENCH] ⚠️  Dataset diverso dal baseline: {baseline.get('dataset')} vs {scale}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ REGRESSIONI (p95 oltre +{args.tolerance:.0%}):")
+            for name, old, new, ratio in regressions:
+                print(f"   {name:<52} {old:.2f}ms -> {new:.2f}ms (x{ratio:.2f})")
+            sys.exit(1)
+        print("\n✅ Nessuna regressione rispetto al baseline")
+
+if __name__ == '__main__':
+    main()
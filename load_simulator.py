@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# load_simulator.py
+# Simula una flotta di client desktop contro un server avviato in locale con run_server()
+#
+# Ogni utente virtuale riproduce il comportamento reale del client:
+#   login -> sequenza di MainWindow.__init__ -> apertura Bacheca -> polling bacheca (25 s)
+#   e admin (20 s) -> inserimenti ore a raffica -> upload occasionali (admin).
+# Il tempo può essere accelerato con --speed (es. 10 = polling ogni 2.5 s).
+#
+# Esempi:
+#   python load_simulator.py --clients 5,10,25,50 --duration 30 --speed 10
+#   python load_simulator.py --clients 100 --admins 0.05 --save fleet.json
+
+import os
+import sys
+import json
+import time
+import socket
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+import requests
+import BadgeEmpire as be
+from benchmark_endpoints import SCALES, build_dataset, dataset_path, prepare_assets, percentile
+
+BACHECA_POLL = 25.0   # BachecaWindow.poll_timer
+ADMIN_POLL = 20.0     # MainWindow.poll (solo admin)
+LOCK_MARKER = 'database is locked'
+
+
+class Recorder:
+    """Raccoglie latenza ed esito di ogni richiesta della fase corrente"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = []  # (endpoint, secondi, stato, lock_error)
+
+    def add(self, endpoint, seconds, status, locked):
+        with self._lock:
+            self.samples.append((endpoint, seconds, status, locked))
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.samples)
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, idx, base_url, user_code, is_admin, rec, args, stop_event, characters):
+        super().__init__(name=f'vu-{idx}', daemon=True)
+        self.base_url = base_url
+        self.code = user_code
+        self.is_admin = is_admin
+        self.rec = rec
+        self.args = args
+        self.stop_event = stop_event
+        self.characters = characters
+        self.rnd = random.Random(idx)
+        self.user = None
+        self.version = 0  # ultima versione della bacheca ricevuta (sincronizzazione incrementale)
+        self.log_version = 0  # versione della replica locale dei log
+
+    # Ogni chiamata usa requests "nudo" come il client reale (nessuna sessione keep-alive)
+    def call(self, label, method, path, **kwargs):
+        kwargs.setdefault('timeout', 30)
+        t0 = time.perf_counter()
+        status, locked = 'exc', False
+        try:
+            r = requests.request(method, self.base_url + path, **kwargs)
+            status = r.status_code
+            body = r.content
+            locked = status >= 500 and LOCK_MARKER.encode() in body
+            return r
+        except requests.RequestException:
+            return None
+        finally:
+            self.rec.add(label, time.perf_counter() - t0, status, locked)
+
+    def scaled(self, seconds):
+        return seconds / self.args.speed
+
+    def startup(self):
+        r = self.call('POST /login', 'POST', '/login', json={'code': self.code, 'password': 'password'})
+        if r is None or r.status_code != 200:
+            return False
+        self.user = r.json()
+        uid = self.user['id']
+        if self.is_admin:
+            # build_admin_bacheca + load_removal_requests + load_users_hours
+            self.call('GET /bacheca/characters', 'GET', '/bacheca/characters')
+            self.call('GET /get_all_users', 'GET', '/get_all_users')
+            self.call('GET /admin/removal_requests', 'GET', '/admin/removal_requests', headers={'Accept': be.NDJSON_MIMETYPE})
+            self.call('GET /admin/users_hours', 'GET', '/admin/users_hours', headers={'Accept': be.NDJSON_MIMETYPE})
+        self.call('GET /user_profile/<id>', 'GET', f'/user_profile/{uid}')
+        self.load_months()
+        self.open_bacheca()
+        return True
+
+    def load_months(self):
+        # La dashboard legge dalla replica locale: in rete va solo il delta dei log
+        uid = self.user['id']
+        r = self.call('GET /get_logs/<id>?since', 'GET', f'/get_logs/{uid}?since={self.log_version}')
+        if r is not None and r.status_code == 200:
+            self.log_version = r.json()['version']
+
+    def open_bacheca(self):
+        r = self.call('GET /bacheca/characters?since=0', 'GET', f"/bacheca/characters?user_id={self.user['id']}&since=0")
+        if r is not None and r.status_code == 200:
+            delta = r.json()
+            self.version = delta['version']
+            # Il client scarica subito l'immagine corrente di entrambi i tab
+            seen = {}
+            for it in delta['items']:
+                seen.setdefault(it['series_title'], it)
+            for it in seen.values():
+                if it.get('image_url'):
+                    path = it['image_url'].split('/profile_image/', 1)[-1]
+                    self.call('GET /profile_image/<path>', 'GET', f'/profile_image/{path}')
+
+    def add_hours_burst(self):
+        for _ in range(self.rnd.randint(1, self.args.burst)):
+            self.call('POST /add_hours', 'POST', '/add_hours',
+                      json={'user_id': self.user['id'], 'hours': round(self.rnd.uniform(0.5, 4), 1), 'reason': 'Simulazione'})
+            self.load_months()
+
+    def upload(self):
+        cid = self.rnd.randint(1, max(1, self.characters))
+        png = os.path.join(BASE_DIR, 'assets', 'logo.png')
+        with open(png, 'rb') as f:
+            self.call('POST /bacheca/character/<id>/upload_image', 'POST',
+                      f'/bacheca/character/{cid}/upload_image', files={'image_file': f})
+
+    def run(self):
+        # Avvio sfalsato come nella realtà (i client non partono tutti nello stesso istante)
+        if self.stop_event.wait(self.rnd.uniform(0, self.scaled(self.args.ramp))):
+            return
+        if not self.startup():
+            return
+        now = time.monotonic()
+        next_bacheca = now + self.scaled(BACHECA_POLL)
+        next_admin = now + self.scaled(ADMIN_POLL)
+        next_hours = now + self.rnd.expovariate(1.0 / self.scaled(self.args.hours_interval))
+        next_upload = now + self.rnd.expovariate(1.0 / self.scaled(self.args.upload_interval))
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            if now >= next_bacheca:
+                # Polling incrementale della bacheca (solo le differenze)
+                r = self.call('GET /bacheca/characters?since', 'GET',
+                              f"/bacheca/characters?user_id={self.user['id']}&since={self.version}", timeout=6)
+                if r is not None and r.status_code == 200:
+                    self.version = r.json()['version']
+                next_bacheca += self.scaled(BACHECA_POLL)
+            if self.is_admin and now >= next_admin:
+                self.call('GET /admin/removal_requests', 'GET', '/admin/removal_requests', headers={'Accept': be.NDJSON_MIMETYPE})
+                next_admin += self.scaled(ADMIN_POLL)
+            if now >= next_hours:
+                self.add_hours_burst()
+                next_hours = time.monotonic() + self.rnd.expovariate(1.0 / self.scaled(self.args.hours_interval))
+            if self.is_admin and now >= next_upload:
+                self.upload()
+                next_upload = time.monotonic() + self.rnd.expovariate(1.0 / self.scaled(self.args.upload_interval))
+            deadlines = [next_bacheca, next_hours]
+            if self.is_admin:
+                deadlines += [next_admin, next_upload]
+            self.stop_event.wait(max(0.0, min(deadlines) - time.monotonic()))
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def start_server(port):
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)  # niente log per ogni richiesta
+    t = threading.Thread(target=be.run_server, kwargs={'host': '127.0.0.1', 'port': port}, daemon=True)
+    t.start()
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/metrics', timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError("Il server non si è avviato")
+
+def summarize(samples, elapsed):
+    lat = [s[1] for s in samples]
+    errors = sum(1 for s in samples if s[2] == 'exc' or (isinstance(s[2], int) and s[2] >= 500 and s[2] != 503))
+    rejected = sum(1 for s in samples if s[2] in (429, 503))
+    per_endpoint = {}
+    for ep, sec, status, locked in samples:
+        d = per_endpoint.setdefault(ep, {'lat': [], 'errors': 0, 'locked': 0, 'rejected': 0})
+        d['lat'].append(sec)
+        d['errors'] += status == 'exc' or (isinstance(status, int) and status >= 500 and status != 503)
+        d['rejected'] += status in (429, 503)
+        d['locked'] += locked
+    return {
+        'requests': len(samples),
+        'throughput_rps': len(samples) / elapsed if elapsed else 0.0,
+        'errors': errors,
+        'error_rate': errors / len(samples) if samples else 0.0,
+        'rejected': rejected,  # 429 (rate limit) e 503 (load shedding)
+        'lock_errors': sum(1 for s in samples if s[3]),
+        'p50_ms': percentile(lat, 50) * 1000,
+        'p95_ms': percentile(lat, 95) * 1000,
+        'p99_ms': percentile(lat, 99) * 1000,
+        'endpoints': {ep: {'requests': len(d['lat']), 'errors': d['errors'], 'lock_errors': d['locked'],
+                           'rejected': d['rejected'],
+                           'p50_ms': percentile(d['lat'], 50) * 1000, 'p95_ms': percentile(d['lat'], 95) * 1000,
+                           'p99_ms': percentile(d['lat'], 99) * 1000}
+                      for ep, d in sorted(per_endpoint.items())},
+    }
+
+def run_stage(n, base_url, args, codes, admin_codes, characters):
+    rec = Recorder()
+    stop = threading.Event()
+    rnd = random.Random(n)
+    vus = []
+    for i in range(n):
+        is_admin = rnd.random() < args.admins
+        code = rnd.choice(admin_codes if is_admin and admin_codes else codes)
+        vus.append(VirtualUser(i, base_url, code, is_admin, rec, args, stop, characters))
+    t0 = time.perf_counter()
+    for vu in vus:
+        vu.start()
+    time.sleep(args.duration)
+    stop.set()
+    for vu in vus:
+        vu.join(timeout=35)
+    return summarize(rec.snapshot(), time.perf_counter() - t0)
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulatore di carico per una flotta di client BadgeEmpire")
+    parser.add_argument('--clients', default='5,10,25,50', help="Numero di client per ogni fase (lista)")
+    parser.add_argument('--duration', type=float, default=30, help="Durata di ogni fase in secondi")
+    parser.add_argument('--speed', type=float, default=10, help="Accelerazione del tempo (polling e pause)")
+    parser.add_argument('--ramp', type=float, default=20, help="Finestra di avvio dei client (s, tempo reale client)")
+    parser.add_argument('--admins', type=float, default=0.1, help="Frazione di client admin")
+    parser.add_argument('--burst', type=int, default=3, help="Inserimenti ore massimi per raffica")
+    parser.add_argument('--hours-interval', type=float, default=120, help="Pausa media tra raffiche di ore (s)")
+    parser.add_argument('--upload-interval', type=float, default=300, help="Pausa media tra upload admin (s)")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--db-dir', default=os.path.join(BASE_DIR, 'bench_data'))
+    parser.add_argument('--rate-limit', action='store_true',
+                        help="Lascia attivo il rate limiter (tutti i client simulati arrivano da 127.0.0.1)")
+    parser.add_argument('--save', type=str, help="Salva i risultati in JSON")
+    args = parser.parse_args()
+    stages = [int(x) for x in args.clients.split(',') if x.strip()]
+
+    scale = SCALES[args.scale]
+    os.makedirs(args.db_dir, exist_ok=True)
+    src = dataset_path(args.db_dir, scale['users'], scale['logs'], scale['characters'], args.seed)
+    if not os.path.exists(src):
+        build_dataset(src, scale['users'], scale['logs'], scale['characters'], args.seed)
+
+    work_dir = tempfile.mkdtemp(prefix='badgeempire_load_')
+    be.DB_PATH = os.path.join(work_dir, 'timbracart.db')
+    shutil.copy(src, be.DB_PATH)
+    be.BASE_DIR = work_dir
+    be.ASSETS_DIR = os.path.join(work_dir, 'assets')
+    be.RATE_LIMIT_ENABLED = args.rate_limit
+    prepare_assets(work_dir)
+
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    be.SERVER_URL = base_url
+    start_server(port)
+
+    codes = [f"USRB{i:07d}" for i in range(scale['users'])]
+    admin_codes = [f"USRB{i:07d}" for i in range(0, scale['users'], 500)]
+
+    results = {}
+    print(f"\n{'Client':>7} {'req':>7} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'errori':>7} {'locked':>7} {'respinte':>9}")
+    print("-" * 80)
+    try:
+        for n in stages:
+            res = run_stage(n, base_url, args, codes, admin_codes, scale['characters'])
+            results[str(n)] = res
+            print(f"{n:>7} {res['requests']:>7} {res['throughput_rps']:>8.1f} {res['p50_ms']:>8.1f}m "
+                  f"{res['p95_ms']:>8.1f}m {res['p99_ms']:>8.1f}m {res['errors']:>7} {res['lock_errors']:>7} {res['rejected']:>9}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # Endpoint peggiori nell'ultima fase: dove si satura per primo
+    if results:
+        last = results[str(stages[-1])]
+        print(f"\nCoda di latenza con {stages[-1]} client:")
+        worst = sorted(last['endpoints'].items(), key=lambda kv: kv[1]['p99_ms'], reverse=True)[:8]
+        for ep, d in worst:
+            print(f"   {ep:<45} p95 {d['p95_ms']:>8.1f}ms  p99 {d['p99_ms']:>8.1f}ms  "
+                  f"errori {d['errors']}  locked {d['lock_errors']}  respinte {d['rejected']}")
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 'dataset': scale,
+                       'speed': args.speed, 'duration': args.duration, 'stages': results}, f, indent=2)
+        print(f"\n[LOAD] Risultati salvati in {args.save}")
+    be._audit_writer.stop()
+    os._exit(0)  # il server Flask gira in un thread non interrompibile
+
+if __name__ == '__main__':
+    main()
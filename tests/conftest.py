@@ -0,0 +1,37 @@
+# Fixture comuni: ogni test lavora su un database temporaneo
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import BadgeEmpire as be
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(be, 'DB_PATH', str(tmp_path / 'timbracart.db'))
+    monkeypatch.setattr(be, 'BASE_DIR', str(tmp_path))
+    monkeypatch.setattr(be, 'ASSETS_DIR', str(tmp_path / 'assets'))
+    monkeypatch.setattr(be, 'ARCHIVE_DB_PATH', None)
+    monkeypatch.setattr(be, 'RATE_LIMIT_ENABLED', False)
+    be.response_cache.clear()
+    be._user_codes.invalidate()
+    be.init_db()
+    yield be
+    # I thread di scrittura tengono una connessione al database del test
+    be._db_writer.stop()
+    be._audit_writer.stop()
+
+
+@pytest.fixture
+def client(server):
+    return server.app.test_client()
+
+
+@pytest.fixture
+def db(server):
+    conn = server.get_db_connection()
+    yield conn
+    conn.close()
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+
+def test_delta_keeps_edited_logs_that_were_archived(client, db, server):
+    old_date = (datetime.now() - timedelta(days=60)).strftime('%Y-%m-%d %H:%M:%S')
+    db.execute("INSERT INTO work_logs (user_id, date, hours, reason) VALUES (1, ?, 3, 'turno')", (old_date,))
+    db.commit()
+    version = client.get('/get_logs/1?since=0').get_json()['version']
+
+    db.execute('UPDATE work_logs SET hours=2 WHERE id=1')
+    db.commit()
+    r = client.post('/admin/archive', json={'days': 30})
+    assert r.status_code == 202
+    server._archive_now.wait(10)
+    assert client.get('/admin/archive').get_json()['archived_rows'] == 1
+
+    delta = client.get(f'/get_logs/1?since={version}').get_json()
+    assert delta['full'] is False
+    assert delta['deleted'] == []
+    assert [(it['id'], it['hours']) for it in delta['items']] == [(1, 2)]
+
+
+def test_archive_rejects_non_integer_days(client):
+    for days in (True, False, '30', 1.5, -1):
+        assert client.post('/admin/archive', json={'days': days}).status_code == 400
+
+
+def test_archiving_leaves_change_log_alone(client, db, server):
+    old_date = (datetime.now() - timedelta(days=60)).strftime('%Y-%m-%d %H:%M:%S')
+    db.executemany("INSERT INTO work_logs (user_id, date, hours, reason) VALUES (1, ?, 1, 'turno')",
+                   [(old_date,)] * 3)
+    db.commit()
+    version = server.current_change_version(db.cursor())
+    server.archive_old_logs(30)
+    assert server.current_change_version(db.cursor()) == version
+    assert db.execute("SELECT COUNT(*) FROM change_log WHERE op='delete'").fetchone()[0] == 0
+    assert db.execute('SELECT COUNT(*) FROM change_log_paused').fetchone()[0] == 0
+
+    # Le cancellazioni normali continuano a finire nel change log
+    db.execute("INSERT INTO work_logs (user_id, date, hours, reason) VALUES (1, '2099-01-01', 1, 'x')")
+    db.execute("DELETE FROM work_logs WHERE date='2099-01-01'")
+    db.commit()
+    assert db.execute("SELECT COUNT(*) FROM change_log WHERE op='delete'").fetchone()[0] == 1
+
+
+def test_old_delete_trigger_is_replaced(server, db):
+    db.execute('DROP TRIGGER work_logs_changes_delete')
+    db.execute('''CREATE TRIGGER work_logs_changes_delete AFTER DELETE ON work_logs BEGIN
+        INSERT INTO change_log (entity, entity_id, owner_id, op) VALUES ('work_log', old.id, old.user_id, 'delete');
+    END''')
+    db.commit()
+    server.init_db_change_log(db)
+    sql = db.execute("SELECT sql FROM sqlite_master WHERE name='work_logs_changes_delete'").fetchone()[0]
+    assert 'change_log_paused' in sql
+
+
+def test_archive_request_while_running_is_409(client, server, monkeypatch):
+    import threading
+    release = threading.Event()
+    monkeypatch.setattr(server._archive_now, 'fn', lambda days: release.wait(10))
+    assert client.post('/admin/archive', json={'days': 30}).status_code == 202
+    assert client.get('/admin/archive').get_json()['running'] is True
+    assert client.post('/admin/archive', json={'days': 30}).status_code == 409
+    release.set()
+    server._archive_now.wait(10)
+    assert client.get('/admin/archive').get_json()['running'] is False
+
+
+def test_maintenance_does_not_vacuum_a_non_incremental_db(server, db):
+    db.execute('PRAGMA auto_vacuum = NONE')
+    db.execute('VACUUM')
+    db.execute('CREATE TABLE filler (x BLOB)')
+    db.executemany('INSERT INTO filler VALUES (?)', [(b'x' * 4000,)] * 200)
+    db.commit()
+    db.execute('DROP TABLE filler')
+    db.commit()
+    free = db.execute('PRAGMA freelist_count').fetchone()[0]
+    assert server.maintain_database()['freed_pages'] == 0
+    assert db.execute('PRAGMA auto_vacuum').fetchone()[0] == 0
+    # Niente VACUUM: le pagine libere restano (ANALYZE ne può riusare qualcuna)
+    assert db.execute('PRAGMA freelist_count').fetchone()[0] > free // 2
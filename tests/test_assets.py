@@ -0,0 +1,55 @@
+import io
+import os
+
+
+def _create(client, content):
+    r = client.post('/bacheca/character', data={'character_name': 'A', 'role': 'R', 'image_file': (io.BytesIO(content), 'a.png')},
+                    content_type='multipart/form-data')
+    assert r.status_code == 200
+    return r.get_json()['id']
+
+
+def _blob(db, cid):
+    return db.execute('SELECT image_path FROM bacheca_characters WHERE id=?', (cid,)).fetchone()[0]
+
+
+def _refcount(db, rel):
+    r = db.execute('SELECT refcount FROM asset_blobs WHERE path=?', (rel,)).fetchone()
+    return r[0] if r else None
+
+
+def test_identical_uploads_share_one_blob_until_the_last_reference(server, client, db):
+    a, b = _create(client, b'stessa immagine'), _create(client, b'stessa immagine')
+    rel = _blob(db, a)
+    assert _blob(db, b) == rel
+    assert _refcount(db, rel) == 2
+    full_path = os.path.join(server.BASE_DIR, rel)
+
+    client.delete(f'/bacheca/character/{a}')
+    server.collect_asset_garbage(grace=0)
+    assert os.path.exists(full_path)
+
+    client.delete(f'/bacheca/character/{b}')
+    server.collect_asset_garbage(grace=3600)
+    assert os.path.exists(full_path)  # periodo di grazia
+    server.collect_asset_garbage(grace=0)
+    assert not os.path.exists(full_path)
+    assert _refcount(db, rel) is None
+
+
+def test_gc_fixes_counters_and_removes_orphans(server, client, db):
+    rel = _blob(db, _create(client, b'immagine'))
+    db.execute('UPDATE asset_blobs SET refcount=0, unreferenced_since=0 WHERE path=?', (rel,))
+    db.commit()
+
+    orphan = os.path.join(server._blobs_dir(), 'ab', 'cd', 'orfano.png')
+    os.makedirs(os.path.dirname(orphan), exist_ok=True)
+    with open(orphan, 'wb') as f:
+        f.write(b'x')
+    os.utime(orphan, (0, 0))
+
+    info = server.collect_asset_garbage(grace=0)
+    assert info['fixed_refs'] == 1
+    assert _refcount(db, rel) == 1
+    assert os.path.exists(os.path.join(server.BASE_DIR, rel))
+    assert not os.path.exists(orphan)
@@ -0,0 +1,51 @@
+import io
+
+import pytest
+
+
+@pytest.fixture
+def character(client):
+    return client.post('/bacheca/character', data={'character_name': 'A', 'role': 'R'}).get_json()['id']
+
+
+def test_patch_updates_fields_and_files_in_one_request(client, character):
+    r = client.patch(f'/bacheca/character/{character}', data={
+        'role': 'R2', 'image_file': (io.BytesIO(b'png'), 'a.png')}, content_type='multipart/form-data')
+    assert r.status_code == 200
+    item = r.get_json()['character']
+    assert item['role'] == 'R2'
+    assert item['image_url']
+
+
+def test_patch_accepts_visible_to_as_list(client, character):
+    r = client.patch(f'/bacheca/character/{character}', json={'visible_to': [1, '2'], 'assigned_to': 3})
+    assert r.status_code == 200
+    assert r.get_json()['character']['visible_to'] == '1,2'
+    assert [c['id'] for c in client.get('/bacheca/characters?user_id=2').get_json()] == [character]
+    assert client.get('/bacheca/characters?user_id=5').get_json() == []
+
+
+@pytest.mark.parametrize('body', [
+    {'visible_to': {'a': 1}},
+    {'visible_to': [[1]]},
+    {'role': 5},
+    {'character_name': ['x']},
+    {'assigned_to': True},
+    [1, 2],
+])
+def test_patch_rejects_wrong_types(client, character, body):
+    r = client.patch(f'/bacheca/character/{character}', json=body)
+    assert r.status_code == 400
+
+
+def test_failed_script_extraction_clears_stale_text(server, client, character, db):
+    db.execute("UPDATE bacheca_characters SET script_path='scripts/rotto.docx', script_text='vecchio copione' "
+               "WHERE id=?", (character,))
+    db.commit()
+    text, preview = server.extract_character_script(character)
+    assert text is None and preview
+    row = db.execute('SELECT script_text, script_preview_html FROM bacheca_characters WHERE id=?',
+                     (character,)).fetchone()
+    assert row[0] is None and row[1] == preview
+    if server.SEARCH_AVAILABLE:
+        assert client.get('/search?q=vecchio').get_json()['characters'] == []
@@ -0,0 +1,72 @@
+import os
+import sqlite3
+
+
+def test_backup_files_are_not_served_as_assets(server, client):
+    r = client.post('/admin/backups', json={'label': 'test'})
+    assert r.status_code == 200
+    name = r.get_json()['file']
+    assert os.path.isfile(os.path.join(server._backup_dir(), name))
+    assert client.get(f'/profile_image/backups/{name}').status_code == 404
+    assert client.get('/profile_image/timbracart.db').status_code == 404
+
+
+def test_assets_are_still_served(server, client):
+    os.makedirs(server.ASSETS_DIR, exist_ok=True)
+    with open(os.path.join(server.ASSETS_DIR, 'logo.png'), 'wb') as f:
+        f.write(b'png')
+    assert client.get('/profile_image/assets/logo.png').data == b'png'
+
+
+def test_symlink_out_of_assets_is_refused(server, client):
+    os.makedirs(server.ASSETS_DIR, exist_ok=True)
+    os.symlink(server.DB_PATH, os.path.join(server.ASSETS_DIR, 'db.png'))
+    assert client.get('/profile_image/assets/db.png').status_code == 404
+
+
+def test_backup_is_a_verified_copy_with_its_archive(server, db, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, 'ARCHIVE_DB_PATH', str(tmp_path / 'archivio.db'))
+    db.execute("INSERT INTO work_logs (user_id, date, hours, reason) VALUES (1, '2000-01-01', 3, 'vecchio')")
+    db.execute("INSERT INTO work_logs (user_id, date, hours, reason) VALUES (1, '2999-01-01', 2, 'nuovo')")
+    db.commit()
+    server.archive_old_logs(30)
+
+    info = server.backup_database(label='test')
+    assert info['integrity'] == 'ok'
+    copy = sqlite3.connect(info['path'])
+    assert copy.execute('SELECT reason FROM work_logs').fetchall() == [('nuovo',)]
+    copy.close()
+    archive_copy = sqlite3.connect(server._backup_companion(info['path']))
+    assert archive_copy.execute('SELECT reason FROM work_logs').fetchall() == [('vecchio',)]
+    archive_copy.close()
+    assert not [n for n in os.listdir(server._backup_dir()) if n.endswith('.tmp')]
+
+
+def test_second_backup_while_one_runs_is_409(server, client):
+    assert server._backup_lock.acquire(blocking=False)
+    try:
+        assert client.post('/admin/backups').status_code == 409
+    finally:
+        server._backup_lock.release()
+
+
+def test_retention_keeps_the_newest_backups(server):
+    dest = server._backup_dir()
+    os.makedirs(dest)
+    for day in range(1, 5):
+        open(os.path.join(dest, f'timbracart_2026010{day}_000000.db'), 'wb').close()
+    open(os.path.join(dest, 'timbracart_20260101_000000.archive.db'), 'wb').close()
+    assert server.prune_backups(keep=2) == ['timbracart_20260102_000000.db', 'timbracart_20260101_000000.db']
+    assert sorted(os.listdir(dest)) == ['timbracart_20260103_000000.db', 'timbracart_20260104_000000.db']
+
+
+def test_scheduled_backup_skips_when_the_last_one_is_recent(server):
+    assert server.scheduled_backup() is not None
+    assert server.scheduled_backup() is None
+    assert len(server.list_backups()) == 1
+
+
+def test_verify_backup_reports_a_damaged_copy(server, tmp_path):
+    bad = tmp_path / 'rotto.db'
+    bad.write_bytes(b'non un database' * 100)
+    assert server.verify_backup(str(bad))
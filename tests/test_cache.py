@@ -0,0 +1,51 @@
+def _x_cache(client, path, **kwargs):
+    r = client.get(path, **kwargs)
+    r.data
+    r.close()
+    return r.headers.get('X-Cache')
+
+
+def test_writes_invalidate_only_their_tags(client):
+    assert _x_cache(client, '/get_all_users') == 'MISS'
+    assert _x_cache(client, '/get_all_users') == 'HIT'
+    assert _x_cache(client, '/admin/users_hours') == 'MISS'
+    assert _x_cache(client, '/admin/users_hours') == 'HIT'
+
+    r = client.post('/add_hours', json={'user_id': 1, 'hours': 2, 'reason': 'x'})
+    assert r.status_code == 200
+    assert _x_cache(client, '/admin/users_hours') == 'MISS'  # tag work_logs
+    assert _x_cache(client, '/get_all_users') == 'HIT'       # solo tag users
+
+
+def test_invalidated_response_reflects_the_write(client):
+    before = {u['id']: u['total_hours'] for u in client.get('/admin/users_hours').get_json()}
+    client.post('/add_hours', json={'user_id': 1, 'hours': 2, 'reason': 'x'})
+    after = {u['id']: u['total_hours'] for u in client.get('/admin/users_hours').get_json()}
+    assert after[1] == before[1] + 2
+
+
+def test_query_string_and_format_are_part_of_the_key(client):
+    assert _x_cache(client, '/bacheca/characters?user_id=1') == 'MISS'
+    assert _x_cache(client, '/bacheca/characters?user_id=2') == 'MISS'
+    assert _x_cache(client, '/bacheca/characters?user_id=1',
+                    headers={'Accept': 'application/x-ndjson'}) == 'MISS'
+    # La risposta NDJSON in streaming entra in cache una volta letta fino in fondo
+    assert _x_cache(client, '/bacheca/characters?user_id=1',
+                    headers={'Accept': 'application/x-ndjson'}) == 'HIT'
+
+
+def test_put_computed_before_an_invalidation_is_discarded(server):
+    cache = server.ResponseCache()
+    generation = cache.generation
+    cache.invalidate('users')
+    assert cache.put(('/r', (), (), 'json'), b'{}', 'application/json', ('users',), 60, generation) is None
+    assert cache.get(('/r', (), (), 'json')) is None
+
+
+def test_cache_evicts_beyond_max_entries(server):
+    cache = server.ResponseCache(max_entries=2)
+    for i in range(3):
+        cache.put((f'/r{i}', (), (), 'json'), b'{}', 'application/json', ('users',), 60, cache.generation)
+    assert cache.get(('/r0', (), (), 'json')) is None
+    assert cache.get(('/r2', (), (), 'json')) is not None
+    assert cache.stats['evictions'] == 1
@@ -0,0 +1,31 @@
+import gzip
+
+import pytest
+
+
+def test_script_preview_revalidates_with_compressed_etag(client, db):
+    html = '<p>' + 'battuta di prova ' * 200 + '</p>'
+    db.execute("INSERT INTO bacheca_characters (character_name, role, script_path, script_preview_html) "
+               "VALUES ('A', 'R', 'assets/copione.docx', ?)", (html,))
+    db.commit()
+    headers = {'Accept-Encoding': 'gzip'}
+
+    first = client.get('/bacheca/character/1/script_preview', headers=headers)
+    assert first.status_code == 200
+    assert first.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(first.data).decode() == html
+    etag = first.headers['ETag']
+    assert etag.endswith('-gzip"')
+
+    again = client.get('/bacheca/character/1/script_preview', headers=dict(headers, **{'If-None-Match': etag}))
+    assert again.status_code == 304
+    assert again.headers['ETag'] == etag
+    assert again.data == b''
+
+
+def test_brotli_request_body_is_bounded(client, server):
+    brotli = pytest.importorskip('brotli')
+    bomb = brotli.compress(b'\0' * (server.MAX_DECOMPRESSED_BODY + 1024 * 1024))
+    r = client.post('/add_hours', data=bomb, content_type='application/json',
+                    headers={'Content-Encoding': 'br'})
+    assert r.status_code == 413
@@ -0,0 +1,27 @@
+import csv
+import io
+import zipfile
+
+
+def test_export_neutralises_formulas(client, db):
+    db.execute("INSERT INTO users (name, surname, email, password, code, role) "
+               "VALUES ('+39 333', '@Rossi', '-mail@x.it', 'x', 'USR1', 'user')")
+    uid = db.execute("SELECT id FROM users WHERE code='USR1'").fetchone()[0]
+    db.executemany("INSERT INTO work_logs (user_id, date, hours, reason) VALUES (?, ?, ?, ?)", [
+        (uid, '2026-01-05 09:00:00', -1.5, '=HYPERLINK("http://x","clic")'),
+        (uid, '2026-01-06 09:00:00', 2, '\tcmd')])
+    db.commit()
+
+    r = client.get(f'/admin/export/work_logs?from=2026-01-01&to=2026-01-31&user_id={uid}')
+    assert r.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(r.data.decode('utf-8-sig'))))
+    assert [row['Motivo'] for row in rows] == ['\'=HYPERLINK("http://x","clic")', "'\tcmd"]
+    assert rows[0]['Nome'] == "'+39 333"
+    assert rows[0]['Cognome'] == "'@Rossi"
+    assert rows[0]['Email'] == "'-mail@x.it"
+    assert rows[0]['Ore'] == '-1.5'  # i numeri negativi restano numeri
+
+    r = client.get(f'/admin/export/work_logs?from=2026-01-01&to=2026-01-31&user_id={uid}&format=xlsx')
+    sheet = zipfile.ZipFile(io.BytesIO(r.data)).read('xl/worksheets/sheet1.xml').decode()
+    assert '<f>' not in sheet
+    assert '<is><t xml:space="preserve">=HYPERLINK(' in sheet
@@ -0,0 +1,108 @@
+import threading
+import time
+
+
+def _add(client, key, hours=2):
+    return client.post('/add_hours', json={'user_id': 1, 'hours': hours, 'reason': 'turno'},
+                       headers={'Idempotency-Key': key})
+
+
+def _keys(db):
+    return [r[0] for r in db.execute('SELECT key FROM idempotency_keys')]
+
+
+def test_repeat_replays_the_stored_response(client, db):
+    first = _add(client, 'k1')
+    again = _add(client, 'k1')
+    assert first.status_code == again.status_code == 200
+    assert again.get_json() == first.get_json()
+    assert again.headers['Idempotent-Replayed'] == 'true'
+    assert db.execute('SELECT COUNT(*) FROM work_logs').fetchone()[0] == 1
+    assert _add(client, 'k1', hours=3).status_code == 422
+
+
+def test_key_and_write_share_one_writer_operation(client, server):
+    writer = server._db_writer
+    _add(client, 'warmup')
+    operations = writer.operations
+    assert _add(client, 'k2').status_code == 200
+    assert writer.operations == operations + 1
+    assert _add(client, 'k2').status_code == 200
+    assert writer.operations == operations + 2  # la ripetizione legge il risultato, non scrive
+
+
+def test_routes_outside_the_allowlist_ignore_the_key(client, db):
+    r = client.post('/login', json={'code': 'ADMIN001', 'password': 'Angelo282008'},
+                    headers={'Idempotency-Key': 'login'})
+    assert r.status_code == 200
+    r = client.post('/kiosk/scan', json={'code': 'ADMIN001'}, headers={'Idempotency-Key': 'scan'})
+    assert r.status_code == 200
+    assert _keys(db) == []
+
+
+def test_failed_write_keeps_the_key_free(client, db):
+    body = {'work_log_id': 1, 'requester_id': 1, 'reason': 'errore'}
+    r = client.post('/request_removal', json=body, headers={'Idempotency-Key': 'k3'})
+    assert r.status_code == 404
+    assert _keys(db) == []
+    db.execute("INSERT INTO work_logs (id, user_id, date, hours, reason) VALUES (1, 1, '2026-01-01', 1, 'x')")
+    db.commit()
+    r = client.post('/request_removal', json=body, headers={'Idempotency-Key': 'k3'})
+    assert r.status_code == 200
+    assert 'Idempotent-Replayed' not in r.headers
+
+
+def test_batch_decisions_replay_instead_of_conflicting(client, db):
+    db.execute("INSERT INTO work_logs (id, user_id, date, hours, reason) VALUES (1, 1, '2026-01-01', 4, 'x')")
+    db.execute("INSERT INTO removal_requests (id, work_log_id, requester_id, status) VALUES (1, 1, 1, 'pending')")
+    db.commit()
+    body = {'admin_id': 1, 'decisions': [{'request_id': 1, 'action': 'rejected', 'hours': 3}]}
+    first = client.post('/admin/handle_removal_batch', json=body, headers={'Idempotency-Key': 'k4'})
+    again = client.post('/admin/handle_removal_batch', json=body, headers={'Idempotency-Key': 'k4'})
+    assert first.status_code == again.status_code == 200
+    assert again.get_json() == first.get_json()
+    assert client.post('/admin/handle_removal_batch', json=body).status_code == 409
+
+
+def test_concurrent_duplicates_write_once(client, server, db):
+    started, release = threading.Event(), threading.Event()
+    server._db_writer.submit(lambda c: started.set() or release.wait(10))
+    assert started.wait(5)
+    responses = []
+    threads = [threading.Thread(target=lambda: responses.append(_add(server.app.test_client(), 'k5')))
+               for _ in range(2)]
+    for t in threads:
+        t.start()
+    for _ in range(500):  # entrambe accodate dietro l'operazione che blocca lo scrittore
+        if server._db_writer.queue.qsize() >= 2:
+            break
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join(10)
+    assert [r.status_code for r in responses] == [200, 200]
+    assert sorted(r.headers.get('Idempotent-Replayed', '') for r in responses) == ['', 'true']
+    assert db.execute('SELECT COUNT(*) FROM work_logs').fetchone()[0] == 1
+
+
+def test_old_key_table_is_replaced(server, db):
+    db.execute('DROP TABLE idempotency_keys')
+    db.execute('CREATE TABLE idempotency_keys (key TEXT PRIMARY KEY, fingerprint TEXT, status INTEGER, '
+               'body BLOB, mimetype TEXT, created_at REAL)')
+    db.commit()
+    server.init_db_idempotency(db)
+    cols = [r[1] for r in db.execute('PRAGMA table_info(idempotency_keys)')]
+    assert 'result' in cols and 'body' not in cols
+
+
+def test_multipart_create_replay_keeps_one_reference(client, db):
+    boundary = 'confine'
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="character_name"\r\n\r\nA\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="role"\r\n\r\nR\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="image_file"; filename="a.png"\r\n'
+            f'Content-Type: image/png\r\n\r\npng\r\n--{boundary}--\r\n').encode()
+    ids = [client.post('/bacheca/character', data=body, content_type=f'multipart/form-data; boundary={boundary}',
+                       headers={'Idempotency-Key': 'k6'}).get_json()['id'] for _ in range(2)]
+    assert ids[0] == ids[1]
+    assert db.execute('SELECT COUNT(*) FROM bacheca_characters').fetchone()[0] == 1
+    assert [r[0] for r in db.execute('SELECT refcount FROM asset_blobs')] == [1]
@@ -0,0 +1,50 @@
+import pytest
+
+
+def _scan(client, code):
+    return client.post('/kiosk/scan', json={'code': code, 'terminal': 'ingresso'})
+
+
+def test_scans_alternate_in_and_out_with_debounce(server, client, db, monkeypatch):
+    first = _scan(client, 'ADMIN001').get_json()
+    assert (first['kind'], first['duplicate']) == ('in', False)
+    assert _scan(client, 'ADMIN001').get_json()['duplicate'] is True
+
+    monkeypatch.setattr(server, 'KIOSK_DEBOUNCE', -1)
+    out = _scan(client, 'ADMIN001').get_json()
+    assert (out['kind'], out['duplicate']) == ('out', False)
+    assert db.execute("SELECT COUNT(*) FROM work_logs WHERE reason=?", (server.KIOSK_LOG_REASON,)).fetchone()[0] == 1
+
+
+def test_known_codes_are_served_from_memory(server, client, monkeypatch):
+    server._user_codes.load()
+    hits = server._user_codes.hits
+
+    def no_db():
+        raise AssertionError('lettura dal database')
+    monkeypatch.setattr(server._user_codes, 'load', no_db)
+    assert server._user_codes.get('ADMIN001')['role'] == 'admin'
+    assert server._user_codes.hits == hits + 1
+
+
+def test_registered_user_can_scan_immediately(client):
+    assert _scan(client, 'USR0').status_code == 404
+    code = client.post('/register', json={'name': 'N', 'surname': 'S', 'email': 'n@s.it',
+                                          'password': 'p'}).get_json()['code']
+    r = _scan(client, code)
+    assert r.status_code == 200
+    assert r.get_json()['name'] == 'N'
+
+
+def test_cache_reloads_after_ttl(server, db, monkeypatch):
+    server._user_codes.load()
+    db.execute("UPDATE users SET name='Nuovo' WHERE code='ADMIN001'")
+    db.commit()
+    assert server._user_codes.get('ADMIN001')['name'] != 'Nuovo'
+    monkeypatch.setattr(server, 'KIOSK_CODE_CACHE_TTL', -1)
+    assert server._user_codes.get('ADMIN001')['name'] == 'Nuovo'
+
+
+@pytest.mark.parametrize('body', [{}, {'code': ''}, {'code': '   '}])
+def test_missing_code_is_400(client, body):
+    assert client.post('/kiosk/scan', json=body).status_code == 400
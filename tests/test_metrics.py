@@ -0,0 +1,50 @@
+import gzip
+import json
+
+
+def _call(client, path, **kwargs):
+    r = client.open(path, **kwargs)
+    data = r.data
+    r.close()  # le metriche si chiudono a fine trasferimento
+    return r, data
+
+
+def test_metrics_count_wire_bytes(client, server):
+    m = server.METRICS
+    for _ in range(100):
+        _call(client, '/add_hours', method='POST',
+              json={'user_id': 1, 'hours': 1, 'date': '2026-01-01', 'reason': 'riunione settimanale'})
+    key = ('/get_logs/<int:user_id>', 'GET')
+    before = m.response_bytes.get(key, 0)
+    r, data = _call(client, '/get_logs/1', headers={'Accept-Encoding': 'gzip'})
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert m.response_bytes[key] - before == len(data)
+
+    body = gzip.compress(json.dumps({'user_id': 1, 'hours': 1, 'reason': 'x' * 5000}).encode())
+    key = ('/add_hours', 'POST')
+    before = m.request_bytes.get(key, 0)
+    r, _ = _call(client, '/add_hours', method='POST', data=body, content_type='application/json',
+                 headers={'Content-Encoding': 'gzip'})
+    assert r.status_code == 200
+    assert m.request_bytes[key] - before == len(body)
+
+
+def test_metrics_count_requests_rejected_before_the_view(client, server):
+    key = ('/add_hours', 'POST', 415)
+    before = server.METRICS.requests.get(key, 0)
+    r, _ = _call(client, '/add_hours', method='POST', data=b'xx', content_type='application/json',
+                 headers={'Content-Encoding': 'zstd'})
+    assert r.status_code == 415
+    assert server.METRICS.requests[key] == before + 1
+
+
+def test_writes_on_the_writer_thread_count_as_request_db_time(client, server):
+    key = ('/add_hours', 'POST')
+    m = server.METRICS
+    queries = m.db_queries.get(key, 0)
+    hist = m.db_time.get(key)
+    seconds = hist.sum if hist else 0.0
+    r, _ = _call(client, '/add_hours', method='POST', json={'user_id': 1, 'hours': 1, 'reason': 'x'})
+    assert r.status_code == 200
+    assert m.db_queries[key] > queries
+    assert m.db_time[key].sum > seconds
@@ -0,0 +1,49 @@
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def limited(server, monkeypatch):
+    monkeypatch.setattr(server, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setattr(server, '_rate_limiter', server.TokenBucketLimiter())
+    monkeypatch.setitem(server.RATE_LIMITS, '/admin/cache', (0.01, 2))
+    return server
+
+
+def test_bucket_allows_the_burst_then_answers_429(limited, client):
+    statuses = [client.get('/admin/cache').status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+    r = client.get('/admin/cache')
+    assert int(r.headers['Retry-After']) >= 1
+    # Bucket distinti per client
+    assert client.get('/admin/cache', environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code == 200
+
+
+def test_unlimited_routes_are_never_rejected(limited, client):
+    for _ in range(5):
+        assert client.get('/metrics').status_code == 200
+
+
+def test_limiter_keeps_at_most_max_buckets(server):
+    limiter = server.TokenBucketLimiter(max_buckets=2)
+    for client_id in ('a', 'b', 'c'):
+        assert limiter.acquire(client_id, '/search') == 0
+    assert len(limiter) == 2
+
+
+def test_full_route_slots_shed_with_503_and_are_released(limited, client, monkeypatch):
+    slot = threading.BoundedSemaphore(1)
+    monkeypatch.setitem(limited._route_slots, '/admin/archive', slot)
+    slot.acquire()
+    r = client.get('/admin/archive')
+    assert r.status_code == 503
+    assert r.headers['Retry-After']
+    slot.release()
+
+    r = client.get('/admin/archive')
+    assert r.status_code == 200
+    r.close()
+    # Lo slot torna libero a fine risposta
+    assert slot.acquire(blocking=False)
+    slot.release()
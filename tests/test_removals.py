@@ -0,0 +1,41 @@
+import pytest
+
+
+@pytest.fixture
+def pending(client):
+    """Un log di 3 ore con una richiesta di rimozione in attesa: ritorna (log_id, request_id)"""
+    log_id = client.post('/add_hours', json={'user_id': 1, 'hours': 3, 'reason': 'turno'}).get_json()['id']
+    req_id = client.post('/request_removal', json={'work_log_id': log_id, 'requester_id': 1,
+                                                   'reason': 'errore'}).get_json()['id']
+    return log_id, req_id
+
+
+def _log_hours(db, log_id):
+    r = db.execute('SELECT hours FROM work_logs WHERE id=?', (log_id,)).fetchone()
+    return r[0] if r else None
+
+
+def test_decided_request_cannot_be_decided_again(client, db, pending):
+    log_id, req_id = pending
+    r = client.post('/admin/handle_removal_batch', json={
+        'admin_id': 1, 'decisions': [{'request_id': req_id, 'action': 'rejected', 'hours': 2}]})
+    assert r.status_code == 200
+
+    r = client.post('/admin/handle_removal', json={'request_id': req_id, 'action': 'accepted', 'admin_id': 1})
+    assert r.status_code == 409
+    r = client.post('/admin/handle_removal_batch', json={
+        'admin_id': 1, 'decisions': [{'request_id': req_id, 'action': 'accepted'}]})
+    assert r.status_code == 409
+    assert _log_hours(db, log_id) == 2
+
+
+def test_batch_rejects_duplicate_request_ids(client, db, pending):
+    log_id, req_id = pending
+    r = client.post('/admin/handle_removal_batch', json={'admin_id': 1, 'decisions': [
+        {'request_id': req_id, 'action': 'rejected', 'hours': 1},
+        {'request_id': str(req_id), 'action': 'accepted'}]})
+    assert r.status_code == 400
+    assert r.get_json()['index'] == 1
+    assert _log_hours(db, log_id) == 3
+    status = db.execute('SELECT status FROM removal_requests WHERE id=?', (req_id,)).fetchone()[0]
+    assert status == 'pending'
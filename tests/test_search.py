@@ -0,0 +1,52 @@
+import pytest
+
+import BadgeEmpire
+
+pytestmark = pytest.mark.skipif(not BadgeEmpire.SEARCH_AVAILABLE, reason='SQLite senza FTS5')
+
+
+def _ids(client, q, scope='characters', **params):
+    out = client.get('/search', query_string=dict(q=q, scope=scope, **params)).get_json()
+    return [it['id'] for it in out['characters' if scope == 'characters' else 'logs']]
+
+
+def _integrity(db):
+    for fts in ('characters_fts', 'work_logs_fts'):
+        db.execute(f"INSERT INTO {fts}({fts}, rank) VALUES ('integrity-check', 1)")
+
+
+def test_triggers_follow_insert_update_delete(client, db):
+    cid = client.post('/bacheca/character', data={'character_name': 'Amleto', 'role': 'principe'}).get_json()['id']
+    assert _ids(client, 'amleto') == [cid]
+
+    client.patch(f'/bacheca/character/{cid}', json={'character_name': 'Ofelia'})
+    assert _ids(client, 'amleto') == []
+    assert _ids(client, 'ofelia') == [cid]
+
+    client.delete(f'/bacheca/character/{cid}')
+    assert _ids(client, 'ofelia') == []
+    _integrity(db)
+
+
+def test_log_reasons_are_indexed_per_user(client, db):
+    client.post('/add_hours', json={'user_id': 1, 'hours': 1, 'reason': 'inventario magazzino'})
+    client.post('/add_hours', json={'user_id': 2, 'hours': 1, 'reason': 'inventario cassa'})
+    assert len(_ids(client, 'inventario', scope='logs')) == 2
+    assert len(_ids(client, 'inventario', scope='logs', user_id=2)) == 1
+
+    # Un UPDATE di colonne non indicizzate non tocca l'indice (e non lo corrompe)
+    db.execute('UPDATE work_logs SET hours = 5')
+    db.commit()
+    assert len(_ids(client, 'magazzino', scope='logs')) == 1
+    _integrity(db)
+
+
+def test_index_created_on_an_existing_database_contains_old_rows(server, client, db):
+    db.execute("INSERT INTO work_logs (user_id, date, hours, reason) VALUES (1, '2026-01-01', 1, 'collaudo impianto')")
+    db.execute('DROP TABLE work_logs_fts')
+    for suffix in ('ai', 'ad', 'au'):
+        db.execute(f'DROP TRIGGER work_logs_fts_{suffix}')
+    db.commit()
+    server.init_db_search(db)
+    assert len(_ids(client, 'collaudo', scope='logs')) == 1
+    _integrity(db)
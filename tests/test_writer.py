@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+
+def _block_writer(server):
+    """Occupa il thread scrittore finché l'evento restituito non viene impostato"""
+    started, release = threading.Event(), threading.Event()
+
+    def hold(c):
+        started.set()
+        release.wait(10)
+    server._db_writer.submit(hold)
+    assert started.wait(5)
+    return release
+
+
+def _insert(reason):
+    return lambda c: c.execute("INSERT INTO work_logs (user_id, date, hours, reason) VALUES (1, '2026-01-01', 1, ?)",
+                               (reason,)).lastrowid
+
+
+def test_failing_operation_does_not_roll_back_the_batch(server, db):
+    writer = server._db_writer
+    release = _block_writer(server)
+
+    def boom(c):
+        _insert('annullata')(c)
+        raise ValueError('boom')
+    futures = [writer.submit(_insert('a')), writer.submit(boom), writer.submit(_insert('b'))]
+    transactions = writer.transactions
+    release.set()
+
+    assert futures[0].result(5) and futures[2].result(5)
+    with pytest.raises(ValueError):
+        futures[1].result(5)
+    assert writer.transactions == transactions + 2  # il blocco, poi le tre operazioni in un solo commit
+    reasons = [r[0] for r in db.execute('SELECT reason FROM work_logs ORDER BY id')]
+    assert reasons == ['a', 'b']
+
+
+def test_writer_timeout_is_a_503_and_writes_nothing(server, client, db, monkeypatch):
+    monkeypatch.setattr(server, 'WRITE_TIMEOUT', 0.2)
+    release = _block_writer(server)
+    try:
+        r = client.post('/add_hours', json={'user_id': 1, 'hours': 1, 'reason': 'in ritardo'})
+    finally:
+        release.set()
+    assert r.status_code == 503
+    assert r.headers['Retry-After']
+    server._db_writer.execute(lambda c: None)  # la coda è stata smaltita
+    assert db.execute('SELECT COUNT(*) FROM work_logs').fetchone()[0] == 0